@@ -0,0 +1,7 @@
+"""
+Benchmark suite
+
+Builds synthetic inventory databases and measures the app against them. Run
+it with ``python -m benchmarks --help``; see `benchmarks.loadtest` for the
+options and `benchmarks.fixtures` for the generated data.
+"""
@@ -0,0 +1,140 @@
+"""
+Synthetic benchmark databases
+
+Fixtures are generated from a fixed random seed, so the same size always
+produces the same data, and are cached on disk by name. Every fixture has one
+store, owned by BENCH_USERNAME, holding all items; about a fifth of the items
+are at or below their reorder threshold and a few are out of stock.
+"""
+
+
+import io
+import os
+import random
+import sqlite3
+from PIL import Image
+from werkzeug.security import generate_password_hash
+from inventory.db import DEFAULT_PRAGMAS
+from inventory.images import image_hash, make_renditions
+
+
+FIXTURE_SIZES = {
+    '1k': 1000,
+    '10k': 10000,
+    '100k': 100000,
+}
+
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench-password'
+BENCH_STORE = 'Benchmark Store'
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', 'inventory', 'inventory_schema.sql')
+
+# Distinct images cycled through the items, enough that they are not all one cached blob
+IMAGE_VARIANTS = 16
+
+_WORDS = ('bolt', 'nut', 'washer', 'screw', 'hinge', 'bracket', 'cable', 'clamp', 'filter', 'gasket', 'valve',
+          'spring', 'bearing', 'pulley', 'sensor', 'switch', 'relay', 'fuse', 'lamp', 'panel', 'steel', 'brass',
+          'plastic', 'heavy', 'compact', 'outdoor', 'spare', 'blue', 'red', 'large', 'small', 'kit')
+
+
+def fixture_path(directory, size, images):
+    """
+    Path a fixture is cached at
+
+    Args:
+        directory (str): Fixture directory
+        size (str): Key of FIXTURE_SIZES
+        images (bool): Whether items have images
+
+    Returns:
+        str: Database file path
+    """
+    return os.path.join(directory, f'inventory-{size}{"-images" if images else ""}.db')
+
+
+def _make_images(rng):
+    variants = []
+    for _ in range(IMAGE_VARIANTS):
+        color = tuple(rng.randrange(256) for _ in range(3))
+        img = Image.new('RGB', (800, 600), color)
+        for _ in range(20):
+            x, y = rng.randrange(780), rng.randrange(580)
+            img.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + 20, y + 20))
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=85)
+        data = buf.getvalue()
+        variants.append((data, image_hash(data), make_renditions(data)))
+    return variants
+
+
+def build_fixture(path, items, images=False, seed=1234):
+    """
+    Create a benchmark database
+
+    Args:
+        path (str): Database file to create, replaced if it exists
+        items (int): Number of items
+        images (bool): Give every item one of IMAGE_VARIANTS stored images
+        seed (int): Random seed for the generated data
+
+    Returns:
+        str: The database path
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.create_function('sha256', 1, image_hash, deterministic=True)
+    connection.execute(f"PRAGMA journal_mode = {DEFAULT_PRAGMAS['journal_mode']}")
+    with open(SCHEMA_PATH) as f:
+        connection.executescript(f.read())
+    variants = _make_images(rng) if images else []
+
+    with connection:
+        owner_id = connection.execute('INSERT INTO USERS (username, user_password, store_name) VALUES (?, ?, ?)',
+                                      (BENCH_USERNAME, generate_password_hash(BENCH_PASSWORD),
+                                       BENCH_STORE)).lastrowid
+        for data, variant_hash, variant_renditions in variants:
+            connection.execute('INSERT INTO IMAGES (hash, mime, size, data) VALUES (?, ?, ?, ?)',
+                               (variant_hash, 'image/jpeg', len(data), data))
+            connection.executemany('INSERT INTO IMAGE_RENDITIONS (hash, rendition, mime, data) VALUES (?, ?, ?, ?)',
+                                   [(variant_hash, rendition, mime, rendition_data)
+                                    for rendition, (mime, rendition_data) in variant_renditions.items()])
+        rows = []
+        for index in range(items):
+            threshold = rng.choice((5, 10, 20))
+            # Roughly one item in five is low on stock
+            quantity = rng.randrange(0, threshold + 1) if rng.random() < 0.2 else rng.randrange(threshold + 1, 500)
+            name = f'{rng.choice(_WORDS)} {rng.choice(_WORDS)} {index:06d}'
+            description = ' '.join(rng.choice(_WORDS) for _ in range(rng.randrange(4, 16)))
+            item_image_hash = variants[index % len(variants)][1] if variants else None
+            rows.append((index + 1, name, item_image_hash, description, quantity, round(rng.uniform(0.5, 250), 2),
+                         owner_id, threshold))
+        connection.executemany('INSERT INTO INVENTORY (item_id, name, image_hash, description, quantity, price, '
+                               'owner_id, reorder_threshold) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    connection.execute('ANALYZE')
+    connection.close()
+    return path
+
+
+def ensure_fixture(directory, size, images=False, rebuild=False):
+    """
+    Get a cached fixture, building it first if needed
+
+    Args:
+        directory (str): Fixture directory
+        size (str): Key of FIXTURE_SIZES
+        images (bool): Whether items have images
+        rebuild (bool): Build the fixture again even if it is cached
+
+    Returns:
+        str: Database file path
+    """
+    path = fixture_path(directory, size, images)
+    if rebuild or not os.path.exists(path):
+        build_fixture(path, FIXTURE_SIZES[size], images=images)
+    return path
@@ -0,0 +1,424 @@
+"""
+Load test runner
+
+Runs request scenarios against a fixture database, each with a number of
+concurrent workers, and reports throughput, latency percentiles and peak
+memory as JSON. By default requests go through the Flask test client in this
+process; with --url they are sent over HTTP to a running server instead
+(started on the same fixture, see --print-fixture), and --server-pid adds
+that server's peak RSS to the report.
+
+A result file can be compared with a stored baseline: any scenario whose p95
+latency or throughput is worse than the baseline by more than --tolerance
+is reported and the run exits with status 1.
+
+Examples::
+
+    python -m benchmarks --size 10k --output results.json
+    python -m benchmarks --size 1k --images --scenarios inventory,xlsx_export --requests 50
+    python -m benchmarks --size 10k --baseline baseline.json
+    python -m benchmarks --size 100k --scenarios xml_export,csv_export,ndjson_export --requests 10
+    python -m benchmarks --scenarios upload --requests 40 --concurrency 8 --upload-size 8
+
+The upload scenario adds items with a distinct JPEG of about --upload-size MB
+each, so every request goes through the whole image ingest path.
+"""
+
+
+import argparse
+import http.cookiejar
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from .fixtures import BENCH_PASSWORD, BENCH_USERNAME, FIXTURE_SIZES, ensure_fixture
+
+
+DEFAULT_SCENARIOS = ('login', 'inventory', 'low_stock', 'xml_export', 'xlsx_export', 'add')
+DEFAULT_FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+_names = itertools.count()
+
+
+class TestClientSession:
+    """
+    Logged in session that sends requests through the Flask test client
+
+    Attributes:
+        client (FlaskClient): Test client holding the session cookie
+    """
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, files=None):
+        """
+        Send a request and read the whole response
+
+        Args:
+            method (str): HTTP method
+            path (str): Path with query string
+            data (dict | None): Form fields for POST requests
+            files (dict | None): Field name -> (filename, bytes) uploads, sent as multipart/form-data
+
+        Returns:
+            int: Status code
+        """
+        if files:
+            data = dict(data or {}, **{field: (io.BytesIO(content), filename)
+                                       for field, (filename, content) in files.items()})
+        response = self.client.open(path, method=method, data=data)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+
+class HTTPSession:
+    """
+    Logged in session that sends requests to a running server
+
+    Attributes:
+        base_url (str): Root URL of the server
+    """
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._opener = urllib.request.build_opener(_NoRedirect, urllib.request.HTTPCookieProcessor(
+            http.cookiejar.CookieJar()))
+
+    def request(self, method, path, data=None, files=None):
+        """
+        Send a request and read the whole response
+
+        Args:
+            method (str): HTTP method
+            path (str): Path with query string
+            data (dict | None): Form fields for POST requests
+            files (dict | None): Field name -> (filename, bytes) uploads, sent as multipart/form-data
+
+        Returns:
+            int: Status code
+        """
+        headers = {}
+        if files:
+            body, headers['Content-Type'] = _multipart(data or {}, files)
+        else:
+            body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers)
+        try:
+            with self._opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+
+def _multipart(data, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in data.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Redirects are answers in their own right here, following them would time two requests
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def _login(session):
+    return session.request('POST', '/login', {'username': BENCH_USERNAME, 'user_password': BENCH_PASSWORD})
+
+
+def _add(session):
+    return session.request('POST', '/add', {'name': f'bench item {os.getpid()}-{next(_names)}',
+                                            'description': 'added by the benchmark', 'quantity': '5',
+                                            'price': '1.50', 'reorder_threshold': '3'})
+
+
+# Size of the images sent by the upload scenario, in MB, set from --upload-size
+upload_megabytes = 4
+_upload_image = None
+_upload_lock = threading.Lock()
+
+
+def _upload(session):
+    global _upload_image
+    with _upload_lock:
+        if _upload_image is None:
+            from PIL import Image
+            # Noise barely compresses, so the JPEG comes out close to the requested size
+            side = int((upload_megabytes * 1024 * 1024 / 1.5) ** 0.5)
+            buffer = io.BytesIO()
+            Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(buffer, 'JPEG', quality=95)
+            _upload_image = buffer.getvalue()
+    name = f'bench upload {os.getpid()}-{next(_names)}'
+    # Bytes after the JPEG end marker are ignored by decoders but give every upload its own hash
+    return session.request('POST', '/add', {'name': name, 'description': 'uploaded by the benchmark',
+                                            'quantity': '5', 'price': '1.50'},
+                           files={'image': ('upload.jpg', _upload_image + name.encode())})
+
+
+# Scenario name -> function sending one request with a logged in session
+SCENARIOS = {
+    'login': _login,
+    'inventory': lambda session: session.request('GET', '/inventory'),
+    'low_stock': lambda session: session.request('GET', '/low-stock'),
+    'xml_export': lambda session: session.request('GET', '/xml-export?mode=direct'),
+    'xlsx_export': lambda session: session.request('GET', '/xlsx-export?mode=direct'),
+    'csv_export': lambda session: session.request('GET', '/csv-export'),
+    'ndjson_export': lambda session: session.request('GET', '/ndjson-export?images=url'),
+    'add': _add,
+    'upload': _upload,
+}
+
+
+def peak_rss_kib(pid=None):
+    """
+    Peak resident set size of this process or another one
+
+    Args:
+        pid (int | None): Process to inspect, this one by default
+
+    Returns:
+        int | None: Peak RSS in KiB, or None if it cannot be read
+    """
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        return peak // 1024 if sys.platform == 'darwin' else peak
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of sorted values
+
+    Args:
+        sorted_values (list): Values in ascending order
+        fraction (float): Percentile as a fraction, 0.95 for p95
+
+    Returns:
+        float | None: The percentile, or None for an empty list
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * fraction // 1))
+    return sorted_values[int(rank) - 1]
+
+
+def run_scenario(make_session, scenario, requests, concurrency):
+    """
+    Send a scenario's requests from concurrent workers and measure them
+
+    Every worker logs in with its own session first; logins are not timed
+    except in the login scenario itself.
+
+    Args:
+        make_session (callable): Returns a new, logged out session
+        scenario (str): Key of SCENARIOS
+        requests (int): Total number of requests
+        concurrency (int): Number of workers sending requests at the same time
+
+    Returns:
+        dict: requests, errors, seconds, throughput and p50/p95/p99/max latency in milliseconds
+    """
+    send = SCENARIOS[scenario]
+    sessions = []
+    for _ in range(concurrency):
+        session = make_session()
+        _login(session)
+        sessions.append(session)
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = itertools.count()
+    start_barrier = threading.Barrier(concurrency + 1)
+
+    def worker(session):
+        start_barrier.wait()
+        while next(counter) < requests:
+            start = time.perf_counter()
+            try:
+                status = send(session)
+            except Exception as error:
+                status = repr(error)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not isinstance(status, int) or status >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    to_ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_samples': [str(error) for error in errors[:5]],
+        'concurrency': concurrency,
+        'seconds': round(seconds, 3),
+        'throughput': round(len(latencies) / seconds, 2) if seconds else None,
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p95_ms': to_ms(percentile(latencies, 0.95)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'max_ms': to_ms(latencies[-1] if latencies else None),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find scenarios that got slower than a baseline run
+
+    Args:
+        results (dict): Report from this run
+        baseline (dict): Report from the baseline run
+        tolerance (float): Allowed relative slowdown, 0.2 for 20%
+
+    Returns:
+        list: Messages describing each regression
+    """
+    regressions = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        if previous.get('p95_ms') and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if previous.get('throughput') and current['throughput'] < previous['throughput'] / (1 + tolerance):
+            regressions.append(f"{scenario}: throughput {previous['throughput']}/s -> {current['throughput']}/s")
+    return regressions
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmark the inventory app')
+    parser.add_argument('--size', choices=list(FIXTURE_SIZES), default='1k', help='Fixture size')
+    parser.add_argument('--images', action='store_true', help='Use a fixture whose items have images')
+    parser.add_argument('--fixture-dir', default=DEFAULT_FIXTURE_DIR, help='Where fixtures are cached')
+    parser.add_argument('--rebuild-fixture', action='store_true', help='Build the fixture again')
+    parser.add_argument('--print-fixture', action='store_true',
+                        help='Build the fixture, print its path and exit, for starting a server on it')
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS),
+                        help=f'Comma separated scenarios out of {", ".join(SCENARIOS)}')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent workers per scenario')
+    parser.add_argument('--upload-size', type=float, default=4, help='Size of the upload scenario\'s images in MB')
+    parser.add_argument('--url', help='Send requests to a running server instead of the test client')
+    parser.add_argument('--server-pid', type=int, help='PID of the server, to report its peak RSS')
+    parser.add_argument('--output', help='Write the JSON report to this file as well as stdout')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown')
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+    return args
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    Args:
+        argv (list | None): Arguments, sys.argv by default
+
+    Returns:
+        int: Exit status
+    """
+    args = _parse_args(argv)
+    global upload_megabytes
+    upload_megabytes = args.upload_size
+    database = ensure_fixture(args.fixture_dir, args.size, images=args.images, rebuild=args.rebuild_fixture)
+    if args.print_fixture:
+        print(os.path.abspath(database))
+        return 0
+
+    if args.url:
+        make_session = lambda: HTTPSession(args.url)
+    else:
+        # The test client writes to the fixture, so run against a copy and keep the fixture pristine
+        work_copy = database + '.run'
+        source = sqlite3.connect(database)
+        target = sqlite3.connect(work_copy)
+        source.backup(target)
+        source.close()
+        target.close()
+        from inventory import create_app, init_database
+        from inventory.db import close_pools
+        app = create_app({'DATABASE': work_copy})
+        init_database(app)
+        make_session = lambda: TestClientSession(app)
+
+    report = {
+        'meta': {
+            'fixture': os.path.basename(database),
+            'items': FIXTURE_SIZES[args.size],
+            'images': args.images,
+            'target': args.url or 'test-client',
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'scenarios': {},
+    }
+    for scenario in args.scenarios:
+        result = run_scenario(make_session, scenario, args.requests, args.concurrency)
+        result['client_peak_rss_kib'] = peak_rss_kib()
+        if args.server_pid:
+            result['server_peak_rss_kib'] = peak_rss_kib(args.server_pid)
+        report['scenarios'][scenario] = result
+        print(f"{scenario:12} {result['throughput']:>9}/s  p50 {result['p50_ms']}ms  p95 {result['p95_ms']}ms  "
+              f"p99 {result['p99_ms']}ms  errors {result['errors']}", file=sys.stderr)
+
+    if not args.url:
+        # Close the app's connections before the copy they point at goes
+        close_pools(app)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(work_copy + suffix):
+                os.remove(work_copy + suffix)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f'REGRESSION {message}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
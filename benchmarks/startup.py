@@ -0,0 +1,174 @@
+"""
+Worker startup benchmark
+
+Measures what a fresh server process pays before it answers its first
+request: importing the package, `create_app`, and one login page render.
+Every run is a new interpreter, so nothing is already imported. Runs are
+made with the default app, which leaves openpyxl and Pillow to be imported on
+first use, and with PRELOAD set, which imports them up front like the app did
+before it had a factory; the difference between the two is what lazy imports
+save each worker. Median times, peak RSS and the modules loaded are reported
+as JSON.
+
+Examples::
+
+    python -m benchmarks.startup --runs 10 --output startup.json
+    python -m benchmarks.startup --baseline startup.json
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+MODES = ('lazy', 'preload')
+
+# Modules whose presence after startup shows whether export and image code was loaded
+HEAVY_MODULES = ('openpyxl', 'PIL.Image')
+
+_CHILD = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import inventory
+imported = time.perf_counter()
+app = inventory.create_app({'DATABASE': sys.argv[2], 'PRELOAD': sys.argv[1] == 'preload'})
+created = time.perf_counter()
+response = app.test_client().get('/login')
+response.get_data()
+answered = time.perf_counter()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'status': response.status_code,
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (answered - created) * 1000,
+    'peak_rss_kib': peak // 1024 if sys.platform == 'darwin' else peak,
+    'modules': len(sys.modules),
+    'heavy_modules': [name for name in sys.argv[3:] if name in sys.modules],
+}))
+'''
+
+
+def _run_child(mode, database):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', _CHILD, mode, database, *HEAVY_MODULES], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output)
+    result['process_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def measure(mode, database, runs):
+    """
+    Start fresh processes and summarise their startup
+
+    Args:
+        mode (str): 'lazy' or 'preload'
+        database (str): Initialised database the processes serve
+        runs (int): Number of processes to start
+
+    Returns:
+        dict: Median timings in milliseconds, peak RSS in KiB and the modules loaded
+    """
+    results = [_run_child(mode, database) for _ in range(runs)]
+    summary = {key: round(statistics.median(result[key] for result in results), 2)
+               for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms')}
+    summary['peak_rss_kib'] = int(statistics.median(result['peak_rss_kib'] for result in results))
+    summary['modules'] = results[-1]['modules']
+    summary['heavy_modules'] = results[-1]['heavy_modules']
+    summary['status'] = results[-1]['status']
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """
+    List startup costs that grew compared with a baseline
+
+    Args:
+        results (dict): Current report
+        baseline (dict): Earlier report
+        tolerance (float): Allowed relative increase, e.g. 0.2 for 20%
+
+    Returns:
+        list: Human readable regression descriptions, empty if there are none
+    """
+    regressions = []
+    for mode, current in results['modes'].items():
+        previous = baseline.get('modes', {}).get(mode)
+        if not previous:
+            continue
+        for key in ('process_ms', 'peak_rss_kib'):
+            if previous.get(key) and current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f'{mode}: {key} {previous[key]} -> {current[key]}')
+    return regressions
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.startup',
+                                     description='Benchmark the startup of a server process')
+    parser.add_argument('--runs', type=int, default=5, help='Processes started per mode')
+    parser.add_argument('--output', help='Write the JSON report to this file as well as stdout')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative increase')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    Args:
+        argv (list | None): Arguments, sys.argv by default
+
+    Returns:
+        int: Exit status
+    """
+    args = _parse_args(argv)
+    from inventory import create_app, init_database
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'startup.db')
+        init_database(create_app({'DATABASE': database}))
+        report = {
+            'meta': {
+                'runs': args.runs,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            },
+            'modes': {},
+        }
+        for mode in MODES:
+            result = measure(mode, database, args.runs)
+            report['modes'][mode] = result
+            print(f"{mode:8} process {result['process_ms']}ms  import {result['import_ms']}ms  "
+                  f"create_app {result['create_app_ms']}ms  first request {result['first_request_ms']}ms  "
+                  f"peak RSS {result['peak_rss_kib']} KiB", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f'REGRESSION {message}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
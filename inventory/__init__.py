@@ -2,10 +2,34 @@
 Inventory package initialization.
 
 This file makes the `inventory` folder a Python package. It exposes the
-Flask application instance (`app`) and the `init_database` function for
-use by external tools
+application factory (`create_app`) and the `init_database` function for use
+by external tools and servers, e.g. `flask --app inventory run` or
+`gunicorn --preload 'inventory:create_app()'`
+
+`inventory.app` is an application built with the default settings the first
+time it is used, so `from inventory import app` keeps working for code written
+before the factory. The `inventory.app` module itself is imported with
+`from inventory.app import ...`.
 """
 
-from .app import app, init_database
+import threading
+from .app import create_app, init_database
+
+__all__ = ["create_app", "init_database"]
+
+# Importing the submodule bound its name here, remove it so `app` goes through __getattr__
+del app
+
+_app = None
+_app_lock = threading.Lock()
+
 
-__all__ = ["app", "init_database"]
+def __getattr__(name):
+    global _app
+    if name != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app
@@ -0,0 +1,348 @@
+"""
+Versioned JSON API
+
+Integrations read and change a store's items under /api/v1 without scraping
+pages or downloading exports:
+
+    GET    /api/v1/items                     one page of items, with the inventory listing's parameters
+    GET    /api/v1/items/batch?ids=1,2,3     items by ID
+    GET    /api/v1/items/<item_id>           one item
+    POST   /api/v1/items                     create a batch, {"items": [{...}, ...]}
+    PATCH  /api/v1/items                     update a batch, {"items": [{"item_id": 1, ...}, ...]}
+    DELETE /api/v1/items?ids=1,2,3           delete a batch
+
+Read requests take 'fields', a comma separated subset of `items.FIELDS`;
+image bytes are only read for 'fields=image'. Requests are authenticated
+with an API token in an `Authorization: Bearer` header instead of a login
+session; tokens are created with the create-api-token command and only
+their SHA-256 is stored. Reads carry a weak ETag of the store's inventory
+version, so an integration polling with If-None-Match gets a 304 after one
+primary key lookup until something changes. Larger responses are gzipped
+for clients that accept it.
+
+Configuration keys (all optional):
+    API_GZIP_MIN_SIZE (int): Smallest response body, in bytes, that is compressed
+    API_GZIP_LEVEL (int): zlib compression level of compressed responses
+"""
+
+
+import gzip
+import hashlib
+import secrets
+from functools import wraps
+from flask import Blueprint, current_app, g, jsonify, request
+from werkzeug.exceptions import BadRequest, HTTPException
+from .conditional import conditional_page
+from .db import get_catalog_db, get_db
+from .events import publish_reload
+from .items import DuplicateName, create_items, delete_items, item_columns, parse_fields, parse_ids, \
+    parse_new_items, parse_updates, prepare_images, read_items, serialize_items, update_items
+from .offload import run_cpu
+from .queries import list_items, parse_listing_args
+
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def init_app(app):
+    """
+    Register default API settings and the API routes on a Flask app
+
+    Args:
+        app (Flask): Application to configure
+    """
+    app.config.setdefault('API_GZIP_MIN_SIZE', 1024)
+    app.config.setdefault('API_GZIP_LEVEL', 6)
+    app.register_blueprint(bp)
+
+
+def hash_token(token):
+    """
+    Hash an API token the way it is stored
+
+    Args:
+        token (str): Token as sent by the client
+
+    Returns:
+        str: Hex SHA-256 of the token
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def create_token(connection, user_id, name):
+    """
+    Create an API token for a user
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database holding USERS
+        user_id (int): ID of the user the token acts for
+        name (str): Label to tell the user's tokens apart
+
+    Returns:
+        tuple: (token ID, token), the token cannot be read back later
+    """
+    token = 'inv_' + secrets.token_urlsafe(32)
+    with connection:
+        cursor = connection.execute('INSERT INTO API_TOKENS (user_id, name, token_hash) VALUES (?, ?, ?)',
+                                    (user_id, name, hash_token(token)))
+    return cursor.lastrowid, token
+
+
+def revoke_token(connection, token_id):
+    """
+    Delete an API token
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database holding USERS
+        token_id (int): ID of the token
+
+    Returns:
+        bool: True if the token existed
+    """
+    with connection:
+        return connection.execute('DELETE FROM API_TOKENS WHERE token_id = ?', (token_id,)).rowcount > 0
+
+
+def token_owner(connection, token):
+    """
+    Find the user an API token acts for
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database holding USERS
+        token (str): Token as sent by the client
+
+    Returns:
+        int | None: ID of the user, or None if the token is unknown
+    """
+    row = connection.execute('SELECT user_id FROM API_TOKENS WHERE token_hash = ?', (hash_token(token),)).fetchone()
+    return row[0] if row is not None else None
+
+
+def _error(status, message, **extra):
+    response = jsonify(error=message, **extra)
+    response.status_code = status
+    return response
+
+
+def token_required(view):
+    """
+    Decorate an API view so it needs a valid bearer token
+
+    The ID of the token's user is kept in `g.api_owner_id`.
+
+    Args:
+        view (callable): View function
+
+    Returns:
+        callable: Wrapped view answering 401 without a valid token
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        owner_id = token_owner(get_catalog_db(), token.strip()) if scheme.lower() == 'bearer' and token else None
+        if owner_id is None:
+            response = _error(401, 'a valid API token is required')
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response
+        g.api_owner_id = owner_id
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def api_owner():
+    """
+    ID of the store the current API request acts for
+
+    Returns:
+        int: User ID set by `token_required`
+    """
+    return g.api_owner_id
+
+
+@bp.errorhandler(HTTPException)
+def http_error(error):
+    """
+    Answer errors raised in API views with JSON instead of an HTML page
+
+    Args:
+        error (HTTPException): The error
+
+    Returns:
+        Response: JSON error
+    """
+    response = _error(error.code, error.description)
+    for name, value in error.get_headers():
+        if name.lower() != 'content-type':
+            response.headers[name] = value
+    return response
+
+
+@bp.after_request
+def compress(response):
+    """
+    Gzip large API responses for clients that accept it
+
+    Args:
+        response (Response): Response of an API view
+
+    Returns:
+        Response: The response, compressed if worthwhile
+    """
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or not request.accept_encodings['gzip']):
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config['API_GZIP_MIN_SIZE']:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=current_app.config['API_GZIP_LEVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _fields():
+    try:
+        return parse_fields(request.args.get('fields'))
+    except ValueError as error:
+        raise BadRequest(str(error))
+
+
+def _items_payload():
+    payload = request.get_json(silent=True)
+    return payload.get('items') if isinstance(payload, dict) else payload
+
+
+@bp.route('/items')
+@token_required
+@conditional_page(owner=api_owner)
+def list_store_items():
+    """
+    List one page of the store's items
+
+    Takes the inventory page's query parameters ('limit', 'sort', 'order',
+    the quantity and price ranges and the 'after' cursor) and 'fields'.
+
+    Returns:
+        Response: JSON with the items and the cursor of the next page, or a 304 response
+    """
+    fields = _fields()
+    listing = parse_listing_args(request.args)
+    connection = get_db(api_owner())
+    rows, next_cursor = list_items(connection, api_owner(), columns=item_columns(fields), **listing)
+    return jsonify(items=serialize_items(connection, rows, fields), next_after=next_cursor)
+
+
+@bp.route('/items/batch')
+@token_required
+@conditional_page(owner=api_owner)
+def batch_get_items():
+    """
+    Read many of the store's items by ID
+
+    Returns:
+        Response: JSON with the items in the order of 'ids' and the IDs that were not found
+    """
+    fields = _fields()
+    try:
+        item_ids = parse_ids(request.args.get('ids'))
+    except ValueError as error:
+        return _error(400, str(error))
+    items, missing = read_items(get_db(api_owner()), api_owner(), item_ids, fields)
+    return jsonify(items=items, missing=missing)
+
+
+@bp.route('/items/<int:item_id>')
+@token_required
+@conditional_page(owner=api_owner)
+def get_item(item_id):
+    """
+    Read one of the store's items
+
+    Args:
+        item_id (int): ID of the item
+
+    Returns:
+        Response: JSON of the item, or a 404 error
+    """
+    fields = _fields()
+    items, _ = read_items(get_db(api_owner()), api_owner(), [item_id], fields)
+    if not items:
+        return _error(404, 'item not found')
+    return jsonify(items[0])
+
+
+@bp.route('/items', methods=['POST'])
+@token_required
+def create_store_items():
+    """
+    Create a batch of items
+
+    Returns:
+        Response: 201 with the new items, 400 for a malformed batch or 409 if a name is taken
+    """
+    owner_id = api_owner()
+    connection = get_db(owner_id)
+    try:
+        params = parse_new_items(_items_payload(), owner_id)
+    except ValueError as error:
+        return _error(400, str(error))
+    images = [param['image'] for param in params if param['image']]
+    try:
+        item_ids = create_items(connection, owner_id, params,
+                                run_cpu(prepare_images, connection, images) if images else {})
+    except DuplicateName as error:
+        return _error(409, 'names already in use', names=error.args[0])
+    publish_reload(connection, owner_id)
+    items, _ = read_items(connection, owner_id, item_ids)
+    response = jsonify(items=items)
+    response.status_code = 201
+    return response
+
+
+@bp.route('/items', methods=['PATCH'])
+@token_required
+def update_store_items():
+    """
+    Update a batch of items, changing only the fields each update gives
+
+    Returns:
+        Response: JSON with the updated items, or a 400, 404 or 409 error if nothing was changed
+    """
+    owner_id = api_owner()
+    connection = get_db(owner_id)
+    try:
+        updates = parse_updates(_items_payload(), owner_id)
+    except ValueError as error:
+        return _error(400, str(error))
+    images = [changes['image'] for _, changes in updates if changes.get('image')]
+    try:
+        update_items(connection, owner_id, updates, run_cpu(prepare_images, connection, images) if images else {})
+    except LookupError as error:
+        return _error(404, 'unknown items', item_ids=error.args[0])
+    except DuplicateName as error:
+        return _error(409, 'names already in use', names=error.args[0])
+    publish_reload(connection, owner_id)
+    items, _ = read_items(connection, owner_id, [item_id for item_id, _ in updates])
+    return jsonify(items=items)
+
+
+@bp.route('/items', methods=['DELETE'])
+@token_required
+def delete_store_items():
+    """
+    Delete a batch of items given by 'ids'
+
+    Returns:
+        Response: JSON with the deleted IDs, or a 400 or 404 error if nothing was deleted
+    """
+    owner_id = api_owner()
+    connection = get_db(owner_id)
+    try:
+        item_ids = parse_ids(request.args.get('ids'))
+        delete_items(connection, owner_id, item_ids)
+    except ValueError as error:
+        return _error(400, str(error))
+    except LookupError as error:
+        return _error(404, 'unknown items', item_ids=error.args[0])
+    publish_reload(connection, owner_id)
+    return jsonify(deleted=item_ids)
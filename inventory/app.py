@@ -6,66 +6,256 @@ The application is a web base business inventory management system built with Fl
 Features include:
     User authentication with hashed passwords
     Inventory management with use of database queries (insert, delete, update)
-    Exporting of user items via XML and/or XLSX files
+    Exporting of user items via XML, XLSX, CSV and NDJSON files
     Low/No stock tracking
     Image uploading
 """
 
 
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for
+from flask import Blueprint, Flask, render_template, request, send_file, flash, redirect, url_for, make_response, \
+    Response, stream_with_context, jsonify, current_app
+import importlib
+import secrets
 import sqlite3
 import os
-import base64
-import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
 import io
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-from openpyxl import Workbook
-from openpyxl.drawing.image import Image as XLImage
-from openpyxl.styles import Alignment, PatternFill, Font
-import tempfile
-
-app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), "..", "templates"))
-app.secret_key = os.urandom(12)
+import click
+from . import api, db, events, jobs, metrics, offload, uploads
+from .db import SCHEMA_PATH, get_catalog_db, get_db, store_databases
+from .exports import FEED_IMAGE_MODES, IMAGE_MODES, buffered, export_timestamp, gzipped, iter_inventory_csv, \
+    iter_inventory_ndjson, iter_inventory_xml, parse_since, write_inventory_xlsx
+from .images import image_url, external_image_url, make_renditions, backfill_renditions, RENDITIONS, image_exists, \
+    put_image_stream, scan_upload, collect_garbage, recount_references, image_store_needs_migration, \
+    migrate_image_store
+from .importer import IMPORT_FORMATS, detect_format, import_inventory
+from .cache import TTLCache
+from .conditional import conditional_page
+from .stock import apply_adjustments
+from .summary import get_summary, rebuild_summary, summary_exists, verify_summary
+from .ledger import HISTORY_PAGE_SIZE, MAX_HISTORY_PAGE_SIZE, SNAPSHOT_MIN_ENTRIES, item_history, ledger_exists, \
+    ledger_timestamp, seed_ledger, snapshot_all, stock_as_of
+from .search import SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE, search_items, search_index_exists, rebuild_index
+from .queries import SORT_COLUMNS, list_items, parse_listing_args
+from .offload import run_cpu
+from .events import publish_item_change, publish_reload, read_item, stream_events
+from .jobs import EXPORT_KINDS, enqueue_export, get_job, spool_path, cleanup_expired
+from .shards import split_database
+from .api import create_token, revoke_token
+
+# Items at or below their reorder threshold show up on the low stock page
+DEFAULT_REORDER_THRESHOLD = 10
+
+# Modules only needed by exports, imports and image resizing, imported on first use unless PRELOAD is set
+LAZY_MODULES = ('openpyxl', 'openpyxl.cell', 'openpyxl.drawing.image', 'openpyxl.styles', 'PIL.Image',
+                'PIL.ImageOps')
+
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(__file__), "..", "templates")
+
+bp = Blueprint('main', __name__, cli_group=None)
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
+
+
+def create_app(config=None):
+    """
+    Build and configure the application
+
+    Settings come from INVENTORY_* environment variables, e.g.
+    INVENTORY_DATABASE, INVENTORY_SECRET_KEY or INVENTORY_DB_POOL_SIZE, then
+    from `config`, and every module fills in its defaults for the rest.
+    Without a SECRET_KEY, one is generated once and kept in the instance
+    folder, so all server processes on a host read each other's sessions.
+
+    No database connection or thread is opened here, so the app can be built
+    in a server's master process before it forks its workers. Call
+    `init_database` before serving. With PRELOAD set, the modules in
+    LAZY_MODULES are imported now instead of on first use, for servers that
+    fork workers from a preloaded app and want them to share those pages.
+
+    Args:
+        config (dict | None): Settings that take precedence over the environment
+
+    Returns:
+        Flask: The application
+    """
+    app = Flask(__name__, template_folder=TEMPLATE_FOLDER)
+    app.config.from_prefixed_env('INVENTORY')
+    app.config.from_mapping(config or {})
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = instance_secret_key(app)
+    db.init_app(app)
+    jobs.init_app(app)
+    metrics.init_app(app)
+    offload.init_app(app)
+    events.init_app(app)
+    api.init_app(app)
+    uploads.init_app(app)
+    app.config.setdefault('PRELOAD', False)
+    app.config.setdefault('IMPORT_BATCH_SIZE', 1000)
+    app.config.setdefault('IMAGE_CACHE_MAX_AGE', 31536000)
+    app.config.setdefault('EXPORT_GZIP_LEVEL', 6)
+    app.config.setdefault('USER_CACHE_SIZE', 1024)
+    app.config.setdefault('USER_CACHE_TTL', 300)
+    app.config.setdefault('PAGE_CACHE_SIZE', 256)
+    app.config.setdefault('PAGE_CACHE_TTL', 3600)
+    # Users loaded for a session, so authenticated requests do not query USERS every time. Nothing changes a user
+    # row after registration, login refreshes the entry and the TTL bounds how stale another process's copy gets.
+    app.extensions['user_cache'] = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    # Rendered inventory pages by (owner, inventory version, URL), reused until the inventory changes
+    app.extensions['page_cache'] = TTLCache(maxsize=app.config['PAGE_CACHE_SIZE'],
+                                            ttl=app.config['PAGE_CACHE_TTL'])
+    metrics.register_collector(app, lambda: user_cache_metrics(app))
+    metrics.register_collector(app, lambda: page_cache_metrics(app))
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    if app.config['PRELOAD']:
+        for name in LAZY_MODULES:
+            importlib.import_module(name)
+    return app
+
+
+def instance_secret_key(app):
+    """
+    Read the secret key kept in the instance folder, creating it on first use
+
+    The key is written to a temporary file and linked into place, so server
+    processes starting at the same time all end up with the same key.
+
+    Args:
+        app (Flask): Application whose instance folder holds the key
+
+    Returns:
+        bytes: Secret key
+    """
+    path = os.path.join(app.instance_path, 'secret_key')
+    if not os.path.exists(path):
+        os.makedirs(app.instance_path, exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}'
+        with open(temp_path, 'wb') as f:
+            f.write(secrets.token_bytes(32))
+        os.chmod(temp_path, 0o600)
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def user_cache_metrics(app):
+    """
+    Report the user cache's counters for /metrics
+
+    Args:
+        app (Flask): Application whose cache is reported
+
+    Returns:
+        list: Metrics in the format expected by `metrics.register_collector`
+    """
+    stats = app.extensions['user_cache'].stats()
+    return [
+        ('inventory_user_cache_hits_total', 'counter', 'User lookups answered from the cache', [({}, stats['hits'])]),
+        ('inventory_user_cache_misses_total', 'counter', 'User lookups that queried the database',
+         [({}, stats['misses'])]),
+        ('inventory_user_cache_size', 'gauge', 'Users held in the cache', [({}, stats['size'])]),
+    ]
+
+
+def page_cache_metrics(app):
+    """
+    Report the page cache's counters for /metrics
+
+    Args:
+        app (Flask): Application whose cache is reported
+
+    Returns:
+        list: Metrics in the format expected by `metrics.register_collector`
+    """
+    stats = app.extensions['page_cache'].stats()
+    return [
+        ('inventory_page_cache_hits_total', 'counter', 'Pages served from the cache', [({}, stats['hits'])]),
+        ('inventory_page_cache_misses_total', 'counter', 'Pages that had to be rendered', [({}, stats['misses'])]),
+        ('inventory_page_cache_size', 'gauge', 'Pages held in the cache', [({}, stats['size'])]),
+    ]
 
 
 # Changed to support both databases
-def init_database():
+def init_database(app=None):
     """
     Initialize the database using sql script from 'inventory_schema.sql'
 
-    Function creates user and inventory tables if they have not been created
+    Function creates user and inventory tables if they have not been created.
+    The database file is taken from the app's DATABASE setting, and with
+    sharding every existing store database is brought up to date as well.
+    Items that existed before the search index, the stock ledger or the store
+    summary were added are indexed, given an opening ledger entry and
+    summarised on the first run, and images kept inline in INVENTORY are moved
+    to the image store. Export jobs interrupted by a previous shutdown are
+    marked as failed. The connections used are closed afterwards, so a
+    server can run this before forking its workers.
+
+    Args:
+        app (Flask | None): Application to use, a new one from `create_app` by default
     """
-    with sqlite3.connect(f'inventory.db') as connection:
-        with open(f'inventory_schema.sql') as f:
-            connection.executescript(f.read())
+    app = app or create_app()
+    with app.app_context():
+        upgrade_schema(get_catalog_db())
+        if app.config['SHARD_DIR']:
+            for connection in store_databases():
+                upgrade_schema(connection)
+    db.close_pools(app)
 
 
+def upgrade_schema(connection):
+    """
+    Create missing tables in one database and migrate its existing data
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+    """
+    db.migrate(connection)
+    had_search_index = search_index_exists(connection)
+    had_ledger = ledger_exists(connection)
+    had_summary = summary_exists(connection)
+    with open(SCHEMA_PATH) as f:
+        connection.executescript(f.read())
+    if not had_search_index:
+        rebuild_index(connection)
+    if not had_ledger:
+        seed_ledger(connection)
+    if not had_summary:
+        rebuild_summary(connection)
+    if image_store_needs_migration(connection):
+        migrate_image_store(connection)
+    jobs.fail_interrupted(connection)
+
 
 class User(UserMixin):
     """
     User class for Flask-Login
 
+    The password hash is not kept, it is only needed to check a login.
+
     Attributes:
         id (int): User id from database
         username (str): Username of account
-        user_password (str): User password hashed from database
         store_name (str): Store name of account
     """
-    def __init__(self, user_id, username, user_password, store_name):
+    def __init__(self, user_id, username, store_name):
         self.id = user_id
         self.username = username
-        self.user_password = user_password
         self.store_name = store_name
 
     # Function returns a User class with the values stored in the user database
     @staticmethod
     def get(user_id):
         """
-        Retrieve user from the database using ID
+        Retrieve user using ID, from the user cache when possible
 
         Args:
             user_id (int): ID of user
@@ -73,14 +263,18 @@ class User(UserMixin):
         Returns:
             User | None: An instance of User class if it exists in the database, otherwise None
         """
-        connection = sqlite3.connect('inventory.db')
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        user = cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
-        if user is None:
+        user_cache = current_app.extensions['user_cache']
+        user = user_cache.get(user_id)
+        if user is not None:
+            return user
+        connection = get_catalog_db()
+        row = connection.execute('SELECT user_id, username, store_name FROM users WHERE user_id = ?',
+                                 (user_id,)).fetchone()
+        if row is None:
             return None
-        else:
-            return User(user['user_id'], user['username'], user['user_password'], user['store_name'])
+        user = User(row['user_id'], row['username'], row['store_name'])
+        user_cache.set(user_id, user)
+        return user
 
 
 @login_manager.user_loader
@@ -97,156 +291,76 @@ def load_user(user_id):
     return User.get(int(user_id))
 
 
-@app.route('/home')
+@bp.route('/home')
 def home():
     """
     Display the home page after login.
 
+    Logged in users see a dashboard of their store's totals, read from the
+    store summary row instead of scanning the inventory.
+
     Returns:
         Response: Rendered home template.
         """
-    return render_template('home.html')
-
-
-# Converts a file to binary
-def convert_to_binary(filename):
-    """
-    Converts a file via it's name to binary
-
-    Args:
-         filename (str): Name of the file path to be converted to binary
-
-    Returns:
-        bytes: Binary of the file
-    """
-    with open(filename, 'rb') as f:
-        blob_data = f.read()
-    return blob_data
+    summary = get_summary(get_db(), current_user.id) if current_user.is_authenticated else None
+    return render_template('home.html', summary=summary)
 
 
 # Takes the database table and downloads a xml file to the users computer
-@app.route('/xml-export')
+@bp.route('/xml-export')
 @login_required
+@conditional_page()
 def inventory_to_xml():
     """
     Export the current inventory to an XML file.
 
-    Returns:
-        Response: XML file download
-    """
-    connection = sqlite3.connect('inventory.db')
-    cursor = connection.cursor()
-    cursor.execute('SELECT name, image, description, quantity, price FROM inventory WHERE owner_id = ?',
-                   (current_user.id,))
-    # Stores all the rows of the database
-    rows = cursor.fetchall()
-    connection.close()
-
-    '''
-    Creates a tree and creates a child node (item) for each item and then adds a child node (characteristics [name,
-    image, quantity, etc.]) for each column in a row. The value of the characteristic is stored in the
-    corresponding node
-    '''
-    root = ET.Element('inventory')
-    for row in rows:
-        item_elmt = ET.SubElement(root, 'item')
-        name_elmt = ET.SubElement(item_elmt, 'name')
-        name_elmt.text = row[0]
-        image_elmt = ET.SubElement(item_elmt, 'image')
-        '''
-        Have to check if an image is stored, for this item.
-        If an image is stored then have to convert from binary back into base64 
-        '''
-        if row[1]:
-            image_base64 = base64.b64encode(row[1]).decode('utf-8')
-            image_elmt.text = image_base64
-        else:
-            image_elmt.text = ''
-        description_elmt = ET.SubElement(item_elmt, 'description')
-        description_elmt.text = row[2]
-        quantity_elmt = ET.SubElement(item_elmt, 'quantity')
-        quantity_elmt.text = str(row[3])
-        price_elmt = ET.SubElement(item_elmt, 'price')
-        price_elmt.text = f'{row[4]:.2f}'
+    By default the export runs as a background job and the client is sent to
+    its status page. With 'mode=direct' the file is streamed to the client
+    while the rows are read, so memory use stays flat however large the
+    inventory is. The 'images' query parameter selects 'inline' base64 data
+    (the default), 'url' links to the image route or 'none'. Direct downloads
+    carry a weak ETag of the inventory version, so unchanged files are not
+    sent again.
 
-    # Sets up output file
-    output_xml = io.BytesIO()
-    tree = ET.ElementTree(root)
-    tree.write(output_xml, encoding='utf-8', xml_declaration=True)
-    output_xml.seek(0)
+    Returns:
+        Response: Job status redirect, XML file download or a 304 response
+    """
+    images = request.args.get('images', 'inline')
+    if images not in IMAGE_MODES:
+        return "Unknown image mode", 400
+    if request.args.get('mode') != 'direct':
+        return queue_export('xml', images)
 
-    return send_file(output_xml, mimetype='application/xml', as_attachment=True, download_name='inventory.xml')
+    document = iter_inventory_xml(get_db(), current_user.id, images=images, image_url=external_image_url)
+    return Response(stream_with_context(buffered(document)), mimetype='application/xml',
+                    headers={'Content-Disposition': 'attachment; filename=inventory.xml'})
 
 
-@app.route('/xlsx-export')
+@bp.route('/xlsx-export')
 @login_required
+@conditional_page()
 def inventory_to_xlsx():
     """
     Export the current inventory to an XLSX file
 
+    By default the export runs as a background job and the client is sent to
+    its status page, 'mode=direct' builds the file in the request instead. The
+    'images' query parameter selects embedded thumbnails ('inline', the
+    default), 'url' links to the image route or 'none', which keeps memory use
+    flat for large inventories. Direct downloads carry a weak ETag of the
+    inventory version, like the XML export.
+
     Returns:
-         Response: XLSX file download
-    """
-    connection = sqlite3.connect('inventory.db')
-    cursor = connection.cursor()
-    cursor.execute('SELECT name, image, description, quantity, price FROM inventory WHERE owner_id = ?',
-                   (current_user.id,))
-    rows = cursor.fetchall()
-    connection.close()
-
-    # Create a new Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Inventory"
-
-    # Write headers
-    headers = ["Name", "Image", "Description", "Quantity", "Price"]
-    ws.append(headers)
-
-    # Style headers: bold, white text, blue fill, centered
-    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)
-    for col_num in range(1, len(headers) + 1):
-        cell = ws.cell(row=1, column=col_num)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-    ws.row_dimensions[1].height = 25
-
-    # Adjust column widths
-    ws.column_dimensions["A"].width = 20
-    ws.column_dimensions["B"].width = 15
-    ws.column_dimensions["C"].width = 40
-    ws.column_dimensions["D"].width = 10
-    ws.column_dimensions["E"].width = 10
-
-    row_index = 2
-    for name, image_blob, description, quantity, price in rows:
-        ws.cell(row=row_index, column=1, value=name)
-        ws.cell(row=row_index, column=3, value=description)
-        ws.cell(row=row_index, column=4, value=quantity)
-        ws.cell(row=row_index, column=5, value=f'{price:.2f}')
-
-        # Center all text fields
-        for col_num in [1, 3, 4, 5]:
-            ws.cell(row=row_index, column=col_num).alignment = Alignment(horizontal="center", vertical="center")
-
-        ws.row_dimensions[row_index].height = 60  # for images
-
-        if image_blob:
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-            temp_file.write(image_blob)
-            temp_file.close()
-
-            img = XLImage(temp_file.name)
-            img.height = 60
-            img.width = 60
-            ws.add_image(img, f"B{row_index}")
-
-        row_index += 1
+         Response: Job status redirect, XLSX file download or a 304 response
+    """
+    images = request.args.get('images', 'inline')
+    if images not in IMAGE_MODES:
+        return "Unknown image mode", 400
+    if request.args.get('mode') != 'direct':
+        return queue_export('xlsx', images)
 
     output_xlsx = io.BytesIO()
-    wb.save(output_xlsx)
+    run_cpu(write_inventory_xlsx, get_db(), current_user.id, output_xlsx, images=images, image_url=external_image_url)
     output_xlsx.seek(0)
 
     return send_file(
@@ -257,7 +371,159 @@ def inventory_to_xlsx():
     )
 
 
-@app.route('/add', methods=['GET', 'POST'])
+# Streamed feed -> (row writer, MIME type, file name)
+FEEDS = {
+    'csv': (iter_inventory_csv, 'text/csv', 'inventory.csv'),
+    'ndjson': (iter_inventory_ndjson, 'application/x-ndjson', 'inventory.ndjson'),
+}
+
+
+@bp.route('/csv-export')
+@login_required
+@conditional_page()
+def inventory_to_csv():
+    """
+    Stream the current inventory as a CSV file
+
+    See `stream_feed` for the query parameters.
+
+    Returns:
+        Response: CSV file download, a 400 error or a 304 response
+    """
+    return stream_feed('csv')
+
+
+@bp.route('/ndjson-export')
+@login_required
+@conditional_page()
+def inventory_to_ndjson():
+    """
+    Stream the current inventory as newline delimited JSON, one item per line
+
+    See `stream_feed` for the query parameters.
+
+    Returns:
+        Response: NDJSON file download, a 400 error or a 304 response
+    """
+    return stream_feed('ndjson')
+
+
+def stream_feed(kind):
+    """
+    Stream one of the row feeds for data pipelines
+
+    Rows are written while they are fetched from the database in batches, and
+    gzipped on the fly for clients that accept it, so memory use stays flat
+    however large the store is. Images are left out unless 'images=url' asks
+    for links to the image route. 'since', an ISO 8601 time, limits the
+    export to items changed at or after it; the X-Export-Timestamp header of
+    each response is the 'since' to send next time. Deleted items are not
+    listed, they show up as 'delete' entries in the stock ledger.
+
+    Args:
+        kind (str): Key of FEEDS
+
+    Returns:
+        Response: The streamed file, or a 400 error for an unknown image mode or a malformed 'since'
+    """
+    writer, mimetype, filename = FEEDS[kind]
+    images = request.args.get('images', 'none')
+    if images not in FEED_IMAGE_MODES:
+        return "Unknown image mode", 400
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError as error:
+        return str(error), 400
+
+    connection = get_db()
+    headers = {'Content-Disposition': f'attachment; filename={filename}',
+               'X-Export-Timestamp': export_timestamp(connection)}
+    body = buffered(writer(connection, current_user.id, images=images, image_url=external_image_url, since=since))
+    if request.accept_encodings['gzip']:
+        body = gzipped(body, current_app.config['EXPORT_GZIP_LEVEL'])
+        headers['Content-Encoding'] = 'gzip'
+    response = Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def wants_json():
+    """
+    Check whether the client asked for JSON rather than an HTML page
+
+    Returns:
+        bool: True if the Accept header prefers application/json
+    """
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+
+def queue_export(kind, images):
+    """
+    Start a background export for the current user
+
+    Args:
+        kind (str): 'xml' or 'xlsx'
+        images (str): Image mode passed on to the export writer
+
+    Returns:
+        Response: 202 with the job ID for JSON clients, otherwise a redirect to the status page
+    """
+    job_id = enqueue_export(current_user.id, kind, images, base_url=request.host_url)
+    status_url = url_for('main.export_status', job_id=job_id)
+    if wants_json():
+        response = jsonify(job_id=job_id, status_url=status_url,
+                           download_url=url_for('main.export_download', job_id=job_id))
+        response.status_code = 202
+        response.headers['Location'] = status_url
+        return response
+    return redirect(status_url)
+
+
+@bp.route('/exports/<string:job_id>')
+@login_required
+def export_status(job_id):
+    """
+    Report the progress of an export job
+
+    Args:
+        job_id (str): ID of the job
+
+    Returns:
+        str | Response: Status page, or JSON for clients that accept it
+    """
+    job = get_job(get_db(), job_id, current_user.id)
+    if job is None:
+        return "Export not found", 404
+    if wants_json():
+        return jsonify(job_id=job_id, kind=job['kind'], status=job['status'], progress=job['progress'],
+                       total=job['total'], error=job['error'],
+                       download_url=url_for('main.export_download', job_id=job_id) if job['status'] == 'done' else None)
+    return render_template('export_status.html', job=job)
+
+
+@bp.route('/exports/<string:job_id>/download')
+@login_required
+def export_download(job_id):
+    """
+    Download the file of a finished export job
+
+    Args:
+        job_id (str): ID of the job
+
+    Returns:
+        Response: The exported file, or an error if the job is unknown or not finished
+    """
+    job = get_job(get_db(), job_id, current_user.id)
+    if job is None:
+        return "Export not found", 404
+    if job['status'] != 'done':
+        return "Export is not finished", 409
+    extension, mimetype = EXPORT_KINDS[job['kind']]
+    return send_file(spool_path(current_app, job_id, job['kind']), mimetype=mimetype, as_attachment=True,
+                     download_name=f'inventory.{extension}')
+
+
+@bp.route('/add', methods=['GET', 'POST'])
 @login_required
 def add():
     """
@@ -277,67 +543,210 @@ def add():
         description = request.form['description']
         quantity = int(request.form['quantity'])
         price = float(request.form['price'])
-        #
-        image_blob = None
-
-        if image_file and image_file.filename != '':
-            # Temporarily save the file to read it as binary
-            temp_folder = 'temp'
-            os.makedirs(temp_folder, exist_ok=True)
-
-            temp_path = os.path.join(temp_folder, image_file.filename)
-            image_file.save(temp_path)
-            image_blob = convert_to_binary(temp_path)
-            os.remove(temp_path)
+        reorder_threshold = max(0, request.form.get('reorder_threshold', DEFAULT_REORDER_THRESHOLD, type=int))
+
+        # The upload is read from the request's in-memory buffer straight into the image store
+        image_stream = image_file.stream if image_file and image_file.filename != '' else None
+        upload = None
+        if image_stream is not None:
+            try:
+                with metrics.timed('image_scan'):
+                    upload = scan_upload(image_stream)
+            except ValueError:
+                flash("The image must be a JPEG, PNG, GIF, WebP, BMP or TIFF file.")
+                return render_template("add.html", default_threshold=DEFAULT_REORDER_THRESHOLD), 400
+        connection = get_db()
+        renditions = None
+        # An image that is already stored keeps its renditions, only new images are resized
+        if upload and not image_exists(connection, upload[0]):
+            with metrics.timed('image_renditions'):
+                renditions = run_cpu(make_renditions, image_stream)
         try:
-            with sqlite3.connect('inventory.db') as items:
-                cursor = items.cursor()
-                cursor.execute('INSERT INTO INVENTORY (name, image, description, quantity, price, owner_id) \
-                            VALUES (?, ?, ?, ?, ?, ?)',
-                               (name, image_blob, description, quantity, price, current_user.id))
-                items.commit()
-            return redirect(url_for('home'))
+            with connection:
+                item_image_hash = put_image_stream(connection, image_stream, upload, renditions) if upload else None
+                cursor = connection.execute('INSERT INTO INVENTORY (name, image_hash, description, quantity, price, \
+                            owner_id, reorder_threshold, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)',
+                                            (name, item_image_hash, description, quantity, price, current_user.id,
+                                             reorder_threshold))
+            publish_item_change(connection, None, read_item(connection, current_user.id, item_id=cursor.lastrowid))
+            return redirect(url_for('main.home'))
         except sqlite3.IntegrityError:
             flash("Item already found in inventory. Please change the name.");
-            return render_template("add.html");
+            return render_template("add.html", default_threshold=DEFAULT_REORDER_THRESHOLD);
     else:
-        return render_template('add.html')
+        return render_template('add.html', default_threshold=DEFAULT_REORDER_THRESHOLD)
 
 
-@app.route('/inventory')
+@bp.route('/import', methods=['GET', 'POST'])
 @login_required
+def bulk_import():
+    """
+    Import many items at once from a CSV, XLSX or XML file
+
+    GET:
+        Render the import form
+    POST:
+        Import the uploaded file into the current user's inventory. Items
+        that already exist are updated.
+
+    Returns:
+        str | Response: Rendered form or import report, or the report as JSON for clients that accept it
+    """
+    if request.method == 'GET':
+        return render_template('import.html', formats=IMPORT_FORMATS, report=None)
+
+    # Import files may be much larger than anything else users upload
+    request.max_content_length = current_app.config['IMPORT_MAX_CONTENT_LENGTH']
+    upload = request.files.get('file')
+    if upload is None or upload.filename == '':
+        flash('Choose a file to import.')
+        return render_template('import.html', formats=IMPORT_FORMATS, report=None), 400
+    file_format = request.form.get('format') or detect_format(upload.filename)
+    if file_format not in IMPORT_FORMATS:
+        flash('Unknown file format. Use a .csv, .xlsx or .xml file.')
+        return render_template('import.html', formats=IMPORT_FORMATS, report=None), 400
+
+    report = run_cpu(import_inventory, get_db(), current_user.id, upload.stream, file_format,
+                     batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+    if report.imported:
+        publish_reload(get_db(), current_user.id)
+    if wants_json():
+        return jsonify(report.to_dict())
+    return render_template('import.html', formats=IMPORT_FORMATS, report=report)
+
+
+@bp.route('/items/<int:item_id>/image')
+@login_required
+def item_image(item_id):
+    """
+    Serve the stored image of an item
+
+    The 'size' query parameter picks a rendition ('thumb', 'medium') or the
+    uploaded 'original', which is the default. Responses carry the image hash
+    as a strong ETag and the item's update time as Last-Modified, and
+    conditional requests are answered with a 304 before the BLOB is read.
+
+    Args:
+        item_id (int): ID of the item
+
+    Returns:
+        Response: Image bytes, a 304 response or a 404 error
+    """
+    size = request.args.get('size', 'original')
+    if size != 'original' and size not in RENDITIONS:
+        return "Unknown image size", 404
+
+    connection = get_db()
+    row = connection.execute('SELECT image_hash, updated_at FROM inventory WHERE item_id = ? AND owner_id = ?',
+                             (item_id, current_user.id)).fetchone()
+    if row is None or row['image_hash'] is None:
+        return "Image not found", 404
+    etag = row['image_hash'] if size == 'original' else f"{row['image_hash']}-{size}"
+
+    last_modified = None
+    if row['updated_at']:
+        last_modified = datetime.fromisoformat(row['updated_at']).replace(tzinfo=timezone.utc)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = (last_modified is not None and request.if_modified_since is not None
+                        and last_modified <= request.if_modified_since)
+
+    if not_modified:
+        response = make_response('', 304)
+    else:
+        stored = None
+        if size != 'original':
+            stored = connection.execute('SELECT mime, data FROM image_renditions WHERE hash = ? AND rendition = ?',
+                                        (row['image_hash'], size)).fetchone()
+        if stored is None:
+            # Images Pillow could not read have no renditions, fall back to the original
+            stored = connection.execute('SELECT mime, data FROM images WHERE hash = ?',
+                                        (row['image_hash'],)).fetchone()
+        if stored is None:
+            return "Image not found", 404
+        response = make_response(stored['data'])
+        response.mimetype = stored['mime']
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['IMAGE_CACHE_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+
+@bp.route('/inventory')
+@login_required
+@conditional_page('page_cache')
 def inventory():
     """
-    Display the inventory of the current user
+    Display the inventory of the current user, one page at a time
+
+    Query parameters choose the page size ('limit'), the sort ('sort' by
+    item_id, name, quantity or price and 'order' asc or desc), quantity and
+    price ranges ('min_quantity', 'max_quantity', 'min_price', 'max_price')
+    and the page to continue from ('after', a cursor from the previous page).
+    Pages are cached and revalidated by inventory version.
 
     Returns:
-        str: Render HTML template with current user's items
+        str | Response: Render HTML template with current user's items, or a 304 response
     """
-    connection = sqlite3.connect('inventory.db')
-    cursor = connection.cursor()
-    cursor.execute('SELECT name, image, description, quantity, price FROM inventory WHERE owner_id = ?',
-                   (current_user.id,))
-    rows = cursor.fetchall()
-    connection.close()
+    listing = parse_listing_args(request.args)
+    rows, next_cursor = list_items(get_db(), current_user.id, **listing)
+
+    params = request.args.to_dict()
+    params.pop('after', None)
+    first_url = url_for('main.inventory', **params) if listing['after'] else None
+    next_url = url_for('main.inventory', after=next_cursor, **params) if next_cursor else None
 
     data = []
     for row in rows:
-        name, image_blob, description, quantity, price = row
-        if image_blob:
-            image_base64 = base64.b64encode(image_blob).decode('utf-8')
-            image_uri = f"data:image/jpeg;base64,{image_base64}"
-        else:
-            image_uri = None  # or a default placeholder image path
+        item_id, name, item_image_hash, description, quantity, price = row
+        data.append((name, image_url(item_id, item_image_hash), description, quantity, price,
+                     image_url(item_id, item_image_hash, 'original'), item_id))
+
+    return render_template('inventory.html', data=data, listing=listing, sort_options=list(SORT_COLUMNS),
+                           first_url=first_url, next_url=next_url)
 
-        data.append((name, image_uri, description, quantity, price))
 
-    return render_template('inventory.html', data=data)
+@bp.route('/search')
+@login_required
+def search():
+    """
+    Search the current user's items by name and description
+
+    Every word of the 'q' query parameter is matched as a prefix and the best
+    matches come first. Results are split into pages with 'page' and 'limit'.
+
+    Returns:
+        str | Response: Rendered results page, or JSON for clients that accept it
+    """
+    text = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), MAX_SEARCH_PAGE_SIZE))
+    rows, has_more = search_items(get_db(), current_user.id, text, page=page, limit=limit)
+
+    if wants_json():
+        return jsonify(query=text, page=page, has_more=has_more,
+                       items=[{'item_id': row['item_id'], 'name': row['name'], 'description': row['description'],
+                               'quantity': row['quantity'], 'price': row['price'],
+                               'image_url': image_url(row['item_id'], row['image_hash'])} for row in rows])
+
+    data = []
+    for item_id, name, item_image_hash, description, quantity, price in rows:
+        data.append((name, image_url(item_id, item_image_hash), description, quantity, price,
+                     image_url(item_id, item_image_hash, 'original')))
+    prev_url = url_for('main.search', q=text, page=page - 1, limit=limit) if page > 1 else None
+    next_url = url_for('main.search', q=text, page=page + 1, limit=limit) if has_more else None
+    return render_template('search.html', data=data, query=text, prev_url=prev_url, next_url=next_url)
 
 
 # New main page. Checks user database to see if login information exists.
 # If login information exists moves to the home page and creates a user class
-@app.route('/', methods=['GET', 'POST'])
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     """
     Handle user login
@@ -354,21 +763,33 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         user_password = request.form['user_password']
-        connection = sqlite3.connect('inventory.db')
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        user_row = cursor.execute('SELECT *  FROM USERS WHERE username = ?', (username,)).fetchone()
-        connection.close()
-        if user_row and check_password_hash(user_row['user_password'], user_password):
-            user = User(user_row['user_id'], user_row['username'], user_row['user_password'], user_row['store_name'])
+        connection = get_catalog_db()
+        user_row = connection.execute('SELECT *  FROM USERS WHERE username = ?', (username,)).fetchone()
+        if user_row and run_cpu(check_password_hash, user_row['user_password'], user_password):
+            user = User(user_row['user_id'], user_row['username'], user_row['store_name'])
+            # Logging in refreshes the cached copy with the row just read
+            current_app.extensions['user_cache'].set(user.id, user)
             login_user(user)
-            return redirect(url_for('home'))
+            return redirect(url_for('main.home'))
         else:
             return render_template('login.html')
     return render_template('login.html')
 
 
-@app.route('/logout')
+@bp.route('/cache-stats')
+@login_required
+def cache_stats():
+    """
+    Report hit and miss counters of the in-process caches
+
+    Returns:
+        Response: JSON with the statistics of each cache
+    """
+    return jsonify(users=current_app.extensions['user_cache'].stats(),
+                   pages=current_app.extensions['page_cache'].stats())
+
+
+@bp.route('/logout')
 @login_required
 def logout():
     """
@@ -378,12 +799,12 @@ def logout():
         Response: Redirect to login page
     """
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 
 # Users are able to register new accounts. Usernames have to be unique and passwords are stored as a hashed password.
 # New users are stored in the database and are able to log in.
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     """
     Handle user registration
@@ -402,42 +823,28 @@ def register():
         store_name = request.form['store_name'].strip()
 
         # Always hash once, right before storing
-        hashed_password = generate_password_hash(raw_password)
-
-        # Use a context manager to ensure commit/close happen cleanly
-        with sqlite3.connect('inventory.db') as connection:
-            connection.row_factory = sqlite3.Row
-            cursor = connection.cursor()
+        hashed_password = run_cpu(generate_password_hash, raw_password)
 
+        # Use a transaction so the insert is committed, or rolled back on error
+        connection = get_catalog_db()
+        with connection:
             # Check for existing user by USERNAME ONLY (unique constraint handles true duplicates)
-            existing = cursor.execute(
+            existing = connection.execute(
                 'SELECT 1 FROM USERS WHERE username = ?',
-                (username)
+                (username,)
             ).fetchone()
             if existing:
                 flash('Username already taken. Please choose another.')
                 return render_template('register.html')
 
-            cursor.execute(
+            connection.execute(
                 'INSERT INTO USERS (username, user_password, store_name) VALUES (?, ?, ?)',
                 (username, hashed_password, store_name)
             )
             # context manager will commit automatically unless an exception occurs
 
-        # Option 1: send them to login page immediately
-        # return redirect(url_for('login'))
-
-        # Option 2 (recommended UX): log them in right away after registration
-        with sqlite3.connect('inventory.db') as connection:
-            connection.row_factory = sqlite3.Row
-            cursor = connection.cursor()
-            row = cursor.execute(
-                'SELECT * FROM USERS WHERE username = ?',
-                (username,)
-            ).fetchone()
-
-        #
-        return redirect(url_for('login'))
+        # Send them to login page immediately
+        return redirect(url_for('main.login'))
 
     return render_template('register.html')
 
@@ -446,7 +853,8 @@ def register():
 # If the users tries to update the value a sql query is made updating the value in the database.
 # If a get request is sent the edit_quantity html is rendered and the item name and quantity stored in the database
 # is displayed.
-@app.route('/edit/<string:name>', methods=['GET', 'POST'])
+@bp.route('/edit/<string:name>', methods=['GET', 'POST'])
+@login_required
 def edit_quantity(name):
     """
     Edit an existing inventory item.
@@ -459,66 +867,206 @@ def edit_quantity(name):
     POST:
         Update the item in the database
 
+    Only the current user's items can be edited, other names are not found.
+
     Returns:
         str | Response: Rendered template or redirect to inventory page
     """
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
+    conn = get_db()
 
     if request.method == 'POST':
         new_quantity = int(request.form['quantity'])
-        cursor.execute('UPDATE inventory SET quantity = ? WHERE name = ?', (new_quantity, name))
-        conn.commit()
-        conn.close()
-        return redirect(url_for('inventory'))
+        before = read_item(conn, current_user.id, name=name)
+        with conn:
+            changed = conn.execute('UPDATE inventory SET quantity = ?, updated_at = CURRENT_TIMESTAMP '
+                                   'WHERE name = ? AND owner_id = ?', (new_quantity, name, current_user.id)).rowcount
+            new_threshold = request.form.get('reorder_threshold', type=int)
+            if new_threshold is not None:
+                conn.execute('UPDATE inventory SET reorder_threshold = ?, updated_at = CURRENT_TIMESTAMP '
+                             'WHERE name = ? AND owner_id = ?', (max(0, new_threshold), name, current_user.id))
+        if changed:
+            publish_item_change(conn, before, read_item(conn, current_user.id, name=name))
+        return redirect(url_for('main.inventory'))
 
     # GET request
-    cursor.execute('SELECT quantity FROM inventory WHERE name = ?', (name,))
-    row = cursor.fetchone()
-    conn.close()
+    row = conn.execute('SELECT quantity, reorder_threshold FROM inventory WHERE name = ? AND owner_id = ?',
+                       (name, current_user.id)).fetchone()
 
     if row:
-        current_quantity = row[0]
-        return render_template('edit_quantity.html', name=name, quantity=current_quantity)
+        current_quantity, reorder_threshold = row
+        return render_template('edit_quantity.html', name=name, quantity=current_quantity,
+                               reorder_threshold=reorder_threshold)
     else:
         return "Item not found", 404
 
 
-@app.route('/low-stock')
+@bp.route('/stock/adjust', methods=['GET', 'POST'])
+@login_required
+def adjust_stock():
+    """
+    Adjust the quantities of many items at once, for stocktakes and receiving
+
+    GET:
+        Render a page of items, chosen with the same query parameters as the
+        inventory listing, each with a field for a delta or a counted quantity
+    POST:
+        Apply the adjustments in one transaction. JSON requests send
+        {"adjustments": [{"item_id": 1, "delta": 5}, {"item_id": 2, "count": 10}]}
+        (or just the list) and get the new quantities back; form posts are
+        redirected back to the page.
+
+    Returns:
+        str | Response: Rendered form, redirect, or JSON with the new quantities
+    """
+    if request.method == 'GET':
+        listing = parse_listing_args(request.args)
+        rows, next_cursor = list_items(get_db(), current_user.id, columns=('item_id', 'name', 'quantity'), **listing)
+        params = request.args.to_dict()
+        params.pop('after', None)
+        next_url = url_for('main.adjust_stock', after=next_cursor, **params) if next_cursor else None
+        return render_template('adjust_stock.html', items=rows, next_url=next_url)
+
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        adjustments = payload.get('adjustments') if isinstance(payload, dict) else payload
+    else:
+        adjustments = []
+        for item_id, mode, value in zip(request.form.getlist('item_id'), request.form.getlist('mode'),
+                                        request.form.getlist('value')):
+            if value.strip():
+                adjustments.append({'item_id': item_id, 'count' if mode == 'count' else 'delta': value.strip()})
+        if not adjustments:
+            flash('Nothing to adjust.')
+            return redirect(request.full_path)
+
+    try:
+        quantities = apply_adjustments(get_db(), current_user.id, adjustments)
+    except ValueError as error:
+        if request.is_json:
+            return jsonify(error=str(error)), 400
+        flash(str(error).capitalize() + '.')
+        return redirect(request.full_path)
+    except LookupError as error:
+        if request.is_json:
+            return jsonify(error='unknown items', item_ids=error.args[0]), 404
+        flash('Some items no longer exist, nothing was changed.')
+        return redirect(request.full_path)
+
+    publish_reload(get_db(), current_user.id)
+    if request.is_json:
+        return jsonify(items=[{'item_id': item_id, 'quantity': quantity} for item_id, quantity in quantities.items()])
+    flash(f'Updated {len(quantities)} items.')
+    return redirect(request.full_path)
+
+
+@bp.route('/items/<int:item_id>/history')
 @login_required
+def item_stock_history(item_id):
+    """
+    List the stock movements of one of the current user's items, newest first
+
+    Deleted items keep their history. Pages are chosen with 'limit' and
+    'before', the next_before value of the previous page.
+
+    Args:
+        item_id (int): ID of the item
+
+    Returns:
+        Response: JSON with the ledger entries
+    """
+    limit = max(1, min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), MAX_HISTORY_PAGE_SIZE))
+    entries = item_history(get_db(), current_user.id, item_id, before=request.args.get('before', type=int),
+                           limit=limit)
+    return jsonify(item_id=item_id, entries=[dict(entry) for entry in entries],
+                   next_before=entries[-1]['entry_id'] if len(entries) == limit else None)
+
+
+@bp.route('/stock/as-of')
+@login_required
+def stock_at():
+    """
+    Show the current user's stock levels at a point in time
+
+    The 'at' query parameter is an ISO 8601 date or date and time (UTC unless
+    it has an offset), 'item_id' limits the answer to one item.
+
+    Returns:
+        Response: JSON with the quantity of every item that existed at that time
+    """
+    try:
+        at = ledger_timestamp(request.args['at'])
+    except (KeyError, ValueError):
+        return jsonify(error="'at' must be an ISO 8601 date or time"), 400
+    stock = stock_as_of(get_db(), current_user.id, at, item_id=request.args.get('item_id', type=int))
+    return jsonify(at=at, items=[{'item_id': item_id, 'name': name, 'quantity': quantity}
+                                 for item_id, (name, quantity) in sorted(stock.items())])
+
+
+@bp.route('/low-stock')
+@login_required
+@conditional_page('page_cache')
 def low_stock():
     """
-    Displays all items with quantity less than 11
+    Displays all items at or below their reorder threshold
+
+    Only low stock rows are read, through a partial index that holds nothing
+    else, so the cost of the page follows the number of low stock items rather
+    than the size of the inventory. Pages are cached and revalidated by
+    inventory version.
 
     Returns:
-        str: Render low stock template
+        str | Response: Render low stock template, or a 304 response
     """
-    connection = sqlite3.connect('inventory.db')
-    cursor = connection.cursor()
-    cursor.execute('SELECT name, image, description, quantity, price FROM inventory WHERE owner_id = ?',
-                   (current_user.id,))
-    rows = cursor.fetchall()
-    connection.close()
+    connection = get_db()
+    counts = connection.execute('SELECT COUNT(*), COALESCE(SUM(quantity = 0), 0) FROM inventory \
+                                WHERE owner_id = ? AND quantity <= reorder_threshold', (current_user.id,)).fetchone()
+    rows = connection.execute('SELECT item_id, name, image_hash, description, quantity, price, reorder_threshold \
+                              FROM inventory WHERE owner_id = ? AND quantity <= reorder_threshold \
+                              ORDER BY quantity, item_id', (current_user.id,)).fetchall()
 
     lowStock = []
     outOfStock = []
     for row in rows:
-        name, image_blob, description, quantity, price = row
-        if image_blob:
-            image_base64 = base64.b64encode(image_blob).decode('utf-8')
-            image_uri = f"data:image/jpeg;base64,{image_base64}"
+        item_id, name, item_image_hash, description, quantity, price, reorder_threshold = row
+        image_uri = image_url(item_id, item_image_hash)
+        original_uri = image_url(item_id, item_image_hash, 'original')
+
+        item = (name, image_uri, description, quantity, price, original_uri, reorder_threshold, item_id)
+        if quantity == 0:
+            outOfStock.append(item)
         else:
-            image_uri = None  # or a default placeholder image path
+            lowStock.append(item)
+
+    return render_template('low_stock.html', lowStock=lowStock, outOfStock=outOfStock,
+                           low_count=counts[0] - counts[1], out_count=counts[1])
+
+
+@bp.route('/events')
+@login_required
+def inventory_events():
+    """
+    Stream changes to the current user's items as server-sent events
 
-        if row[3] == 0:
-            outOfStock.append((name, image_uri, description, quantity, price))
-        elif row[3] <= 10:
-            lowStock.append((name, image_uri, description, quantity, price))
+    The inventory and low stock pages listen to this stream to update
+    themselves in place. The 'since' query parameter is the inventory version
+    the page was rendered from; if the inventory changed after that, the
+    stream starts with a reload event. Under the ASGI server this route is
+    served by `events.asgi_events` instead, without a thread per stream.
 
-    return render_template('low_stock.html', lowStock=lowStock, outOfStock=outOfStock)
+    Returns:
+        Response: text/event-stream of item, alert and reload events
+    """
+    stream = stream_events(current_app._get_current_object(), current_user.id,
+                           since=request.args.get('since', type=int))
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Metrics then time the request up to the start of the stream, not for as long as the page stays open
+    response.direct_passthrough = True
+    return response
 
 
-@app.route('/delete', methods=['GET', 'POST'])
+@bp.route('/delete', methods=['GET', 'POST'])
 @login_required
 def delete():
     """
@@ -533,29 +1081,202 @@ def delete():
     Returns:
         str | Response: Rendered template or redirect to inventory page
     """
-    connection = sqlite3.connect('inventory.db')
-    cursor = connection.cursor()
-    cursor.execute('SELECT name, item_id FROM inventory WHERE owner_id = ?',
-                   (current_user.id,))
-    rows = cursor.fetchall()
+    connection = get_db()
 
     if request.method == 'POST':
         itemToDelete = int(request.form['deleteItem'])
-        cursor.execute('DELETE from inventory WHERE item_id = ?', (itemToDelete,))
-        connection.commit()
-        connection.close()
-        return redirect(url_for('inventory'))
-
+        before = read_item(connection, current_user.id, item_id=itemToDelete)
+        with connection:
+            deleted = connection.execute('DELETE from inventory WHERE item_id = ? AND owner_id = ?',
+                                         (itemToDelete, current_user.id)).rowcount
+        # Only the owner's items are deleted, and only real deletions reach their pages
+        if deleted:
+            publish_item_change(connection, before, None)
+        return redirect(url_for('main.inventory'))
+
+    rows = connection.execute('SELECT name, item_id FROM inventory WHERE owner_id = ?',
+                              (current_user.id,)).fetchall()
     items = []
     for row in rows:
         name, item_id = row
         items.append((name, item_id))
 
-    connection.close()
     return render_template('delete.html', items=items)
 
 
-if __name__ == '__main__':
-    init_database()
-    app.run(debug=True)
+@bp.cli.command('init-db')
+def init_db_command():
+    """
+    Create the database or bring it up to the current schema
+    """
+    init_database(current_app._get_current_object())
+    click.echo(f"Initialized {current_app.config['DATABASE']}")
+
+
+@bp.cli.command('backfill-thumbnails')
+@click.option('--workers', type=int, default=None, help='Worker processes, defaults to the CPU count')
+@click.option('--batch-size', type=int, default=32, help='Images processed per batch')
+def backfill_thumbnails_command(workers, batch_size):
+    """
+    Generate thumbnails for images stored before renditions existed
+    """
+    count = sum(backfill_renditions(connection, workers=workers, batch_size=batch_size)
+                for connection in store_databases())
+    click.echo(f'Generated renditions for {count} images')
+
+
+@bp.cli.command('gc-images')
+@click.option('--recount', is_flag=True, help='Recompute reference counts from the inventory first')
+@click.option('--vacuum', is_flag=True, help='Give the freed space back to the file system afterwards')
+def gc_images_command(recount, vacuum):
+    """
+    Delete stored images that no item uses any more
+    """
+    corrected = count = freed = 0
+    for connection in store_databases():
+        if recount:
+            corrected += recount_references(connection)
+        removed, removed_bytes = collect_garbage(connection)
+        count += removed
+        freed += removed_bytes
+        if vacuum:
+            connection.execute('VACUUM')
+    if recount:
+        click.echo(f'Corrected {corrected} reference counts')
+    click.echo(f'Removed {count} unused images ({freed} bytes)')
+
+
+@bp.cli.command('cleanup-exports')
+def cleanup_exports_command():
+    """
+    Delete expired export jobs and their files
+    """
+    count = sum(cleanup_expired(current_app, connection) for connection in store_databases())
+    click.echo(f'Removed {count} expired export jobs')
+
+
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """
+    Rebuild the full-text search index from the inventory table
+    """
+    count = sum(rebuild_index(connection) for connection in store_databases())
+    click.echo(f'Indexed {count} items')
+
+
+@bp.cli.command('import-inventory')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--owner', 'username', required=True, help='Username of the store the items are added to')
+@click.option('--format', 'file_format', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='File format, detected from the extension by default')
+def import_inventory_command(path, username, file_format):
+    """
+    Import items from a CSV, XLSX or XML file
+    """
+    file_format = file_format or detect_format(path)
+    if file_format is None:
+        raise click.UsageError('Cannot tell the file format from the extension, use --format')
+    owner = get_catalog_db().execute('SELECT user_id FROM USERS WHERE username = ?', (username,)).fetchone()
+    if owner is None:
+        raise click.UsageError(f'No user named {username!r}')
+    with open(path, 'rb') as stream:
+        report = import_inventory(get_db(owner[0]), owner[0], stream, file_format,
+                                  batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+    click.echo(f'Read {report.processed} records, imported {report.imported}, skipped {report.error_count}')
+    for line, message in report.errors:
+        click.echo(f'  line {line}: {message}')
+
+
+@bp.cli.command('snapshot-stock')
+@click.option('--min-entries', type=int, default=SNAPSHOT_MIN_ENTRIES,
+              help='Ledger entries a store needs since its last snapshot')
+def snapshot_stock_command(min_entries):
+    """
+    Snapshot stock levels of stores with enough new ledger entries, run periodically
+    """
+    count = sum(snapshot_all(connection, min_entries=min_entries) for connection in store_databases())
+    click.echo(f'Took {count} stock snapshots')
+
+
+@bp.cli.command('verify-summary')
+def verify_summary_command():
+    """
+    Check the store summary table against the inventory
+    """
+    mismatches = {}
+    for connection in store_databases():
+        mismatches.update(verify_summary(connection))
+    for owner_id, (stored, actual) in sorted(mismatches.items()):
+        click.echo(f'owner {owner_id}: stored {stored}, actual {actual}')
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} store summaries are out of date, run rebuild-summary')
+    click.echo('Store summaries are up to date')
+
+
+@bp.cli.command('rebuild-summary')
+def rebuild_summary_command():
+    """
+    Recompute the store summary table from the inventory
+    """
+    count = sum(rebuild_summary(connection) for connection in store_databases())
+    click.echo(f'Summarised {count} stores')
+
 
+@bp.cli.command('split-database')
+@click.argument('catalog', type=click.Path(dir_okay=False))
+@click.argument('shard_dir', type=click.Path(file_okay=False))
+def split_database_command(catalog, shard_dir):
+    """
+    Copy the database into a catalog of users and one database per store
+
+    The current database is left as it is. Point DATABASE at CATALOG and
+    SHARD_DIR at SHARD_DIR afterwards to serve from the shards.
+    """
+    if current_app.config['SHARD_DIR']:
+        raise click.UsageError('The database is already sharded')
+    if os.path.exists(catalog):
+        raise click.UsageError(f'{catalog} already exists')
+    source = get_catalog_db()
+    upgrade_schema(source)
+    count = split_database(source, catalog, shard_dir)
+    click.echo(f'Split {count} stores into {shard_dir}')
+
+
+@bp.cli.command('create-api-token')
+@click.option('--owner', 'username', required=True, help='Username of the store the token acts for')
+@click.option('--name', required=True, help='Label telling the store\'s tokens apart, e.g. the integration')
+def create_api_token_command(username, name):
+    """
+    Create a token for the JSON API and print it
+    """
+    connection = get_catalog_db()
+    owner = connection.execute('SELECT user_id FROM USERS WHERE username = ?', (username,)).fetchone()
+    if owner is None:
+        raise click.UsageError(f'No user named {username!r}')
+    token_id, token = create_token(connection, owner[0], name)
+    click.echo(f'Token {token_id}: {token}')
+    click.echo('It is only shown now, send it as "Authorization: Bearer <token>"')
+
+
+@bp.cli.command('list-api-tokens')
+@click.option('--owner', 'username', default=None, help='Only list the tokens of this user')
+def list_api_tokens_command(username):
+    """
+    List JSON API tokens, without the tokens themselves
+    """
+    rows = get_catalog_db().execute('SELECT token_id, username, name, created_at FROM API_TOKENS '
+                                    'JOIN USERS USING (user_id) WHERE ? IS NULL OR username = ? ORDER BY token_id',
+                                    (username, username)).fetchall()
+    for token_id, owner, name, created_at in rows:
+        click.echo(f'{token_id}\t{owner}\t{name}\t{created_at}')
+
+
+@bp.cli.command('revoke-api-token')
+@click.argument('token_id', type=int)
+def revoke_api_token_command(token_id):
+    """
+    Delete a JSON API token so it no longer works
+    """
+    if not revoke_token(get_catalog_db(), token_id):
+        raise click.UsageError(f'No token {token_id}')
+    click.echo(f'Revoked token {token_id}')
@@ -0,0 +1,48 @@
+"""
+ASGI entry point
+
+Serves the Flask app from an ASGI server such as uvicorn::
+
+    uvicorn inventory.asgi:application
+
+The event loop accepts connections and keeps idle keep-alive clients without
+tying up a thread. Each request runs on a bounded pool of ASGI_THREADS
+threads, so the database pool and the blocking SQLite calls never run on the
+event loop. CPU-heavy work inside a request is capped separately by
+`inventory.offload`. The /events streams are answered on the event loop by
+`inventory.events.asgi_events`, so open pages do not hold request threads.
+`inventory.serve` starts a server with this application and production
+settings. The app is built by `create_app` when this module is imported, so
+a server that imports it before forking (e.g. gunicorn --preload with a
+uvicorn worker class) shares it between its workers.
+
+Configuration keys (all optional):
+    ASGI_THREADS (int): Requests handled at the same time per process
+"""
+
+
+from a2wsgi import WSGIMiddleware
+from .app import create_app
+from .events import asgi_events
+
+
+app = create_app()
+app.config.setdefault('ASGI_THREADS', 32)
+
+wsgi_application = WSGIMiddleware(app, workers=app.config['ASGI_THREADS'])
+events_application = asgi_events(app)
+
+
+async def application(scope, receive, send):
+    """
+    Route event streams to the native handler and everything else to the Flask app
+
+    Args:
+        scope (dict): ASGI connection scope
+        receive (callable): Awaitable returning the next client message
+        send (callable): Awaitable sending a message to the client
+    """
+    if scope['type'] == 'http' and scope['path'] == '/events' and scope['method'] == 'GET':
+        await events_application(scope, receive, send)
+    else:
+        await wsgi_application(scope, receive, send)
@@ -0,0 +1,103 @@
+"""
+In-process caches
+
+A small thread-safe LRU cache whose entries also expire after a time to live.
+Each process has its own copy, so anything cached must be invalidated
+explicitly by the code that changes it and the TTL bounds how stale another
+process's copy can get.
+"""
+
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Least recently used cache with per-entry expiry
+
+    Attributes:
+        maxsize (int): Largest number of entries kept, the least recently used are evicted first
+        ttl (float): Seconds an entry stays valid
+        hits (int): Number of lookups answered from the cache
+        misses (int): Number of lookups that found nothing or an expired entry
+    """
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Look up an entry
+
+        Args:
+            key (hashable): Key of the entry
+            default (object): Returned when there is no valid entry
+
+        Returns:
+            object: Cached value or `default`
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """
+        Store an entry, evicting the least recently used one if the cache is full
+
+        Args:
+            key (hashable): Key of the entry
+            value (object): Value to cache
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Drop an entry if it is cached
+
+        Args:
+            key (hashable): Key of the entry
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every entry
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Report the cache's size and hit counters
+
+        Returns:
+            dict: size, maxsize, ttl, hits, misses and hit_ratio
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+            }
@@ -0,0 +1,98 @@
+"""
+Conditional responses for pages built from a store's inventory
+
+Every store has a version number in INVENTORY_VERSIONS that triggers bump on
+any insert, update or delete of its items, in the same transaction as the
+change. Pages and exports derived from the inventory carry a weak ETag made
+from the owner, that version and the request, so a client that already has
+the current page gets a 304 after one primary key lookup. Rendered pages can
+also be kept in a `TTLCache` of the app keyed the same way; a changed inventory gets a
+new version and therefore new keys, and old entries simply age out of the LRU.
+"""
+
+
+import hashlib
+from functools import wraps
+from flask import current_app, g, make_response, request
+from flask_login import current_user
+from .db import get_db
+
+
+def inventory_version(connection, owner_id):
+    """
+    Read a store's inventory version
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): ID of the user who owns the store
+
+    Returns:
+        int: Version number, 0 for a store whose items never changed
+    """
+    row = connection.execute('SELECT version FROM INVENTORY_VERSIONS WHERE owner_id = ?', (owner_id,)).fetchone()
+    return row[0] if row is not None else 0
+
+
+def page_etag(owner_id, version, key):
+    """
+    Build the ETag of a page
+
+    Args:
+        owner_id (int): ID of the user the page belongs to
+        version (int): Inventory version the page was built from
+        key (str): Everything else the page depends on, such as the path and query string
+
+    Returns:
+        str: ETag value, without quotes
+    """
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return f'{owner_id}-{version}-{digest}'
+
+
+def conditional_page(cache_name=None, owner=None):
+    """
+    Decorate a view whose output only depends on the user's inventory and the request URL
+
+    Successful responses get a weak ETag and must be revalidated by the
+    client; a matching If-None-Match is answered with a 304 without calling
+    the view. With a cache, the bodies of successful responses are also kept
+    and served again until the inventory changes. Leave the cache out for
+    large or streamed responses such as exports. Apply it after
+    `login_required`, or after whatever decorator authenticates the request
+    `owner` reads the store from.
+
+    Args:
+        cache_name (str | None): Key of the `TTLCache` in `app.extensions` that keeps rendered bodies
+        owner (callable | None): Returns the ID of the store the page shows, defaults to the logged in user's
+
+    Returns:
+        callable: Decorator for a view function
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            owner_id = owner() if owner is not None else current_user.id
+            cache = current_app.extensions[cache_name] if cache_name else None
+            version = inventory_version(get_db(owner_id), owner_id)
+            # Pages hand the version to the event stream, so it can tell whether they missed a change
+            g.inventory_version = version
+            key = request.host + request.full_path
+            etag = page_etag(owner_id, version, key)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                body = cache.get((owner_id, version, key)) if cache is not None else None
+                if body is not None:
+                    response = make_response(body)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    if cache is not None:
+                        cache.set((owner_id, version, key), response.get_data())
+            response.set_etag(etag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
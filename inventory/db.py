@@ -0,0 +1,401 @@
+"""
+SQLite connection management
+
+Routes never open their own connections. A bounded pool per database file hands
+out connections through Flask's application context: the first call to
+`get_db()` in a request borrows a connection, and it goes back to the pool when
+the context is torn down. Pooled connections keep their PRAGMAs and their
+prepared statement cache between requests.
+
+With SHARD_DIR set, every store keeps its items in a database file of its own
+in that directory, so stores do not wait on each other's write lock. DATABASE
+is then the catalog that holds USERS. `get_db()` still returns the connection
+for the logged in user's store, while `get_catalog_db()` is used for users.
+Without sharding both return the same connection to DATABASE.
+
+Configuration keys (all optional):
+    DATABASE (str): Path of the SQLite database file, the catalog when sharded
+    SHARD_DIR (str | None): Directory of per-store database files, None to keep every store in DATABASE
+    DB_POOL_SIZE (int): Maximum number of open connections per database
+    DB_SHARD_POOL_SIZE (int): Maximum number of open connections per store database
+    DB_POOL_TIMEOUT (float): Seconds to wait for a free connection
+    DB_STATEMENT_CACHE (int): Prepared statements cached per connection
+    DB_PRAGMAS (dict): PRAGMAs applied to every new connection
+    DB_CONNECTION_FACTORY (type): sqlite3.Connection subclass new connections are made from
+"""
+
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+from flask import current_app, g
+from flask_login import current_user
+from .images import image_hash
+
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,
+    'mmap_size': 134217728,
+    'busy_timeout': 5000,
+}
+
+# Columns added after the first release, as (table, column, definition, backfill SQL).
+# `migrate` adds any that an existing database is missing and runs the backfill once.
+COLUMN_MIGRATIONS = [
+    ('INVENTORY', 'image_hash', 'TEXT', 'UPDATE INVENTORY SET image_hash = sha256(image) WHERE image IS NOT NULL'),
+    ('INVENTORY', 'updated_at', 'TEXT', 'UPDATE INVENTORY SET updated_at = CURRENT_TIMESTAMP'),
+    ('INVENTORY', 'reorder_threshold', 'INTEGER NOT NULL DEFAULT 10', None),
+]
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'inventory_schema.sql')
+
+_SHARD_NAME = re.compile(r'store-(\d+)\.db$')
+
+_pool_lock = threading.Lock()
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """
+    Raised when no connection becomes free within the pool timeout
+    """
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections for one database file
+
+    A connection is only ever used by one thread at a time, but it may be
+    handed to a different thread the next time it is borrowed.
+
+    Attributes:
+        database (str): Path of the database file
+        size (int): Maximum number of connections open at once
+        timeout (float): Seconds `acquire` waits for a free connection
+        pragmas (dict): PRAGMA name/value pairs applied to new connections
+        cached_statements (int): Size of each connection's statement cache
+        factory (type): sqlite3.Connection subclass used to open connections
+    """
+    def __init__(self, database, size=8, timeout=30.0, pragmas=None, cached_statements=128,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.cached_statements = cached_statements
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.database, timeout=self.timeout, check_same_thread=False,
+                                     cached_statements=self.cached_statements, factory=self.factory)
+        connection.row_factory = sqlite3.Row
+        connection.create_function('sha256', 1, image_hash, deterministic=True)
+        for name, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def acquire(self):
+        """
+        Borrow a connection, opening a new one if none are idle
+
+        Returns:
+            sqlite3.Connection: A connection that must be given back with `release`
+
+        Raises:
+            PoolTimeout: If every connection stays busy for `timeout` seconds
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No free connection to {self.database} after {self.timeout}s')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection):
+        """
+        Return a borrowed connection to the pool
+
+        Any transaction left open by the borrower is rolled back first.
+
+        Args:
+            connection (sqlite3.Connection): Connection returned by `acquire`
+        """
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle.put(connection)
+        except sqlite3.Error:
+            connection.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """
+        Close every idle connection held by the pool
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def _unique_name_across_stores(connection):
+    unique_columns = [[info[2] for info in connection.execute(f'PRAGMA index_info("{index[1]}")')]
+                      for index in connection.execute('PRAGMA index_list(INVENTORY)') if index[2]]
+    return ['name'] in unique_columns
+
+
+def _rebuild_inventory(connection):
+    # SQLite cannot drop a UNIQUE constraint, so the rows are copied into a table declared like the old one but
+    # with names unique per store. The old table takes its indexes and triggers with it, the schema script
+    # creates them again. The search view refers to INVENTORY by name and would block the rename, so it goes too.
+    sql = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'INVENTORY'").fetchone()[0]
+    sql = re.sub(r'^CREATE TABLE\s+"?INVENTORY"?', 'CREATE TABLE INVENTORY_REBUILD', sql, flags=re.I)
+    sql = re.sub(r'\bname\s+TEXT\s+NOT\s+NULL\s+UNIQUE\b', 'name TEXT NOT NULL', sql, count=1, flags=re.I)
+    sql = sql[:sql.rindex(')')].rstrip() + ',\n    UNIQUE(owner_id, name)\n)'
+    columns = ', '.join(row[1] for row in connection.execute('PRAGMA table_info(INVENTORY)'))
+    sequence = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'INVENTORY'").fetchone()
+    connection.execute('DROP VIEW IF EXISTS INVENTORY_SEARCH_SOURCE')
+    connection.execute(sql)
+    connection.execute(f'INSERT INTO INVENTORY_REBUILD ({columns}) SELECT {columns} FROM INVENTORY')
+    connection.execute('DROP TABLE INVENTORY')
+    connection.execute('ALTER TABLE INVENTORY_REBUILD RENAME TO INVENTORY')
+    if sequence is not None:
+        # Keep the AUTOINCREMENT counter, the copy only raised it to the highest remaining item_id
+        connection.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'INVENTORY'", (sequence[0],))
+
+
+def migrate(connection):
+    """
+    Bring the tables of an existing database up to the current schema
+
+    Tables that do not exist yet are skipped, the schema script creates them
+    with every column. An INVENTORY table from before item names were unique
+    per store is rebuilt in one transaction, after which the schema script
+    must be run to restore its indexes, triggers and the search view.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database to upgrade
+    """
+    with connection:
+        for table, column, definition, backfill in COLUMN_MIGRATIONS:
+            columns = {row[1].lower() for row in connection.execute(f'PRAGMA table_info({table})')}
+            if columns and column.lower() not in columns:
+                connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                if backfill:
+                    connection.execute(backfill)
+    if _unique_name_across_stores(connection):
+        with connection:
+            connection.execute('BEGIN')
+            _rebuild_inventory(connection)
+
+
+def init_app(app):
+    """
+    Register connection handling and default settings on a Flask app
+
+    Args:
+        app (Flask): Application to configure
+    """
+    app.config.setdefault('DATABASE', 'inventory.db')
+    app.config.setdefault('SHARD_DIR', None)
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('DB_SHARD_POOL_SIZE', 4)
+    app.config.setdefault('DB_POOL_TIMEOUT', 30.0)
+    app.config.setdefault('DB_STATEMENT_CACHE', 128)
+    app.config.setdefault('DB_PRAGMAS', dict(DEFAULT_PRAGMAS))
+    app.config.setdefault('DB_CONNECTION_FACTORY', sqlite3.Connection)
+    app.teardown_appcontext(close_db)
+
+
+def shard_path(shard_dir, owner_id):
+    """
+    Path of a store's database file in sharded mode
+
+    Args:
+        shard_dir (str): Shard directory
+        owner_id (int): ID of the user who owns the store
+
+    Returns:
+        str: Database file path
+    """
+    return os.path.join(shard_dir, f'store-{int(owner_id)}.db')
+
+
+def shard_owners(shard_dir):
+    """
+    List the stores that have a database file in a shard directory
+
+    Args:
+        shard_dir (str): Shard directory
+
+    Returns:
+        list: Owner IDs in ascending order
+    """
+    if not os.path.isdir(shard_dir):
+        return []
+    matches = (_SHARD_NAME.match(name) for name in os.listdir(shard_dir))
+    return sorted(int(match.group(1)) for match in matches if match)
+
+
+def get_pool(app=None, database=None):
+    """
+    Get the connection pool for a database file, creating it on first use
+
+    A new store database is given the schema before it is handed out.
+
+    Args:
+        app (Flask | None): Application to use, defaults to the current app
+        database (str | None): Database file, defaults to the app's DATABASE
+
+    Returns:
+        ConnectionPool: Pool for the database
+    """
+    app = app or current_app._get_current_object()
+    database = database or app.config['DATABASE']
+    pools = app.extensions.setdefault('inventory_db', {})
+    pool = pools.get(database)
+    if pool is None:
+        with _pool_lock:
+            pool = pools.get(database)
+            if pool is None:
+                is_shard = database != app.config['DATABASE']
+                pool = ConnectionPool(database,
+                                      size=app.config['DB_SHARD_POOL_SIZE' if is_shard else 'DB_POOL_SIZE'],
+                                      timeout=app.config['DB_POOL_TIMEOUT'],
+                                      pragmas=app.config['DB_PRAGMAS'],
+                                      cached_statements=app.config['DB_STATEMENT_CACHE'],
+                                      factory=app.config['DB_CONNECTION_FACTORY'])
+                if is_shard and not os.path.exists(database):
+                    os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+                    connection = pool.acquire()
+                    try:
+                        with open(SCHEMA_PATH) as f:
+                            connection.executescript(f.read())
+                    finally:
+                        pool.release(connection)
+                pools[database] = pool
+    return pool
+
+
+def _context_connection(database):
+    connections = g.setdefault('db_connections', {})
+    if database not in connections:
+        connections[database] = get_pool(database=database).acquire()
+    return connections[database]
+
+
+def get_catalog_db():
+    """
+    Get the connection to the database holding USERS for the current app context
+
+    Returns:
+        sqlite3.Connection: Pooled database connection
+    """
+    return _context_connection(current_app.config['DATABASE'])
+
+
+def store_database(app, owner_id):
+    """
+    Path of the database file holding a store's items
+
+    Args:
+        app (Flask): Application to use
+        owner_id (int): ID of the user who owns the store
+
+    Returns:
+        str: The store's shard with sharding on, otherwise DATABASE
+    """
+    if app.config['SHARD_DIR']:
+        return shard_path(app.config['SHARD_DIR'], owner_id)
+    return app.config['DATABASE']
+
+
+def get_db(owner_id=None):
+    """
+    Get the connection to a store's database for the current app context
+
+    The same connection is returned for the rest of the request and released
+    back to the pool on teardown. Without sharding every store shares the
+    catalog database.
+
+    Args:
+        owner_id (int | None): Store to connect to, defaults to the logged in user's
+
+    Returns:
+        sqlite3.Connection: Pooled database connection
+
+    Raises:
+        RuntimeError: If sharding is on and no store is given or logged in
+    """
+    app = current_app._get_current_object()
+    if not app.config['SHARD_DIR']:
+        return get_catalog_db()
+    if owner_id is None:
+        if not current_user or not current_user.is_authenticated:
+            raise RuntimeError('No store to connect to, pass owner_id outside of logged in requests')
+        owner_id = current_user.id
+    return _context_connection(store_database(app, owner_id))
+
+
+def store_databases(app=None):
+    """
+    Iterate over the connections of every store database, for maintenance commands
+
+    Without sharding this is the one shared database. Each connection is
+    released before the next one is borrowed.
+
+    Args:
+        app (Flask | None): Application to use, defaults to the current app
+
+    Yields:
+        sqlite3.Connection: Connection to one store database
+    """
+    app = app or current_app._get_current_object()
+    shard_dir = app.config['SHARD_DIR']
+    databases = [shard_path(shard_dir, owner_id) for owner_id in shard_owners(shard_dir)] if shard_dir \
+        else [app.config['DATABASE']]
+    for database in databases:
+        pool = get_pool(app, database)
+        connection = pool.acquire()
+        try:
+            yield connection
+        finally:
+            pool.release(connection)
+
+
+def close_db(exception=None):
+    """
+    Release the app context's connections back to their pools
+
+    Args:
+        exception (BaseException | None): Error that ended the context, if any
+    """
+    for database, connection in g.pop('db_connections', {}).items():
+        get_pool(database=database).release(connection)
+
+
+def close_pools(app):
+    """
+    Close the idle connections of every pool of an app and forget the pools
+
+    Pools are created again on the next `get_db()`. Call it once setup work is
+    done in a process that forks workers afterwards, so no SQLite connection
+    is shared with the children.
+
+    Args:
+        app (Flask): Application whose pools are closed
+    """
+    for pool in app.extensions.pop('inventory_db', {}).values():
+        pool.close()
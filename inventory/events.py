@@ -0,0 +1,364 @@
+"""
+Live inventory change events
+
+Routes that change items publish small JSON events on an in-process change
+bus once their transaction has committed, and every open /events stream of
+the same store receives them as server-sent events. Three events are sent:
+
+    item: {"change": "added" | "updated" | "deleted", "item": {...}, "version": n}
+    alert: {"item_id", "name", "quantity", "state", "previous_state", "version"} when an
+        item moves between 'ok', 'low' (at or below its reorder threshold) and 'out' (zero)
+    reload: {"version": n} when the page should be fetched again, after bulk changes or
+        when events may have been missed
+
+Every event carries the store's inventory version (see `inventory.conditional`).
+A page passes the version it was rendered from as 'since' when it connects,
+so changes made in between are not lost. The bus only reaches streams of the
+same process; while idle, each stream compares the version every
+EVENTS_HEARTBEAT seconds and sends a reload if another process changed the
+store.
+
+Streams are served by `stream_events` from the Flask route, which ties up a
+request thread per open page, and natively by `asgi_events` under
+`inventory.asgi`, where an idle page only costs a queue on the event loop.
+
+Configuration keys (all optional):
+    EVENTS_HEARTBEAT (float): Seconds between keep-alive messages and version checks
+    EVENTS_QUEUE_SIZE (int): Events buffered per stream before it is told to reload
+"""
+
+
+import asyncio
+import json
+import queue
+import threading
+from collections import defaultdict
+from flask import request
+from flask_login import current_user
+from werkzeug.test import EnvironBuilder
+from . import metrics
+from .conditional import inventory_version
+from .db import get_db, get_pool, store_database
+
+
+# Columns of an item sent in 'item' events
+ITEM_FIELDS = ('item_id', 'name', 'description', 'quantity', 'price', 'reorder_threshold')
+
+# Browsers reconnect after this many milliseconds when a stream drops
+RETRY_MS = 5000
+
+
+def init_app(app):
+    """
+    Register default event stream settings on a Flask app
+
+    Args:
+        app (Flask): Application to configure
+    """
+    app.config.setdefault('EVENTS_HEARTBEAT', 20.0)
+    app.config.setdefault('EVENTS_QUEUE_SIZE', 100)
+    metrics.register_collector(app, lambda: [('inventory_event_streams', 'gauge', 'Open event streams',
+                                              [({}, bus.subscriber_count())])])
+
+
+def stock_state(quantity, reorder_threshold):
+    """
+    Classify an item's stock level the way the low stock page does
+
+    Args:
+        quantity (int): Units on hand
+        reorder_threshold (int): Level at or below which the item is low
+
+    Returns:
+        str: 'out', 'low' or 'ok'
+    """
+    if quantity == 0:
+        return 'out'
+    return 'low' if quantity <= reorder_threshold else 'ok'
+
+
+class ChangeBus:
+    """
+    In-process publish/subscribe of inventory changes, per store
+
+    Subscribers are callables taking (event, data). They are called on the
+    publishing thread and must not block.
+    """
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, owner_id, deliver):
+        """
+        Start receiving a store's events
+
+        Args:
+            owner_id (int): ID of the user who owns the store
+            deliver (callable): Called with (event, data) for each event
+        """
+        with self._lock:
+            self._subscribers[owner_id].add(deliver)
+
+    def unsubscribe(self, owner_id, deliver):
+        """
+        Stop receiving a store's events
+
+        Args:
+            owner_id (int): ID of the user who owns the store
+            deliver (callable): Callable passed to `subscribe`
+        """
+        with self._lock:
+            subscribers = self._subscribers.get(owner_id)
+            if subscribers is not None:
+                subscribers.discard(deliver)
+                if not subscribers:
+                    del self._subscribers[owner_id]
+
+    def publish(self, owner_id, event, data):
+        """
+        Send an event to every subscriber of a store
+
+        Args:
+            owner_id (int): ID of the user who owns the store
+            event (str): Event name
+            data (dict): JSON-serialisable payload
+        """
+        with self._lock:
+            subscribers = list(self._subscribers.get(owner_id, ()))
+        for deliver in subscribers:
+            deliver(event, data)
+
+    def subscriber_count(self):
+        """
+        Count open subscriptions, for /metrics
+
+        Returns:
+            int: Number of subscribers over all stores
+        """
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+bus = ChangeBus()
+
+
+def read_item(connection, owner_id, item_id=None, name=None):
+    """
+    Read the fields of an item sent in events, by ID or by name
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): Owner the item must belong to
+        item_id (int | None): ID of the item
+        name (str | None): Name of the item, used when no ID is given
+
+    Returns:
+        dict | None: The item with its 'owner_id', or None if the owner has no such item
+    """
+    column, value = ('item_id', item_id) if item_id is not None else ('name', name)
+    row = connection.execute(f'SELECT {", ".join(ITEM_FIELDS)}, owner_id FROM INVENTORY '
+                             f'WHERE {column} = ? AND owner_id = ?', (value, owner_id)).fetchone()
+    return dict(zip(ITEM_FIELDS + ('owner_id',), row)) if row is not None else None
+
+
+def publish_item_change(connection, before, after):
+    """
+    Publish the events for one committed change to an item
+
+    Args:
+        connection (sqlite3.Connection): Connection to read the new inventory version from
+        before (dict | None): The item as read by `read_item` before the change, None if it was added
+        after (dict | None): The item after the change, None if it was deleted
+    """
+    item = after or before
+    if item is None:
+        return
+    owner_id = item['owner_id']
+    version = inventory_version(connection, owner_id)
+    change = 'added' if before is None else 'deleted' if after is None else 'updated'
+    payload = {field: item[field] for field in ITEM_FIELDS}
+    payload['state'] = stock_state(item['quantity'], item['reorder_threshold']) if after is not None else None
+    bus.publish(owner_id, 'item', {'change': change, 'item': payload, 'version': version})
+
+    # A new item counts as previously 'ok', so adding one that is already low raises an alert
+    previous_state = stock_state(before['quantity'], before['reorder_threshold']) if before is not None else 'ok'
+    if after is not None and payload['state'] != previous_state:
+        bus.publish(owner_id, 'alert', {'item_id': item['item_id'], 'name': item['name'],
+                                        'quantity': item['quantity'], 'state': payload['state'],
+                                        'previous_state': previous_state, 'version': version})
+
+
+def publish_reload(connection, owner_id):
+    """
+    Tell a store's open pages to reload, after changes too large to send item by item
+
+    Args:
+        connection (sqlite3.Connection): Connection to read the new inventory version from
+        owner_id (int): ID of the user who owns the store
+    """
+    bus.publish(owner_id, 'reload', {'version': inventory_version(connection, owner_id)})
+
+
+def format_event(event, data):
+    """
+    Encode one server-sent event
+
+    Args:
+        event (str): Event name
+        data (dict): JSON-serialisable payload
+
+    Returns:
+        bytes: The event in the text/event-stream format
+    """
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode('utf-8')
+
+
+class _Stream:
+    # State shared by the thread and asyncio streams: the version the client has seen and overflow handling
+    def __init__(self, version, since):
+        self.version = version
+        self.overflowed = False
+        self.opening = [f'retry: {RETRY_MS}\n\n'.encode('utf-8')]
+        if since is not None and since != version:
+            self.opening.append(format_event('reload', {'version': version}))
+
+    def message(self, event, data):
+        if self.overflowed:
+            # Events were dropped, only a reload can bring the page up to date
+            self.overflowed = False
+            event, data = 'reload', {'version': data.get('version', self.version)}
+        self.version = data.get('version', self.version)
+        return format_event(event, data)
+
+    def idle(self, version):
+        # Changes made by other server processes never reach this process's bus
+        if version != self.version:
+            self.version = version
+            return format_event('reload', {'version': version})
+        return b': keep-alive\n\n'
+
+
+def _version_reader(app, owner_id):
+    # Borrows a connection only for the lookup, an open stream must not hold one from the pool
+    pool = get_pool(app, store_database(app, owner_id))
+
+    def read_version():
+        connection = pool.acquire()
+        try:
+            return inventory_version(connection, owner_id)
+        finally:
+            pool.release(connection)
+    return read_version
+
+
+def stream_events(app, owner_id, since=None):
+    """
+    Generate a store's event stream on the calling thread
+
+    Args:
+        app (Flask): Application the stream belongs to
+        owner_id (int): ID of the user who owns the store
+        since (int | None): Inventory version the client's page was rendered from
+
+    Yields:
+        bytes: Server-sent event messages and keep-alive comments
+    """
+    read_version = _version_reader(app, owner_id)
+    heartbeat = app.config['EVENTS_HEARTBEAT']
+    messages = queue.Queue(maxsize=app.config['EVENTS_QUEUE_SIZE'])
+    stream = _Stream(read_version(), since)
+
+    def deliver(event, data):
+        try:
+            messages.put_nowait((event, data))
+        except queue.Full:
+            stream.overflowed = True
+
+    bus.subscribe(owner_id, deliver)
+    try:
+        yield from stream.opening
+        while True:
+            try:
+                event, data = messages.get(timeout=heartbeat)
+            except queue.Empty:
+                yield stream.idle(read_version())
+                continue
+            yield stream.message(event, data)
+    finally:
+        bus.unsubscribe(owner_id, deliver)
+
+
+def _authenticate(app, scope):
+    # Run the request through Flask's session and login handling to find the user and their version
+    headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']]
+    environ = EnvironBuilder(path=scope['path'], query_string=scope['query_string'].decode('latin-1'),
+                             headers=headers).get_environ()
+    with app.request_context(environ):
+        if not current_user.is_authenticated:
+            return None, None, None
+        return current_user.id, inventory_version(get_db(), current_user.id), request.args.get('since', type=int)
+
+
+def asgi_events(app):
+    """
+    Build an ASGI application serving /events without a thread per stream
+
+    Args:
+        app (Flask): Application whose sessions and database are used
+
+    Returns:
+        callable: ASGI application for HTTP requests to the events route
+    """
+    async def events_app(scope, receive, send):
+        loop = asyncio.get_running_loop()
+        owner_id, version, since = await loop.run_in_executor(None, _authenticate, app, scope)
+        if owner_id is None:
+            await send({'type': 'http.response.start', 'status': 401,
+                        'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Log in to receive events'})
+            return
+
+        read_version = _version_reader(app, owner_id)
+        messages = asyncio.Queue(maxsize=app.config['EVENTS_QUEUE_SIZE'])
+        stream = _Stream(version, since)
+
+        def enqueue(event, data):
+            try:
+                messages.put_nowait((event, data))
+            except asyncio.QueueFull:
+                stream.overflowed = True
+
+        def deliver(event, data):
+            loop.call_soon_threadsafe(enqueue, event, data)
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        bus.subscribe(owner_id, deliver)
+        disconnected = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                    (b'x-accel-buffering', b'no')]})
+            for chunk in stream.opening:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            while not disconnected.done():
+                getter = asyncio.ensure_future(messages.get())
+                done, _ = await asyncio.wait({getter, disconnected}, timeout=app.config['EVENTS_HEARTBEAT'],
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    chunk = stream.message(*getter.result())
+                else:
+                    getter.cancel()
+                    if disconnected in done:
+                        break
+                    chunk = stream.idle(await loop.run_in_executor(None, read_version))
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        except OSError:
+            # The client went away while a message was being sent
+            pass
+        finally:
+            bus.unsubscribe(owner_id, deliver)
+            disconnected.cancel()
+    return events_app
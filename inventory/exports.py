@@ -0,0 +1,423 @@
+"""
+Inventory export writers
+
+Exports read the owner's items from a cursor in batches and produce output
+piece by piece, so memory use does not grow with the size of the catalogue.
+openpyxl is only imported by the XLSX writer, when the first workbook is
+built, so processes that never export do not load it.
+
+The CSV and NDJSON feeds are meant for data pipelines: they carry plain item
+rows, image links at most, and can be limited to items changed since a time
+so a nightly sync only reads what changed through the INVENTORY(owner_id,
+updated_at) index. `gzipped` compresses any of the streams as it is sent.
+"""
+
+
+import base64
+import csv
+import io
+import json
+import time
+import zlib
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+from .metrics import record_phase, timed
+
+
+EXPORT_BATCH_SIZE = 500
+
+# Multiple of 3 so every chunk base64-encodes without padding
+IMAGE_CHUNK_SIZE = 3 * 16 * 1024
+
+# Ways an export can include item images
+IMAGE_MODES = ('inline', 'url', 'none')
+
+# Ways the CSV and NDJSON feeds can include item images, they never carry image data
+FEED_IMAGE_MODES = ('none', 'url')
+
+# Item columns of the CSV and NDJSON feeds, in order; 'image_url' follows them when images are linked
+FEED_FIELDS = ('item_id', 'name', 'description', 'quantity', 'price', 'reorder_threshold', 'updated_at')
+
+# XLSX layout: column headers, widths and the height of item rows, which leaves room for a 60x60 image
+XLSX_HEADERS = ["Name", "Image", "Description", "Quantity", "Price"]
+XLSX_WIDTHS = {"A": 20, "B": 15, "C": 40, "D": 10, "E": 10}
+XLSX_ROW_HEIGHT = 60
+XLSX_IMAGE_SIZE = 60
+
+
+def iter_rows(connection, sql, params, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    """
+    Iterate over the rows of a query, fetching them in batches
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        sql (str): SELECT statement
+        params (tuple): Query parameters
+        batch_size (int): Number of rows fetched at a time
+        progress (callable | None): Called with the number of rows fetched so far before each batch is used
+
+    Yields:
+        sqlite3.Row: Each row of the result
+    """
+    cursor = connection.execute(sql, params)
+    done = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if progress is not None:
+                progress(done)
+            yield from rows
+            done += len(rows)
+        if progress is not None:
+            progress(done)
+    finally:
+        cursor.close()
+
+
+def buffered(pieces, size=64 * 1024):
+    """
+    Join small pieces of output into chunks of roughly `size` bytes
+
+    Args:
+        pieces (iterable): Byte strings to join
+        size (int): Number of bytes to collect before yielding
+
+    Yields:
+        bytes: Chunks of at least `size` bytes, except for the last one
+    """
+    buffer = []
+    length = 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_image_base64(connection, image_id):
+    """
+    Base64-encode a stored image without loading all of it at once
+
+    Args:
+        connection (sqlite3.Connection): Connection to read from
+        image_id (int): IMAGES row of the image
+
+    Yields:
+        bytes: Consecutive pieces of the base64 text
+    """
+    encoding = 0.0
+    with connection.blobopen('IMAGES', 'data', image_id, readonly=True) as blob:
+        while True:
+            chunk = blob.read(IMAGE_CHUNK_SIZE)
+            if not chunk:
+                break
+            start = time.perf_counter()
+            encoded = base64.b64encode(chunk)
+            encoding += time.perf_counter() - start
+            yield encoded
+    record_phase('base64_encode', encoding)
+
+
+def iter_inventory_xml(connection, owner_id, images='inline', image_url=None, batch_size=EXPORT_BATCH_SIZE,
+                       progress=None):
+    """
+    Serialize an owner's inventory as XML, one item at a time
+
+    The document has the same layout as the original tree based export: an
+    <inventory> root with one <item> per row holding <name>, <image>,
+    <description>, <quantity> and <price>.
+
+    Args:
+        connection (sqlite3.Connection): Connection to read from
+        owner_id (int): ID of the user whose items are exported
+        images (str): 'inline' for base64 image data, 'url' for image links or 'none' to leave images out
+        image_url (callable | None): Called with (item_id, image_hash) to build links when images is 'url'
+        batch_size (int): Number of rows fetched from the database at a time
+        progress (callable | None): Called with the number of items written so far, once per batch
+
+    Yields:
+        bytes: Consecutive pieces of the UTF-8 encoded document
+    """
+    yield b"<?xml version='1.0' encoding='utf-8'?>\n<inventory>"
+    rows = iter_rows(connection, 'SELECT item_id, name, image_hash, image_id, description, quantity, price '
+                                 'FROM INVENTORY LEFT JOIN IMAGES ON IMAGES.hash = INVENTORY.image_hash '
+                                 'WHERE owner_id = ? ORDER BY item_id', (owner_id,), batch_size, progress)
+    for item_id, name, item_image_hash, image_id, description, quantity, price in rows:
+        yield f'<item><name>{escape(name)}</name>'.encode('utf-8')
+        if images == 'inline' and image_id is not None:
+            yield b'<image>'
+            yield from iter_image_base64(connection, image_id)
+            yield b'</image>'
+        elif images == 'url' and item_image_hash:
+            yield f'<image>{escape(image_url(item_id, item_image_hash))}</image>'.encode('utf-8')
+        elif images != 'none':
+            yield b'<image />'
+        yield (f'<description>{escape(description)}</description><quantity>{quantity}</quantity>'
+               f'<price>{price:.2f}</price></item>').encode('utf-8')
+    yield b'</inventory>'
+
+
+def _xlsx_styles():
+    from openpyxl.styles import Alignment, PatternFill, Font, NamedStyle
+    header = NamedStyle(name='inventory_header')
+    header.fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+    header.font = Font(color="FFFFFF", bold=True)
+    header.alignment = Alignment(horizontal="center", vertical="center")
+    cell = NamedStyle(name='inventory_cell')
+    cell.alignment = Alignment(horizontal="center", vertical="center")
+    return header, cell
+
+
+def write_inventory_xlsx(connection, owner_id, output, images='inline', image_url=None,
+                         batch_size=EXPORT_BATCH_SIZE, progress=None):
+    """
+    Write an owner's inventory to an XLSX workbook
+
+    The workbook is built in openpyxl's write-only mode, so rows are written
+    out as they are read instead of being kept as cell objects, and every cell
+    shares one of two named styles. Images are embedded from the stored
+    thumbnail, straight from memory. Embedded images are held until the
+    workbook is saved, so use images='none' or 'url' for very large catalogues.
+
+    Args:
+        connection (sqlite3.Connection): Connection to read from
+        owner_id (int): ID of the user whose items are exported
+        output (file | str): Binary file object or path the workbook is saved to
+        images (str): 'inline' to embed thumbnails, 'url' for image links or 'none' to leave images out
+        image_url (callable | None): Called with (item_id, image_hash) to build links when images is 'url'
+        batch_size (int): Number of rows fetched from the database at a time
+        progress (callable | None): Called with the number of items written so far, once per batch
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import Cell, WriteOnlyCell
+    from openpyxl.drawing.image import Image as XLImage
+
+    wb = Workbook(write_only=True)
+    header_style, cell_style = _xlsx_styles()
+    wb.add_named_style(header_style)
+    wb.add_named_style(cell_style)
+    ws = wb.create_sheet("Inventory")
+
+    # Column and row sizes have to be set before any row is written
+    for column, width in XLSX_WIDTHS.items():
+        ws.column_dimensions[column].width = width
+    ws.sheet_format.defaultRowHeight = XLSX_ROW_HEIGHT
+    ws.sheet_format.customHeight = True
+    ws.row_dimensions[1].height = 25
+
+    # Resolve each named style once and copy its style array into new cells
+    style_arrays = {}
+    for name in ('inventory_header', 'inventory_cell'):
+        template = WriteOnlyCell(ws)
+        template.style = name
+        style_arrays[name] = template._style
+
+    def styled(value, style):
+        return Cell(ws, row=1, column=1, value=value, style_array=style_arrays[style])
+
+    ws.append([styled(header, 'inventory_header') for header in XLSX_HEADERS])
+
+    # Use the thumbnail when there is one, the image is shrunk to 60x60 anyway
+    if images == 'inline':
+        image_column = "COALESCE(thumb.data, original.data)"
+        image_joins = ("LEFT JOIN image_renditions AS thumb ON thumb.hash = image_hash AND thumb.rendition = 'thumb' "
+                       "LEFT JOIN images AS original ON original.hash = image_hash AND thumb.hash IS NULL ")
+    else:
+        image_column = "NULL"
+        image_joins = ""
+    rows = iter_rows(connection, f"SELECT item_id, name, image_hash, {image_column}, description, quantity, price "
+                                 f"FROM inventory {image_joins}WHERE owner_id = ? ORDER BY item_id",
+                     (owner_id,), batch_size, progress)
+    row_index = 2
+    with timed('xlsx_rows'):
+        for item_id, name, item_image_hash, image_blob, description, quantity, price in rows:
+            link = image_url(item_id, item_image_hash) if images == 'url' and item_image_hash else None
+            ws.append([styled(name, 'inventory_cell'), link, styled(description, 'inventory_cell'),
+                       styled(quantity, 'inventory_cell'), styled(f'{price:.2f}', 'inventory_cell')])
+            if image_blob:
+                try:
+                    img = XLImage(io.BytesIO(image_blob))
+                except OSError:
+                    # Not an image Pillow can read, leave the cell empty
+                    img = None
+                if img is not None:
+                    img.height = XLSX_IMAGE_SIZE
+                    img.width = XLSX_IMAGE_SIZE
+                    ws.add_image(img, f"B{row_index}")
+            row_index += 1
+
+    with timed('xlsx_save'):
+        wb.save(output)
+
+
+def parse_since(value):
+    """
+    Read the 'since' time of an incremental export
+
+    Args:
+        value (str | None): ISO 8601 date or date and time; times without an offset are taken as UTC
+
+    Returns:
+        str | None: The time as 'YYYY-MM-DD HH:MM:SS' UTC, comparable with updated_at, or None if not given
+
+    Raises:
+        ValueError: If the value is not an ISO 8601 date or time
+    """
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise ValueError('since must be an ISO 8601 date or time, e.g. 2024-05-01T00:00:00Z')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def export_timestamp(connection):
+    """
+    Read the database's current time, to be passed as 'since' by the next incremental export
+
+    Items changed while an export runs get this time or a later one, and
+    'since' includes items changed at exactly that second, so nothing is missed
+    between two syncs; at worst an item is sent twice.
+
+    Args:
+        connection (sqlite3.Connection): Connection to read from
+
+    Returns:
+        str: Current time as 'YYYY-MM-DDTHH:MM:SSZ'
+    """
+    return connection.execute("SELECT strftime('%Y-%m-%dT%H:%M:%SZ', 'now')").fetchone()[0]
+
+
+def iter_feed_batches(connection, owner_id, images='none', image_url=None, since=None, batch_size=EXPORT_BATCH_SIZE,
+                      progress=None):
+    """
+    Iterate over the item records of a CSV or NDJSON feed a batch at a time
+
+    Without `since` the items come in item_id order. With it, only items
+    changed at or after that time are read, in updated_at order, straight
+    from the INVENTORY(owner_id, updated_at) index. Feeds write each batch in
+    one go, which is much cheaper than writing the records one by one.
+
+    Args:
+        connection (sqlite3.Connection): Connection to read from
+        owner_id (int): ID of the user whose items are exported
+        images (str): 'none' to leave images out or 'url' to end each record with its image link
+        image_url (callable | None): Called with (item_id, image_hash) to build links when images is 'url'
+        since (str | None): UTC time from `parse_since`
+        batch_size (int): Number of rows fetched from the database at a time
+        progress (callable | None): Called with the number of items read so far, once per batch
+
+    Yields:
+        list: Up to `batch_size` records, each a sequence of the FEED_FIELDS values and the image link if asked for
+    """
+    columns = ', '.join(FEED_FIELDS + (('image_hash',) if images == 'url' else ()))
+    if since is None:
+        sql = f'SELECT {columns} FROM INVENTORY WHERE owner_id = ? ORDER BY item_id'
+        params = (owner_id,)
+    else:
+        sql = f'SELECT {columns} FROM INVENTORY WHERE owner_id = ? AND updated_at >= ? ORDER BY updated_at, item_id'
+        params = (owner_id, since)
+    cursor = connection.execute(sql, params)
+    done = 0
+    try:
+        while True:
+            if progress is not None:
+                progress(done)
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if images == 'url':
+                rows = [row[:-1] + (image_url(row[0], row[-1]) if row[-1] else None,) for row in rows]
+            yield rows
+            done += len(rows)
+    finally:
+        cursor.close()
+
+
+def _feed_fields(images):
+    return FEED_FIELDS + (('image_url',) if images == 'url' else ())
+
+
+def iter_inventory_csv(connection, owner_id, images='none', image_url=None, since=None,
+                       batch_size=EXPORT_BATCH_SIZE, progress=None):
+    """
+    Serialize an owner's items as CSV with a header row
+
+    Args:
+        connection (sqlite3.Connection): Connection to read from
+        owner_id (int): ID of the user whose items are exported
+        images (str): 'none' to leave images out or 'url' to add an image_url column
+        image_url (callable | None): Called with (item_id, image_hash) to build links when images is 'url'
+        since (str | None): Only export items changed at or after this UTC time, from `parse_since`
+        batch_size (int): Number of rows fetched from the database at a time
+        progress (callable | None): Called with the number of items read so far, once per batch
+
+    Yields:
+        bytes: Consecutive pieces of the UTF-8 encoded file, one per batch of rows
+    """
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(_feed_fields(images))
+    yield text.getvalue().encode('utf-8')
+    for records in iter_feed_batches(connection, owner_id, images, image_url, since, batch_size, progress):
+        text.seek(0)
+        text.truncate()
+        writer.writerows(records)
+        yield text.getvalue().encode('utf-8')
+
+
+def iter_inventory_ndjson(connection, owner_id, images='none', image_url=None, since=None,
+                          batch_size=EXPORT_BATCH_SIZE, progress=None):
+    """
+    Serialize an owner's items as newline delimited JSON, one object per item
+
+    Args:
+        connection (sqlite3.Connection): Connection to read from
+        owner_id (int): ID of the user whose items are exported
+        images (str): 'none' to leave images out or 'url' to add an image_url field
+        image_url (callable | None): Called with (item_id, image_hash) to build links when images is 'url'
+        since (str | None): Only export items changed at or after this UTC time, from `parse_since`
+        batch_size (int): Number of rows fetched from the database at a time
+        progress (callable | None): Called with the number of items read so far, once per batch
+
+    Yields:
+        bytes: Consecutive pieces of the UTF-8 encoded lines, one per batch of items
+    """
+    fields = _feed_fields(images)
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for records in iter_feed_batches(connection, owner_id, images, image_url, since, batch_size, progress):
+        lines = [encode(dict(zip(fields, record))) for record in records]
+        lines.append('')
+        yield '\n'.join(lines).encode('utf-8')
+
+
+def gzipped(chunks, level=6):
+    """
+    Gzip a stream of bytes as it is produced
+
+    Only the compressor's window is kept in memory, and every input chunk is
+    flushed so the client receives data while the export is still running.
+
+    Args:
+        chunks (iterable): Byte strings to compress, ideally already `buffered`
+        level (int): zlib compression level
+
+    Yields:
+        bytes: Consecutive pieces of the gzip stream
+    """
+    # wbits 16 + 15 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,406 @@
+"""
+Item image helpers
+
+Images live in a content-addressed store: the IMAGES table holds each distinct
+image once, keyed by its SHA-256, and items refer to it by that hash, so items
+sharing a photo share one copy and item queries never carry image BLOBs.
+Triggers count the items referring to each image and `collect_garbage` removes
+images nobody uses any more.
+
+Next to the original every stored image gets smaller renditions, generated
+once when the image is first stored and kept in IMAGE_RENDITIONS. List pages
+and the XLSX export use the thumbnail and only the image route reads the
+original. Images are served by their own route, so pages only carry an image
+URL and the browser can cache the bytes.
+"""
+
+
+import hashlib
+import io
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from flask import url_for
+
+
+# Leading bytes of the image formats browsers can display
+_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+]
+
+
+# Rendition name -> bounding box, largest first so each can be made from the previous one
+RENDITIONS = {
+    'medium': (600, 600),
+    'thumb': (120, 120),
+}
+
+JPEG_QUALITY = 85
+
+# Bytes read from an upload at a time while it is hashed and copied into the image store
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def detect_mime(data):
+    """
+    Detect the MIME type of an image from its first bytes
+
+    Args:
+        data (bytes): Start of the image, at least 12 bytes to detect every format
+
+    Returns:
+        str: MIME type, 'application/octet-stream' if the format is unknown
+    """
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    return 'application/octet-stream'
+
+
+def image_hash(data):
+    """
+    Hash image bytes for use as a strong ETag
+
+    Args:
+        data (bytes | None): Image bytes
+
+    Returns:
+        str | None: Hex SHA-256 digest, or None when there is no image
+    """
+    if data is None:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_url(item_id, item_image_hash, size='thumb', **kwargs):
+    """
+    Build the URL of an item's image for use in templates
+
+    The image hash is part of the URL so a changed image gets a new URL and
+    browsers can cache each one for good.
+
+    Args:
+        item_id (int): ID of the item
+        item_image_hash (str | None): SHA-256 of the stored image
+        size (str): Rendition name or 'original'
+        **kwargs: Extra arguments for url_for, such as _external
+
+    Returns:
+        str | None: Image URL, or None if the item has no image
+    """
+    if not item_image_hash:
+        return None
+    return url_for('main.item_image', item_id=item_id, size=size, v=item_image_hash[:16], **kwargs)
+
+
+def external_image_url(item_id, item_image_hash):
+    """
+    Build the absolute URL of an item's original image, for use in exports
+
+    Args:
+        item_id (int): ID of the item
+        item_image_hash (str | None): SHA-256 of the stored image
+
+    Returns:
+        str | None: Absolute image URL, or None if the item has no image
+    """
+    return image_url(item_id, item_image_hash, 'original', _external=True)
+
+
+def _encode(img):
+    output = io.BytesIO()
+    if img.mode in ('RGBA', 'LA'):
+        img.save(output, format='PNG', optimize=True)
+        return 'image/png', output.getvalue()
+    img.convert('RGB').save(output, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+    return 'image/jpeg', output.getvalue()
+
+
+def make_renditions(data):
+    """
+    Generate the renditions of an uploaded image
+
+    The image is rotated upright using its EXIF orientation, converted to RGB
+    (or RGBA if it has transparency) and scaled down to fit each rendition's
+    bounding box. Opaque images are stored as JPEG, transparent ones as PNG.
+
+    Args:
+        data (bytes | file): Original image bytes, or a seekable binary file holding them
+
+    Returns:
+        dict: Rendition name -> (mime, bytes), empty if Pillow cannot read the image
+    """
+    # Imported here, only processes that resize images need Pillow loaded
+    from PIL import Image, ImageOps
+
+    try:
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+        data.seek(0)
+        img = Image.open(data)
+        # Let the JPEG decoder downscale while decoding, it is much cheaper than a full decode
+        img.draft('RGB', max(RENDITIONS.values()))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            has_alpha = img.mode in ('LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        renditions = {}
+        for name, size in RENDITIONS.items():
+            img = img.copy()
+            img.thumbnail(size, Image.LANCZOS)
+            renditions[name] = _encode(img)
+        return renditions
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return {}
+
+
+def store_renditions(connection, item_image_hash, renditions):
+    """
+    Save the renditions of a stored image, replacing any existing ones
+
+    Args:
+        connection (sqlite3.Connection): Connection inside the caller's transaction
+        item_image_hash (str): SHA-256 of the image
+        renditions (dict): Output of `make_renditions`
+    """
+    connection.execute('DELETE FROM IMAGE_RENDITIONS WHERE hash = ?', (item_image_hash,))
+    connection.executemany('INSERT INTO IMAGE_RENDITIONS (hash, rendition, mime, data) VALUES (?, ?, ?, ?)',
+                           [(item_image_hash, name, mime, data) for name, (mime, data) in renditions.items()])
+
+
+def image_exists(connection, item_image_hash):
+    """
+    Check whether an image is already in the store
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        item_image_hash (str): SHA-256 of the image
+
+    Returns:
+        bool: True if the image is stored
+    """
+    return connection.execute('SELECT 1 FROM IMAGES WHERE hash = ?', (item_image_hash,)).fetchone() is not None
+
+
+def put_image(connection, data, renditions=None):
+    """
+    Add an image to the store unless an identical one is already there
+
+    Call inside the transaction that saves the item referring to the image,
+    so garbage collection cannot remove it in between. Renditions are only
+    stored with a new image; check `image_exists` first to avoid generating
+    them for an image that is already stored.
+
+    Args:
+        connection (sqlite3.Connection): Connection inside the caller's transaction
+        data (bytes): Image bytes
+        renditions (dict | None): Output of `make_renditions` for the image
+
+    Returns:
+        str: SHA-256 of the image, to store in INVENTORY.image_hash
+    """
+    item_image_hash = image_hash(data)
+    cursor = connection.execute('INSERT INTO IMAGES (hash, mime, size, data) VALUES (?, ?, ?, ?) '
+                                'ON CONFLICT(hash) DO NOTHING',
+                                (item_image_hash, detect_mime(data[:16]), len(data), data))
+    if cursor.rowcount and renditions:
+        store_renditions(connection, item_image_hash, renditions)
+    return item_image_hash
+
+
+def scan_upload(stream):
+    """
+    Check, measure and hash an uploaded image, reading it a chunk at a time
+
+    Args:
+        stream (file): Seekable binary file holding the upload
+
+    Returns:
+        tuple: (SHA-256, size in bytes, MIME type)
+
+    Raises:
+        ValueError: If the upload does not start like a JPEG, PNG, GIF, WebP, BMP or TIFF image
+    """
+    stream.seek(0)
+    header = stream.read(16)
+    mime = detect_mime(header)
+    if mime == 'application/octet-stream':
+        raise ValueError('not a JPEG, PNG, GIF, WebP, BMP or TIFF image')
+    digest = hashlib.sha256(header)
+    size = len(header)
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size, mime
+
+
+def put_image_stream(connection, stream, scan, renditions=None):
+    """
+    Add an uploaded image to the store without holding it in memory as a whole
+
+    Like `put_image`, but the IMAGES row is created with a zero-filled BLOB of
+    the upload's size and the upload is copied into it a chunk at a time with
+    incremental BLOB I/O. An image that is already stored is not copied again.
+
+    Args:
+        connection (sqlite3.Connection): Connection inside the caller's transaction
+        stream (file): Seekable binary file holding the upload
+        scan (tuple): Output of `scan_upload` for the upload
+        renditions (dict | None): Output of `make_renditions` for the image
+
+    Returns:
+        str: SHA-256 of the image, to store in INVENTORY.image_hash
+    """
+    item_image_hash, size, mime = scan
+    cursor = connection.execute('INSERT INTO IMAGES (hash, mime, size, data) VALUES (?, ?, ?, zeroblob(?)) '
+                                'ON CONFLICT(hash) DO NOTHING', (item_image_hash, mime, size, size))
+    if cursor.rowcount:
+        stream.seek(0)
+        with connection.blobopen('IMAGES', 'data', cursor.lastrowid) as blob:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                blob.write(chunk)
+        if renditions:
+            store_renditions(connection, item_image_hash, renditions)
+    return item_image_hash
+
+
+def recount_references(connection):
+    """
+    Recompute every image's reference count from INVENTORY
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        int: Number of images whose count was wrong
+    """
+    with connection:
+        cursor = connection.execute('UPDATE IMAGES SET refcount = (SELECT COUNT(*) FROM INVENTORY '
+                                    'WHERE INVENTORY.image_hash = IMAGES.hash) '
+                                    'WHERE refcount != (SELECT COUNT(*) FROM INVENTORY '
+                                    'WHERE INVENTORY.image_hash = IMAGES.hash)')
+    return cursor.rowcount
+
+
+def collect_garbage(connection):
+    """
+    Delete stored images and renditions that no item refers to
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        tuple: (number of images deleted, bytes freed)
+    """
+    with connection:
+        count, freed = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM IMAGES '
+                                          'WHERE refcount <= 0').fetchone()
+        connection.execute('DELETE FROM IMAGE_RENDITIONS WHERE hash IN (SELECT hash FROM IMAGES WHERE refcount <= 0)')
+        connection.execute('DELETE FROM IMAGES WHERE refcount <= 0')
+    return count, freed
+
+
+def image_store_needs_migration(connection):
+    """
+    Check whether a database still keeps images inline in INVENTORY
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        bool: True if INVENTORY has the old image column or ITEM_IMAGES exists
+    """
+    columns = {row[1].lower() for row in connection.execute('PRAGMA table_info(INVENTORY)')}
+    return 'image' in columns or connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'ITEM_IMAGES'").fetchone() is not None
+
+
+def migrate_image_store(connection):
+    """
+    Move images kept inline in INVENTORY into the image store
+
+    Each distinct image is copied into IMAGES once, renditions from the old
+    per-item ITEM_IMAGES table are kept, reference counts are computed and
+    the old column and table are dropped. Runs in one transaction. Run
+    VACUUM afterwards to give the freed space back to the file system.
+
+    Args:
+        connection (sqlite3.Connection): Connection to a database with the current schema applied
+
+    Returns:
+        int: Number of distinct images stored
+    """
+    columns = {row[1].lower() for row in connection.execute('PRAGMA table_info(INVENTORY)')}
+    has_item_images = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'ITEM_IMAGES'").fetchone()
+    connection.create_function('image_mime', 1, lambda data: detect_mime(data[:16]), deterministic=True)
+    with connection:
+        before = connection.execute('SELECT COUNT(*) FROM IMAGES').fetchone()[0]
+        if 'image' in columns:
+            connection.execute('UPDATE INVENTORY SET image_hash = sha256(image) '
+                               'WHERE image IS NOT NULL AND image_hash IS NULL')
+            connection.execute('INSERT INTO IMAGES (hash, mime, size, data) '
+                               'SELECT image_hash, image_mime(image), length(image), image FROM INVENTORY '
+                               'WHERE image IS NOT NULL ORDER BY item_id '
+                               'ON CONFLICT(hash) DO NOTHING')
+        if has_item_images:
+            connection.execute('INSERT INTO IMAGE_RENDITIONS (hash, rendition, mime, data) '
+                               'SELECT i.image_hash, r.rendition, r.mime, r.data '
+                               'FROM ITEM_IMAGES AS r JOIN INVENTORY AS i ON i.item_id = r.item_id '
+                               'WHERE i.image_hash IS NOT NULL '
+                               'ON CONFLICT(hash, rendition) DO NOTHING')
+            connection.execute('DROP TRIGGER IF EXISTS inventory_delete_images')
+            connection.execute('DROP TABLE ITEM_IMAGES')
+        connection.execute('UPDATE IMAGES SET refcount = (SELECT COUNT(*) FROM INVENTORY '
+                           'WHERE INVENTORY.image_hash = IMAGES.hash)')
+        stored = connection.execute('SELECT COUNT(*) FROM IMAGES').fetchone()[0] - before
+    if 'image' in columns:
+        try:
+            connection.execute('ALTER TABLE INVENTORY DROP COLUMN image')
+        except sqlite3.OperationalError:
+            # SQLite before 3.35 cannot drop columns, the emptied column stays
+            with connection:
+                connection.execute('UPDATE INVENTORY SET image = NULL WHERE image IS NOT NULL')
+    return stored
+
+
+def backfill_renditions(connection, workers=None, batch_size=32):
+    """
+    Generate renditions for every stored image that does not have them yet
+
+    Images are decoded and resized in a process pool, one batch at a time, and
+    each batch is saved in its own transaction.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+        workers (int | None): Number of worker processes, defaults to the CPU count
+        batch_size (int): Number of images loaded and processed per batch
+
+    Returns:
+        int: Number of images that got renditions
+    """
+    done = 0
+    last_id = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            rows = connection.execute(
+                'SELECT image_id, hash, data FROM IMAGES WHERE image_id > ? '
+                'AND NOT EXISTS (SELECT 1 FROM IMAGE_RENDITIONS WHERE IMAGE_RENDITIONS.hash = IMAGES.hash) '
+                'ORDER BY image_id LIMIT ?', (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            results = executor.map(make_renditions, [row[2] for row in rows])
+            with connection:
+                for row, renditions in zip(rows, results):
+                    if renditions:
+                        store_renditions(connection, row[1], renditions)
+                        done += 1
+    return done
@@ -0,0 +1,399 @@
+"""
+Bulk inventory import
+
+Items can be loaded from CSV, XLSX or the XML format written by the XML
+export. Files are parsed as a stream, one record at a time, and records are
+written with `executemany` in large batches, one transaction per batch. Items
+whose name already exists in the store are updated in place. Records that
+cannot be imported are reported with their line (or row) number and skipped
+without stopping the rest of the import.
+
+Recognised fields, matched case-insensitively against the CSV/XLSX header
+row or the XML element names: name, description, quantity, price, image
+(base64 data) and reorder_threshold.
+"""
+
+
+import base64
+import binascii
+import csv
+import io
+import math
+import sqlite3
+import xml.etree.ElementTree as ET
+import zipfile
+from .images import image_hash, image_exists, make_renditions, put_image
+from .queries import SQLITE_MAX_INTEGER, SQLITE_MIN_INTEGER
+
+
+IMPORT_FORMATS = ('csv', 'xlsx', 'xml')
+IMPORT_BATCH_SIZE = 1000
+
+# Only the first errors are kept in the report, the rest are only counted
+MAX_REPORTED_ERRORS = 500
+
+_UPSERT_SQL = '''
+    INSERT INTO INVENTORY (name, image_hash, description, quantity, price, owner_id, reorder_threshold, updated_at)
+    VALUES (:name, :image_hash, :description, :quantity, :price, :owner_id, COALESCE(:reorder_threshold, 10),
+            CURRENT_TIMESTAMP)
+    ON CONFLICT(owner_id, name) DO UPDATE SET
+        image_hash = COALESCE(excluded.image_hash, image_hash),
+        description = excluded.description,
+        quantity = excluded.quantity,
+        price = excluded.price,
+        reorder_threshold = COALESCE(:reorder_threshold, reorder_threshold),
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+
+def detect_format(filename):
+    """
+    Guess the import format from a file name
+
+    Args:
+        filename (str): Name of the uploaded or given file
+
+    Returns:
+        str | None: One of IMPORT_FORMATS, or None if the extension is not recognised
+    """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def _normalize(record):
+    return {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+
+
+def iter_csv(stream):
+    """
+    Read records from a CSV file with a header row
+
+    Args:
+        stream (file): Binary file object
+
+    Yields:
+        tuple: (line number, record dict)
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    for record in reader:
+        yield reader.line_num, _normalize(record)
+
+
+def iter_xlsx(stream):
+    """
+    Read records from the first sheet of an XLSX workbook with a header row
+
+    The workbook is opened in read-only mode, which streams rows instead of
+    loading the whole sheet.
+
+    Args:
+        stream (file): Seekable binary file object
+
+    Yields:
+        tuple: (row number, record dict)
+    """
+    # Imported here, openpyxl is slow to load and only XLSX imports need it
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        wb = load_workbook(stream, read_only=True, data_only=True)
+    except InvalidFileException as error:
+        # Reported like any other unreadable archive
+        raise zipfile.BadZipFile(str(error)) from error
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        for row_number, row in enumerate(rows, start=2):
+            if not any(value is not None for value in row):
+                continue
+            yield row_number, _normalize(dict(zip(header, row)))
+    finally:
+        wb.close()
+
+
+def iter_xml(stream):
+    """
+    Read <item> records from an XML export
+
+    Each item is discarded as soon as it has been read, so the document is
+    never held in memory as a whole.
+
+    Args:
+        stream (file): Binary file object
+
+    Yields:
+        tuple: (item number, record dict)
+    """
+    root = None
+    count = 0
+    for event, element in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            continue
+        if element.tag == 'item':
+            count += 1
+            yield count, {child.tag.lower(): child.text for child in element}
+            root.clear()
+
+
+PARSERS = {
+    'csv': iter_csv,
+    'xlsx': iter_xlsx,
+    'xml': iter_xml,
+}
+
+
+def parse_whole_number(value, field):
+    """
+    Read a whole number such as a quantity from an import value
+
+    Whole floats are accepted, since spreadsheet cells hold numbers as
+    floats, but fractions are refused rather than truncated.
+
+    Args:
+        value (int | float | str): Raw value
+        field (str): Field name for error messages
+
+    Returns:
+        int: The number
+
+    Raises:
+        ValueError: If the value is not a whole number or does not fit in an SQLite integer
+    """
+    number = value.strip() if isinstance(value, str) else value
+    if isinstance(number, str):
+        try:
+            number = int(number)
+        except ValueError:
+            try:
+                number = float(number)
+            except ValueError:
+                raise ValueError(f'invalid {field} {value!r}')
+    if isinstance(number, bool) or not isinstance(number, (int, float)):
+        raise ValueError(f'invalid {field} {value!r}')
+    if isinstance(number, float):
+        if not number.is_integer():
+            raise ValueError(f'invalid {field} {value!r}, it must be a whole number')
+        number = int(number)
+    if not SQLITE_MIN_INTEGER <= number <= SQLITE_MAX_INTEGER:
+        raise ValueError(f'{field} {value!r} is out of range')
+    return number
+
+
+def parse_integer(value, field, label):
+    """
+    Read an integer from a JSON request value
+
+    Unlike spreadsheet cells, JSON clients send integers as integers, so
+    floats are refused along with booleans and other types. Numeric strings
+    are accepted.
+
+    Args:
+        value (object): Raw value
+        field (str): Field name for error messages
+        label (str): Which record the value belongs to, e.g. 'adjustment 3', prefixed to error messages
+
+    Returns:
+        int: The number
+
+    Raises:
+        ValueError: If the value is not an integer or does not fit in an SQLite integer
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'{label}: {field} must be an integer')
+    try:
+        return parse_whole_number(value, field)
+    except ValueError as error:
+        raise ValueError(f'{label}: {error}')
+
+
+def parse_price(value, field='price'):
+    """
+    Read a price from an import value
+
+    Args:
+        value (int | float | str): Raw value
+        field (str): Field name for error messages
+
+    Returns:
+        float: The price
+
+    Raises:
+        ValueError: If the value is not a finite number
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f'invalid {field} {value!r}')
+    try:
+        price = float(value)
+    except (ValueError, OverflowError):
+        raise ValueError(f'invalid {field} {value!r}')
+    if not math.isfinite(price):
+        raise ValueError(f'invalid {field} {value!r}, it must be a finite number')
+    return price
+
+
+def parse_record(record, owner_id):
+    """
+    Validate an import record and turn it into upsert parameters
+
+    Args:
+        record (dict): Field name -> raw value
+        owner_id (int): ID of the user the item belongs to
+
+    Returns:
+        dict: Named parameters for the upsert statement
+
+    Raises:
+        ValueError: If a required field is missing or a value is invalid
+    """
+    def text(field):
+        value = record.get(field)
+        return '' if value is None else str(value).strip()
+
+    name = text('name')
+    if not name:
+        raise ValueError('name is required')
+    description = text('description')
+    if not description:
+        raise ValueError('description is required')
+    quantity = parse_whole_number(text('quantity'), 'quantity')
+    if quantity < 0:
+        raise ValueError(f'quantity {quantity} cannot be negative')
+    price = parse_price(text('price'))
+
+    reorder_threshold = None
+    if text('reorder_threshold'):
+        reorder_threshold = max(0, parse_whole_number(text('reorder_threshold'), 'reorder_threshold'))
+
+    image = None
+    image_text = text('image')
+    if image_text:
+        try:
+            image = base64.b64decode(image_text, validate=True)
+        except (binascii.Error, ValueError):
+            # Exports made with linked images carry URLs, which cannot be imported
+            if not image_text.startswith(('http://', 'https://', '/')):
+                raise ValueError('image is not valid base64 data')
+
+    return {
+        'name': name,
+        'image': image,
+        'image_hash': image_hash(image),
+        'description': description,
+        'quantity': quantity,
+        'price': price,
+        'owner_id': owner_id,
+        'reorder_threshold': reorder_threshold,
+    }
+
+
+class ImportReport:
+    """
+    Outcome of an import
+
+    Attributes:
+        processed (int): Number of records read from the file
+        imported (int): Number of items inserted or updated
+        error_count (int): Number of records that were skipped
+        errors (list): (line number, message) for the first MAX_REPORTED_ERRORS skipped records
+    """
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        """
+        Record a skipped record
+
+        Args:
+            line (int): Line, row or item number of the record
+            message (str): Why it was skipped
+        """
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def to_dict(self):
+        """
+        Convert the report for a JSON response
+
+        Returns:
+            dict: Counts and errors
+        """
+        return {
+            'processed': self.processed,
+            'imported': self.imported,
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'message': message} for line, message in self.errors],
+        }
+
+
+def _write_batch(connection, batch, report):
+    # Images already in the store keep their renditions, only new ones are resized
+    images = {}
+    for _, params in batch:
+        if params['image'] and params['image_hash'] not in images:
+            new = not image_exists(connection, params['image_hash'])
+            images[params['image_hash']] = (params['image'], make_renditions(params['image']) if new else None)
+
+    def store_images(rows):
+        for _, params in rows:
+            if params['image']:
+                put_image(connection, *images[params['image_hash']])
+
+    try:
+        with connection:
+            store_images(batch)
+            connection.executemany(_UPSERT_SQL, [params for _, params in batch])
+        report.imported += len(batch)
+    except (sqlite3.Error, OverflowError):
+        # Something in the batch was rejected, retry row by row to find it
+        for line, params in batch:
+            try:
+                with connection:
+                    store_images([(line, params)])
+                    connection.execute(_UPSERT_SQL, params)
+                report.imported += 1
+            except (sqlite3.Error, OverflowError) as error:
+                report.add_error(line, str(error))
+
+
+def import_inventory(connection, owner_id, stream, file_format, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Import items from a file into an owner's inventory
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+        owner_id (int): ID of the user the items belong to
+        stream (file): Binary file object, seekable for XLSX
+        file_format (str): One of IMPORT_FORMATS
+        batch_size (int): Number of records written per transaction
+
+    Returns:
+        ImportReport: Counts and per-record errors
+    """
+    report = ImportReport()
+    batch = []
+    try:
+        for line, record in PARSERS[file_format](stream):
+            report.processed += 1
+            try:
+                batch.append((line, parse_record(record, owner_id)))
+            except ValueError as error:
+                report.add_error(line, str(error))
+            if len(batch) >= batch_size:
+                _write_batch(connection, batch, report)
+                batch = []
+    except (csv.Error, ET.ParseError, UnicodeDecodeError, OSError, KeyError, zipfile.BadZipFile) as error:
+        # The rest of the file cannot be read, keep what was imported so far
+        report.add_error(report.processed + 1, f'could not read file: {error}')
+    if batch:
+        _write_batch(connection, batch, report)
+    return report
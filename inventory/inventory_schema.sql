@@ -5,13 +5,273 @@ CREATE TABLE IF NOT EXISTS USERS(
     store_name TEXT NOT NULL
 );
 
+-- Tokens integrations use to call the JSON API instead of logging in. Only a SHA-256 of each token is
+-- kept, the token itself is shown once when it is created.
+CREATE TABLE IF NOT EXISTS API_TOKENS(
+    token_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    token_hash TEXT NOT NULL UNIQUE,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES USERS(user_id) ON DELETE CASCADE
+);
+
 CREATE TABLE IF NOT EXISTS INVENTORY(
     item_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL UNIQUE,
-    image BLOB,
+    name TEXT NOT NULL,
     description TEXT NOT NULL,
     quantity INTEGER NOT NULL,
     price REAL NOT NULL,
     owner_id INTEGER NOT NULL,
-    FOREIGN KEY (owner_id) REFERENCES Users(user_id) ON DELETE CASCADE
-);
\ No newline at end of file
+    image_hash TEXT,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    reorder_threshold INTEGER NOT NULL DEFAULT 10,
+    FOREIGN KEY (owner_id) REFERENCES Users(user_id) ON DELETE CASCADE,
+    UNIQUE(owner_id, name)
+);
+
+-- Content-addressed image store: each distinct image is stored once, keyed by its SHA-256, and items
+-- refer to it through INVENTORY.image_hash. refcount is the number of items using the image, kept by
+-- the triggers below; unreferenced images are removed by the gc-images command.
+CREATE TABLE IF NOT EXISTS IMAGES(
+    image_id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    mime TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    data BLOB NOT NULL
+);
+
+-- Scaled down copies of each stored image, generated when the image is first stored
+CREATE TABLE IF NOT EXISTS IMAGE_RENDITIONS(
+    hash TEXT NOT NULL,
+    rendition TEXT NOT NULL,
+    mime TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (hash, rendition)
+);
+
+CREATE INDEX IF NOT EXISTS idx_inventory_image_hash ON INVENTORY(image_hash) WHERE image_hash IS NOT NULL;
+
+CREATE TRIGGER IF NOT EXISTS inventory_image_ref_insert AFTER INSERT ON INVENTORY
+    WHEN NEW.image_hash IS NOT NULL
+BEGIN
+    UPDATE IMAGES SET refcount = refcount + 1 WHERE hash = NEW.image_hash;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_image_ref_delete AFTER DELETE ON INVENTORY
+    WHEN OLD.image_hash IS NOT NULL
+BEGIN
+    UPDATE IMAGES SET refcount = refcount - 1 WHERE hash = OLD.image_hash;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_image_ref_update AFTER UPDATE OF image_hash ON INVENTORY
+    WHEN NEW.image_hash IS NOT OLD.image_hash
+BEGIN
+    UPDATE IMAGES SET refcount = refcount - 1 WHERE hash = OLD.image_hash;
+    UPDATE IMAGES SET refcount = refcount + 1 WHERE hash = NEW.image_hash;
+END;
+
+-- Background XML/XLSX exports, finished files live in the export spool directory
+CREATE TABLE IF NOT EXISTS EXPORT_JOBS(
+    job_id TEXT PRIMARY KEY,
+    owner_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    images TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_export_jobs_created ON EXPORT_JOBS(created_at);
+
+-- Listing indexes: each serves one sort order of an owner's items and its keyset pagination
+CREATE INDEX IF NOT EXISTS idx_inventory_owner ON INVENTORY(owner_id, item_id);
+CREATE INDEX IF NOT EXISTS idx_inventory_owner_name ON INVENTORY(owner_id, name, item_id);
+CREATE INDEX IF NOT EXISTS idx_inventory_owner_quantity ON INVENTORY(owner_id, quantity, item_id);
+CREATE INDEX IF NOT EXISTS idx_inventory_owner_price ON INVENTORY(owner_id, price, item_id);
+
+-- Items changed since a time, for incremental CSV and NDJSON exports; item_id is implied as the rowid
+CREATE INDEX IF NOT EXISTS idx_inventory_owner_updated ON INVENTORY(owner_id, updated_at);
+
+-- Holds only items at or below their reorder threshold, for the low stock page
+CREATE INDEX IF NOT EXISTS idx_inventory_low_stock ON INVENTORY(owner_id, quantity, item_id, reorder_threshold)
+    WHERE quantity <= reorder_threshold;
+
+-- Full-text search over item names and descriptions. The owner is indexed as an 'o<owner_id>'
+-- token so searches can be scoped to one store inside the index.
+CREATE VIEW IF NOT EXISTS INVENTORY_SEARCH_SOURCE AS
+    SELECT item_id, name, description, 'o' || owner_id AS owner_key FROM INVENTORY;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS INVENTORY_FTS USING fts5(
+    name,
+    description,
+    owner_key,
+    content='INVENTORY_SEARCH_SOURCE',
+    content_rowid='item_id',
+    prefix='2 3',
+    tokenize='unicode61 remove_diacritics 2'
+);
+
+-- Rank name matches above description matches, the owner token does not count
+INSERT INTO INVENTORY_FTS(INVENTORY_FTS, rank) VALUES ('rank', 'bm25(10.0, 1.0, 0.0)');
+
+CREATE TRIGGER IF NOT EXISTS inventory_fts_insert AFTER INSERT ON INVENTORY
+BEGIN
+    INSERT INTO INVENTORY_FTS(rowid, name, description, owner_key)
+        VALUES (NEW.item_id, NEW.name, NEW.description, 'o' || NEW.owner_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_fts_delete AFTER DELETE ON INVENTORY
+BEGIN
+    INSERT INTO INVENTORY_FTS(INVENTORY_FTS, rowid, name, description, owner_key)
+        VALUES ('delete', OLD.item_id, OLD.name, OLD.description, 'o' || OLD.owner_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_fts_update AFTER UPDATE OF name, description, owner_id ON INVENTORY
+BEGIN
+    INSERT INTO INVENTORY_FTS(INVENTORY_FTS, rowid, name, description, owner_key)
+        VALUES ('delete', OLD.item_id, OLD.name, OLD.description, 'o' || OLD.owner_id);
+    INSERT INTO INVENTORY_FTS(rowid, name, description, owner_key)
+        VALUES (NEW.item_id, NEW.name, NEW.description, 'o' || NEW.owner_id);
+END;
+-- Append-only record of every stock movement, written by the triggers below. Each entry keeps the
+-- item's name and its quantity after the movement, so past stock can be read without INVENTORY.
+CREATE TABLE IF NOT EXISTS STOCK_LEDGER(
+    entry_id INTEGER PRIMARY KEY,
+    owner_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_owner ON STOCK_LEDGER(owner_id, entry_id);
+CREATE INDEX IF NOT EXISTS idx_stock_ledger_item ON STOCK_LEDGER(item_id, entry_id);
+
+CREATE TRIGGER IF NOT EXISTS inventory_ledger_insert AFTER INSERT ON INVENTORY
+BEGIN
+    INSERT INTO STOCK_LEDGER(owner_id, item_id, name, kind, delta, quantity)
+        VALUES (NEW.owner_id, NEW.item_id, NEW.name, 'add', NEW.quantity, NEW.quantity);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_ledger_update AFTER UPDATE OF quantity ON INVENTORY
+    WHEN NEW.quantity IS NOT OLD.quantity
+BEGIN
+    INSERT INTO STOCK_LEDGER(owner_id, item_id, name, kind, delta, quantity)
+        VALUES (NEW.owner_id, NEW.item_id, NEW.name, 'adjust', NEW.quantity - OLD.quantity, NEW.quantity);
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_ledger_delete AFTER DELETE ON INVENTORY
+BEGIN
+    INSERT INTO STOCK_LEDGER(owner_id, item_id, name, kind, delta, quantity)
+        VALUES (OLD.owner_id, OLD.item_id, OLD.name, 'delete', -OLD.quantity, 0);
+END;
+
+-- Per owner stock levels as of a ledger entry, so a past quantity is rebuilt from the nearest
+-- snapshot and the entries after it instead of the whole ledger
+CREATE TABLE IF NOT EXISTS STOCK_SNAPSHOTS(
+    snapshot_id INTEGER PRIMARY KEY,
+    owner_id INTEGER NOT NULL,
+    last_entry_id INTEGER NOT NULL,
+    taken_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_stock_snapshots_owner ON STOCK_SNAPSHOTS(owner_id, taken_at);
+
+CREATE TABLE IF NOT EXISTS STOCK_SNAPSHOT_ITEMS(
+    snapshot_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (snapshot_id, item_id)
+) WITHOUT ROWID;
+
+-- Per owner totals for the dashboard, kept up to date by the triggers below. Stock value is held in
+-- cents so adding and subtracting rows is exact. Rebuild with the rebuild-summary command.
+CREATE TABLE IF NOT EXISTS STORE_SUMMARY(
+    owner_id INTEGER PRIMARY KEY,
+    item_count INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    stock_value_cents INTEGER NOT NULL DEFAULT 0,
+    low_count INTEGER NOT NULL DEFAULT 0,
+    out_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS inventory_summary_insert AFTER INSERT ON INVENTORY
+BEGIN
+    INSERT INTO STORE_SUMMARY(owner_id, item_count, units, stock_value_cents, low_count, out_count)
+        VALUES (NEW.owner_id, 1, NEW.quantity, CAST(ROUND(NEW.quantity * NEW.price * 100) AS INTEGER),
+                NEW.quantity <= NEW.reorder_threshold, NEW.quantity = 0)
+        ON CONFLICT(owner_id) DO UPDATE SET
+            item_count = item_count + 1,
+            units = units + excluded.units,
+            stock_value_cents = stock_value_cents + excluded.stock_value_cents,
+            low_count = low_count + excluded.low_count,
+            out_count = out_count + excluded.out_count;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_summary_delete AFTER DELETE ON INVENTORY
+BEGIN
+    UPDATE STORE_SUMMARY SET
+        item_count = item_count - 1,
+        units = units - OLD.quantity,
+        stock_value_cents = stock_value_cents - CAST(ROUND(OLD.quantity * OLD.price * 100) AS INTEGER),
+        low_count = low_count - (OLD.quantity <= OLD.reorder_threshold),
+        out_count = out_count - (OLD.quantity = 0)
+    WHERE owner_id = OLD.owner_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_summary_update
+    AFTER UPDATE OF quantity, price, reorder_threshold, owner_id ON INVENTORY
+BEGIN
+    UPDATE STORE_SUMMARY SET
+        item_count = item_count - 1,
+        units = units - OLD.quantity,
+        stock_value_cents = stock_value_cents - CAST(ROUND(OLD.quantity * OLD.price * 100) AS INTEGER),
+        low_count = low_count - (OLD.quantity <= OLD.reorder_threshold),
+        out_count = out_count - (OLD.quantity = 0)
+    WHERE owner_id = OLD.owner_id;
+    INSERT INTO STORE_SUMMARY(owner_id, item_count, units, stock_value_cents, low_count, out_count)
+        VALUES (NEW.owner_id, 1, NEW.quantity, CAST(ROUND(NEW.quantity * NEW.price * 100) AS INTEGER),
+                NEW.quantity <= NEW.reorder_threshold, NEW.quantity = 0)
+        ON CONFLICT(owner_id) DO UPDATE SET
+            item_count = item_count + 1,
+            units = units + excluded.units,
+            stock_value_cents = stock_value_cents + excluded.stock_value_cents,
+            low_count = low_count + excluded.low_count,
+            out_count = out_count + excluded.out_count;
+END;
+
+-- Version of each store's inventory, bumped by every change to its items so
+-- pages built from it can be revalidated with one lookup
+CREATE TABLE IF NOT EXISTS INVENTORY_VERSIONS(
+    owner_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS inventory_version_insert AFTER INSERT ON INVENTORY
+BEGIN
+    INSERT INTO INVENTORY_VERSIONS(owner_id, version) VALUES (NEW.owner_id, 1)
+        ON CONFLICT(owner_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_version_delete AFTER DELETE ON INVENTORY
+BEGIN
+    INSERT INTO INVENTORY_VERSIONS(owner_id, version) VALUES (OLD.owner_id, 1)
+        ON CONFLICT(owner_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS inventory_version_update AFTER UPDATE ON INVENTORY
+BEGIN
+    INSERT INTO INVENTORY_VERSIONS(owner_id, version) VALUES (OLD.owner_id, 1)
+        ON CONFLICT(owner_id) DO UPDATE SET version = version + 1;
+    INSERT INTO INVENTORY_VERSIONS(owner_id, version)
+        SELECT NEW.owner_id, 1 WHERE NEW.owner_id != OLD.owner_id
+        ON CONFLICT(owner_id) DO UPDATE SET version = version + 1;
+END;
@@ -0,0 +1,376 @@
+"""
+Batch item reads and writes for the JSON API
+
+Items are read with only the fields a client asks for. Image bytes are never
+part of an item query: when the 'image' field is requested they are fetched
+from IMAGES for the whole page in one extra query. Batch writes are checked
+first and then applied in a single transaction, like stock adjustments, so
+either every item of a batch is created, updated or deleted or none is.
+"""
+
+
+import base64
+import binascii
+import io
+import json
+from .images import image_exists, image_hash, make_renditions, put_image, scan_upload
+from .importer import parse_integer, parse_price, parse_record
+
+
+# Fields an item can be read with; 'image' is the original image as base64
+FIELDS = ('item_id', 'name', 'description', 'quantity', 'price', 'reorder_threshold', 'image_hash', 'updated_at',
+          'image')
+
+# Fields returned when a request does not choose any, everything but the image bytes
+DEFAULT_FIELDS = tuple(field for field in FIELDS if field != 'image')
+
+# Fields a batch update may change
+UPDATABLE_FIELDS = ('name', 'description', 'quantity', 'price', 'reorder_threshold', 'image')
+
+# Largest number of items read or written in one batch
+MAX_BATCH_SIZE = 1000
+
+
+class DuplicateName(ValueError):
+    """
+    Raised when item names are already used, item names being unique within a store
+    """
+
+
+def parse_fields(value):
+    """
+    Read the 'fields' query parameter
+
+    Args:
+        value (str | None): Comma separated field names
+
+    Returns:
+        tuple: Requested fields in FIELDS order, DEFAULT_FIELDS if none are given
+
+    Raises:
+        ValueError: If a field is unknown
+    """
+    if not value:
+        return DEFAULT_FIELDS
+    requested = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = sorted(requested - set(FIELDS))
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(unknown)}')
+    return tuple(field for field in FIELDS if field in requested)
+
+
+def parse_ids(value):
+    """
+    Read a comma separated list of item IDs, such as the 'ids' query parameter
+
+    Args:
+        value (str | None): Comma separated IDs
+
+    Returns:
+        list: Item IDs in the given order, without repeats
+
+    Raises:
+        ValueError: If the list is empty, too long or holds something that is not an ID
+    """
+    try:
+        item_ids = list(dict.fromkeys(int(part) for part in (value or '').split(',') if part.strip()))
+    except ValueError:
+        raise ValueError('ids must be a comma separated list of item IDs')
+    if not item_ids:
+        raise ValueError('ids must list at least one item ID')
+    if len(item_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'at most {MAX_BATCH_SIZE} items can be requested at once')
+    return item_ids
+
+
+def item_columns(fields):
+    """
+    Columns of INVENTORY to select for a set of fields
+
+    Args:
+        fields (tuple): Fields from `parse_fields`
+
+    Returns:
+        tuple: Column names, with image_hash standing in for the image
+    """
+    columns = [field for field in fields if field != 'image']
+    if 'image' in fields and 'image_hash' not in columns:
+        columns.append('image_hash')
+    return tuple(columns)
+
+
+def serialize_items(connection, rows, fields):
+    """
+    Turn item rows into dicts holding the requested fields
+
+    Args:
+        connection (sqlite3.Connection): Connection to read image bytes from, when asked for
+        rows (list): Rows with the columns from `item_columns`
+        fields (tuple): Fields to include
+
+    Returns:
+        list: One dict per row
+    """
+    images = {}
+    if 'image' in fields:
+        hashes = sorted({row['image_hash'] for row in rows if row['image_hash']})
+        images = {item_image_hash: base64.b64encode(data).decode('ascii') for item_image_hash, data in
+                  connection.execute('SELECT hash, data FROM IMAGES WHERE hash IN (SELECT value FROM json_each(?))',
+                                     (json.dumps(hashes),))}
+    items = []
+    for row in rows:
+        item = {field: row[field] for field in fields if field != 'image'}
+        if 'image' in fields:
+            item['image'] = images.get(row['image_hash'])
+        items.append(item)
+    return items
+
+
+def read_items(connection, owner_id, item_ids, fields=DEFAULT_FIELDS):
+    """
+    Read some of an owner's items by ID
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): ID of the user the items belong to
+        item_ids (list): IDs of the items
+        fields (tuple): Fields to include
+
+    Returns:
+        tuple: (items in the order of item_ids, IDs that are not the owner's items)
+    """
+    columns = item_columns(fields)
+    if 'item_id' not in columns:
+        columns += ('item_id',)
+    rows = connection.execute(f'SELECT {", ".join(columns)} FROM INVENTORY WHERE owner_id = ? '
+                              f'AND item_id IN (SELECT value FROM json_each(?))',
+                              (owner_id, json.dumps(item_ids))).fetchall()
+    by_id = {row['item_id']: row for row in rows}
+    found = [by_id[item_id] for item_id in item_ids if item_id in by_id]
+    return serialize_items(connection, found, fields), [item_id for item_id in item_ids if item_id not in by_id]
+
+
+def _check_batch(items, what):
+    if not isinstance(items, list) or not items:
+        raise ValueError(f'{what} must be a non-empty list')
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f'at most {MAX_BATCH_SIZE} items can be {what} at once')
+
+
+def _image(value, index):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f'item {index}: image must be base64 data or null')
+    try:
+        data = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError(f'item {index}: image is not valid base64 data')
+    # Only images go into the image store, checked the same way as uploads from the add form
+    try:
+        scan_upload(io.BytesIO(data))
+    except ValueError as error:
+        raise ValueError(f'item {index}: image is {error}')
+    return data
+
+
+def parse_new_items(items, owner_id):
+    """
+    Validate a batch of items to create
+
+    Items are checked like import records: name, description, quantity and
+    price are required, reorder_threshold and a base64 image are optional.
+
+    Args:
+        items (list): Dicts of item fields
+        owner_id (int): ID of the user the items are created for
+
+    Returns:
+        list: Named parameters for the insert statement, in the given order
+
+    Raises:
+        ValueError: If the batch is empty, too large or an item is malformed
+    """
+    _check_batch(items, 'created')
+    params = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'item {index}: must be an object')
+        try:
+            params.append(parse_record(dict(item, image=None), owner_id))
+        except ValueError as error:
+            raise ValueError(f'item {index}: {error}')
+        params[-1]['image'] = _image(item.get('image'), index)
+        params[-1]['image_hash'] = image_hash(params[-1]['image'])
+    names = [param['name'] for param in params]
+    if len(set(names)) != len(names):
+        raise ValueError('item names must be unique within a batch')
+    return params
+
+
+def parse_updates(items, owner_id):
+    """
+    Validate a batch of item updates
+
+    Every update names an item_id and the fields to change, any of
+    UPDATABLE_FIELDS. An image of null removes the item's image.
+
+    Args:
+        items (list): Dicts with an item_id and the new values
+        owner_id (int): ID of the user whose items are updated
+
+    Returns:
+        list: (item_id, dict of column -> new value) per update, in the given order
+
+    Raises:
+        ValueError: If the batch is empty, too large or an update is malformed
+    """
+    _check_batch(items, 'updated')
+    updates = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'item_id' not in item:
+            raise ValueError(f'item {index}: item_id is required')
+        unknown = sorted(set(item) - set(UPDATABLE_FIELDS) - {'item_id'})
+        if unknown:
+            raise ValueError(f'item {index}: cannot update {", ".join(unknown)}')
+        changes = {}
+        for field in ('name', 'description'):
+            if field in item:
+                if not isinstance(item[field], str) or not item[field].strip():
+                    raise ValueError(f'item {index}: {field} must be a non-empty string')
+                changes[field] = item[field].strip()
+        if 'quantity' in item:
+            changes['quantity'] = parse_integer(item['quantity'], 'quantity', f'item {index}')
+            if changes['quantity'] < 0:
+                raise ValueError(f'item {index}: quantity cannot be negative')
+        if 'price' in item:
+            try:
+                changes['price'] = parse_price(item['price'])
+            except ValueError as error:
+                raise ValueError(f'item {index}: {error}')
+        if 'reorder_threshold' in item:
+            changes['reorder_threshold'] = max(0, parse_integer(item['reorder_threshold'], 'reorder_threshold',
+                                                                f'item {index}'))
+        if 'image' in item:
+            changes['image'] = _image(item['image'], index)
+        if not changes:
+            raise ValueError(f'item {index}: nothing to update')
+        updates.append((parse_integer(item['item_id'], 'item_id', f'item {index}'), changes))
+    item_ids = [item_id for item_id, _ in updates]
+    if len(set(item_ids)) != len(item_ids):
+        raise ValueError('each item can only be updated once per batch')
+    return updates
+
+
+def prepare_images(connection, images):
+    """
+    Generate renditions for the images of a batch that are not stored yet
+
+    This is the slow part of a write, run it on the CPU executor.
+
+    Args:
+        connection (sqlite3.Connection): Connection to check the image store with
+        images (list): Image bytes, None entries are skipped
+
+    Returns:
+        dict: Image hash -> (bytes, renditions or None if the image is already stored)
+    """
+    prepared = {}
+    for data in images:
+        if data and image_hash(data) not in prepared:
+            new = not image_exists(connection, image_hash(data))
+            prepared[image_hash(data)] = (data, make_renditions(data) if new else None)
+    return prepared
+
+
+def _taken_names(connection, owner_id, names, item_ids=()):
+    return sorted(row[0] for row in connection.execute(
+        'SELECT name FROM INVENTORY WHERE owner_id = ? AND name IN (SELECT value FROM json_each(?)) '
+        'AND item_id NOT IN (SELECT value FROM json_each(?))',
+        (owner_id, json.dumps(names), json.dumps(list(item_ids)))))
+
+
+def create_items(connection, owner_id, params, images):
+    """
+    Insert a batch of items in one transaction
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+        owner_id (int): ID of the user the items are created for
+        params (list): Output of `parse_new_items`
+        images (dict): Output of `prepare_images` for the batch's images
+
+    Returns:
+        list: IDs of the new items, in the given order
+
+    Raises:
+        DuplicateName: If a name is already used, with the names as its argument
+    """
+    item_ids = []
+    with connection:
+        taken = _taken_names(connection, owner_id, [param['name'] for param in params])
+        if taken:
+            raise DuplicateName(taken)
+        for param in params:
+            if param['image']:
+                put_image(connection, *images[param['image_hash']])
+            cursor = connection.execute('INSERT INTO INVENTORY (name, image_hash, description, quantity, price, '
+                                        'owner_id, reorder_threshold, updated_at) VALUES (:name, :image_hash, '
+                                        ':description, :quantity, :price, :owner_id, COALESCE(:reorder_threshold, '
+                                        '10), CURRENT_TIMESTAMP)', param)
+            item_ids.append(cursor.lastrowid)
+    return item_ids
+
+
+def update_items(connection, owner_id, updates, images):
+    """
+    Apply a batch of item updates in one transaction
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+        owner_id (int): ID of the user whose items are updated
+        updates (list): Output of `parse_updates`
+        images (dict): Output of `prepare_images` for the batch's images
+
+    Raises:
+        LookupError: If an item does not belong to the owner, with the missing IDs as its argument
+        DuplicateName: If a new name is already used, with the names as its argument
+    """
+    item_ids = [item_id for item_id, _ in updates]
+    names = [changes['name'] for _, changes in updates if 'name' in changes]
+    with connection:
+        _, missing = read_items(connection, owner_id, item_ids, fields=('item_id',))
+        if missing:
+            raise LookupError(missing)
+        taken = _taken_names(connection, owner_id, names, item_ids) if names else []
+        if taken:
+            raise DuplicateName(taken)
+        for item_id, changes in updates:
+            columns = dict(changes)
+            if 'image' in columns:
+                data = columns.pop('image')
+                columns['image_hash'] = put_image(connection, *images[image_hash(data)]) if data else None
+            assignments = ', '.join(f'{column} = :{column}' for column in columns)
+            connection.execute(f'UPDATE INVENTORY SET {assignments}, updated_at = CURRENT_TIMESTAMP '
+                               f'WHERE item_id = :item_id AND owner_id = :owner_id',
+                               dict(columns, item_id=item_id, owner_id=owner_id))
+
+
+def delete_items(connection, owner_id, item_ids):
+    """
+    Delete a batch of items in one transaction
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+        owner_id (int): ID of the user whose items are deleted
+        item_ids (list): IDs of the items
+
+    Raises:
+        LookupError: If an item does not belong to the owner, with the missing IDs as its argument
+    """
+    with connection:
+        _, missing = read_items(connection, owner_id, item_ids, fields=('item_id',))
+        if missing:
+            raise LookupError(missing)
+        connection.execute('DELETE FROM INVENTORY WHERE owner_id = ? AND item_id IN (SELECT value FROM json_each(?))',
+                           (owner_id, json.dumps(item_ids)))
@@ -0,0 +1,211 @@
+"""
+Background export jobs
+
+Large exports run on a small local thread pool instead of in the request
+thread. Jobs are tracked in the EXPORT_JOBS table, so no external broker is
+needed, and finished files are written to a spool directory, from which they
+are downloaded. Jobs and their files are removed once they are older than the
+configured time to live. Jobs that were still queued or running when the
+process stopped are marked as failed the next time the database is set up.
+
+Configuration keys (all optional):
+    EXPORT_SPOOL_DIR (str): Directory finished exports are written to
+    EXPORT_JOB_TTL (int): Seconds a job and its file are kept
+    EXPORT_WORKERS (int): Number of exports that run at the same time
+"""
+
+
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from .db import get_db
+from .exports import buffered, iter_inventory_xml, write_inventory_xlsx
+from .images import external_image_url
+from .metrics import timed
+
+
+# Export kind -> (file extension, MIME type)
+EXPORT_KINDS = {
+    'xml': ('xml', 'application/xml'),
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+# Statuses of jobs that will not change any more
+FINISHED_STATUSES = ('done', 'failed')
+
+_executor_lock = threading.Lock()
+
+
+def init_app(app):
+    """
+    Register default export job settings on a Flask app
+
+    Args:
+        app (Flask): Application to configure
+    """
+    app.config.setdefault('EXPORT_SPOOL_DIR', os.path.join(app.instance_path, 'exports'))
+    app.config.setdefault('EXPORT_JOB_TTL', 3600)
+    app.config.setdefault('EXPORT_WORKERS', 2)
+
+
+def _get_executor(app):
+    executor = app.extensions.get('export_jobs')
+    if executor is None:
+        with _executor_lock:
+            executor = app.extensions.get('export_jobs')
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=app.config['EXPORT_WORKERS'],
+                                              thread_name_prefix='export')
+                app.extensions['export_jobs'] = executor
+    return executor
+
+
+def spool_path(app, job_id, kind):
+    """
+    Path of a job's finished file
+
+    Args:
+        app (Flask): Application the job belongs to
+        job_id (str): ID of the job
+        kind (str): Export kind, a key of EXPORT_KINDS
+
+    Returns:
+        str: File path inside the spool directory
+    """
+    return os.path.join(app.config['EXPORT_SPOOL_DIR'], f'{job_id}.{EXPORT_KINDS[kind][0]}')
+
+
+def enqueue_export(owner_id, kind, images='inline', base_url=None):
+    """
+    Queue an export of an owner's inventory
+
+    Expired jobs are cleaned up first.
+
+    Args:
+        owner_id (int): ID of the user whose items are exported
+        kind (str): 'xml' or 'xlsx'
+        images (str): Image mode passed on to the export writer
+        base_url (str | None): Root URL used to build image links for images='url'
+
+    Returns:
+        str: ID of the new job
+    """
+    app = current_app._get_current_object()
+    connection = get_db()
+    cleanup_expired(app, connection)
+
+    job_id = secrets.token_hex(16)
+    with connection:
+        connection.execute('INSERT INTO EXPORT_JOBS (job_id, owner_id, kind, images, status, created_at) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', (job_id, owner_id, kind, images, 'queued', time.time()))
+    _get_executor(app).submit(_run_export, app, owner_id, job_id, base_url)
+    return job_id
+
+
+def get_job(connection, job_id, owner_id):
+    """
+    Look up a job belonging to an owner
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        job_id (str): ID of the job
+        owner_id (int): ID of the user who queued it
+
+    Returns:
+        sqlite3.Row | None: The job, or None if there is no such job for this owner
+    """
+    return connection.execute('SELECT * FROM EXPORT_JOBS WHERE job_id = ? AND owner_id = ?',
+                              (job_id, owner_id)).fetchone()
+
+
+def _run_export(app, owner_id, job_id, base_url):
+    with app.test_request_context(base_url=base_url):
+        connection = get_db(owner_id)
+        job = connection.execute('SELECT * FROM EXPORT_JOBS WHERE job_id = ?', (job_id,)).fetchone()
+        if job is None:
+            return
+        total = connection.execute('SELECT COUNT(*) FROM INVENTORY WHERE owner_id = ?',
+                                   (job['owner_id'],)).fetchone()[0]
+        with connection:
+            connection.execute("UPDATE EXPORT_JOBS SET status = 'running', total = ? WHERE job_id = ?",
+                               (total, job_id))
+
+        def progress(done):
+            with connection:
+                connection.execute('UPDATE EXPORT_JOBS SET progress = ? WHERE job_id = ?', (done, job_id))
+
+        path = spool_path(app, job_id, job['kind'])
+        partial_path = path + '.part'
+        try:
+            os.makedirs(app.config['EXPORT_SPOOL_DIR'], exist_ok=True)
+            with open(partial_path, 'wb') as output, timed(f"export_{job['kind']}"):
+                if job['kind'] == 'xml':
+                    document = iter_inventory_xml(connection, job['owner_id'], images=job['images'],
+                                                  image_url=external_image_url, progress=progress)
+                    for chunk in buffered(document):
+                        output.write(chunk)
+                else:
+                    write_inventory_xlsx(connection, job['owner_id'], output, images=job['images'],
+                                         image_url=external_image_url, progress=progress)
+            os.replace(partial_path, path)
+        except Exception as error:
+            app.logger.exception('Export job %s failed', job_id)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            with connection:
+                connection.execute("UPDATE EXPORT_JOBS SET status = 'failed', error = ?, finished_at = ? "
+                                   "WHERE job_id = ?", (str(error), time.time(), job_id))
+            return
+
+        with connection:
+            connection.execute("UPDATE EXPORT_JOBS SET status = 'done', finished_at = ? WHERE job_id = ?",
+                               (time.time(), job_id))
+
+
+def fail_interrupted(connection):
+    """
+    Mark jobs left queued or running by a previous process as failed
+
+    The thread pool does not outlive the process, so such jobs would never
+    finish and their status pages would wait forever.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        int: Number of jobs marked as failed
+    """
+    with connection:
+        cursor = connection.execute("UPDATE EXPORT_JOBS SET status = 'failed', error = ?, finished_at = ? "
+                                    "WHERE status NOT IN (?, ?)",
+                                    ('Interrupted by a server restart', time.time(), *FINISHED_STATUSES))
+    return cursor.rowcount
+
+
+def cleanup_expired(app, connection):
+    """
+    Delete finished jobs older than EXPORT_JOB_TTL together with their files
+
+    Jobs that are still queued or running are kept, however old they are, so
+    a worker never loses its row or spool file while writing it.
+
+    Args:
+        app (Flask): Application whose spool directory is cleaned
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        int: Number of jobs removed
+    """
+    cutoff = time.time() - app.config['EXPORT_JOB_TTL']
+    expired = connection.execute('SELECT job_id, kind FROM EXPORT_JOBS WHERE created_at < ? AND status IN (?, ?)',
+                                 (cutoff, *FINISHED_STATUSES)).fetchall()
+    for job_id, kind in expired:
+        for path in (spool_path(app, job_id, kind), spool_path(app, job_id, kind) + '.part'):
+            if os.path.exists(path):
+                os.remove(path)
+    with connection:
+        connection.executemany('DELETE FROM EXPORT_JOBS WHERE job_id = ?', [(row[0],) for row in expired])
+    return len(expired)
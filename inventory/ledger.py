@@ -0,0 +1,212 @@
+"""
+Stock movement ledger
+
+Every change to an item's quantity is appended to STOCK_LEDGER by triggers on
+INVENTORY, whatever code path made it: adding, importing, editing, batch
+adjustments and deletes. The write path pays for one narrow insert per
+movement and never reads the ledger.
+
+To answer "what was on hand at time T" without replaying an owner's whole
+history, `take_snapshot` periodically stores each owner's stock levels in
+STOCK_SNAPSHOTS. A point-in-time query starts from the newest snapshot at or
+before T and replays only the entries written after it.
+
+Ledger timestamps are UTC, in SQLite's 'YYYY-MM-DD HH:MM:SS.SSS' format.
+"""
+
+
+from datetime import datetime, timezone
+
+
+HISTORY_PAGE_SIZE = 100
+MAX_HISTORY_PAGE_SIZE = 1000
+
+# Default number of new entries an owner needs before `snapshot_all` takes a new snapshot
+SNAPSHOT_MIN_ENTRIES = 1000
+
+
+def ledger_timestamp(value):
+    """
+    Convert a date or time given by a client to the ledger's timestamp format
+
+    Args:
+        value (str | datetime): ISO 8601 date or date and time, naive values are taken as UTC
+
+    Returns:
+        str: Timestamp comparable with STOCK_LEDGER.created_at
+
+    Raises:
+        ValueError: If the value is not an ISO 8601 date
+    """
+    moment = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime('%Y-%m-%d %H:%M:%S.') + f'{moment.microsecond // 1000:03d}'
+
+
+def ledger_exists(connection):
+    """
+    Check whether the database already has the stock ledger
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        bool: True if the STOCK_LEDGER table exists
+    """
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'STOCK_LEDGER'").fetchone() is not None
+
+
+def seed_ledger(connection):
+    """
+    Record the current stock of every item as an opening ledger entry
+
+    Needed once for databases that had items before the ledger existed.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        int: Number of entries written
+    """
+    with connection:
+        cursor = connection.execute("INSERT INTO STOCK_LEDGER(owner_id, item_id, name, kind, delta, quantity) "
+                                    "SELECT owner_id, item_id, name, 'opening', quantity, quantity FROM INVENTORY "
+                                    "ORDER BY item_id")
+    return cursor.rowcount
+
+
+def item_history(connection, owner_id, item_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Read an item's ledger entries, newest first
+
+    Entries of deleted items are kept, so the history of an item that no
+    longer exists can still be read.
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): ID of the user the item belongs to
+        item_id (int): ID of the item
+        before (int | None): Only return entries older than this entry_id, for paging
+        limit (int): Number of entries to return
+
+    Returns:
+        list: sqlite3.Row entries with entry_id, kind, delta, quantity and created_at
+    """
+    sql = ('SELECT entry_id, name, kind, delta, quantity, created_at FROM STOCK_LEDGER '
+           'WHERE item_id = ? AND owner_id = ?')
+    params = [item_id, owner_id]
+    if before is not None:
+        sql += ' AND entry_id < ?'
+        params.append(before)
+    sql += ' ORDER BY entry_id DESC LIMIT ?'
+    params.append(limit)
+    return connection.execute(sql, params).fetchall()
+
+
+def _latest_snapshot(connection, owner_id, at=None):
+    sql = 'SELECT snapshot_id, last_entry_id FROM STOCK_SNAPSHOTS WHERE owner_id = ?'
+    params = [owner_id]
+    if at is not None:
+        sql += ' AND taken_at <= ?'
+        params.append(at)
+    return connection.execute(sql + ' ORDER BY taken_at DESC, snapshot_id DESC LIMIT 1', params).fetchone()
+
+
+def _replay(connection, owner_id, at=None):
+    # Start from the nearest snapshot, then apply the entries written after it in order
+    stock = {}
+    last_entry_id = 0
+    snapshot = _latest_snapshot(connection, owner_id, at)
+    if snapshot is not None:
+        last_entry_id = snapshot['last_entry_id']
+        for item_id, name, quantity in connection.execute(
+                'SELECT item_id, name, quantity FROM STOCK_SNAPSHOT_ITEMS WHERE snapshot_id = ?',
+                (snapshot['snapshot_id'],)):
+            stock[item_id] = (name, quantity)
+
+    cursor = connection.execute('SELECT entry_id, item_id, name, kind, quantity, created_at FROM STOCK_LEDGER '
+                                'WHERE owner_id = ? AND entry_id > ? ORDER BY entry_id', (owner_id, last_entry_id))
+    for entry_id, item_id, name, kind, quantity, created_at in cursor:
+        # Entries are written in time order, so the first one after `at` ends the replay
+        if at is not None and created_at > at:
+            break
+        if kind == 'delete':
+            stock.pop(item_id, None)
+        else:
+            stock[item_id] = (name, quantity)
+        last_entry_id = entry_id
+    cursor.close()
+    return stock, last_entry_id
+
+
+def stock_as_of(connection, owner_id, at, item_id=None):
+    """
+    Rebuild an owner's stock levels at a point in time
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): ID of the user whose stock is read
+        at (str): Timestamp from `ledger_timestamp`
+        item_id (int | None): Only return this item
+
+    Returns:
+        dict: item_id -> (name, quantity) for every item that existed at that time
+    """
+    stock, _ = _replay(connection, owner_id, at)
+    if item_id is not None:
+        return {item_id: stock[item_id]} if item_id in stock else {}
+    return stock
+
+
+def take_snapshot(connection, owner_id):
+    """
+    Store an owner's current stock levels as a snapshot
+
+    The snapshot is built from the previous snapshot and the entries after
+    it, so taking one does not read the whole ledger.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+        owner_id (int): ID of the user whose stock is stored
+
+    Returns:
+        int | None: ID of the new snapshot, or None if nothing changed since the last one
+    """
+    with connection:
+        previous = _latest_snapshot(connection, owner_id)
+        stock, last_entry_id = _replay(connection, owner_id)
+        if last_entry_id == 0 or (previous is not None and previous['last_entry_id'] == last_entry_id):
+            return None
+        taken_at = connection.execute('SELECT created_at FROM STOCK_LEDGER WHERE entry_id = ?',
+                                      (last_entry_id,)).fetchone()[0]
+        snapshot_id = connection.execute('INSERT INTO STOCK_SNAPSHOTS(owner_id, last_entry_id, taken_at) '
+                                         'VALUES (?, ?, ?)', (owner_id, last_entry_id, taken_at)).lastrowid
+        connection.executemany('INSERT INTO STOCK_SNAPSHOT_ITEMS(snapshot_id, item_id, name, quantity) '
+                               'VALUES (?, ?, ?, ?)',
+                               [(snapshot_id, item_id, name, quantity) for item_id, (name, quantity) in stock.items()])
+    return snapshot_id
+
+
+def snapshot_all(connection, min_entries=SNAPSHOT_MIN_ENTRIES):
+    """
+    Take a snapshot for every owner with enough ledger entries since their last one
+
+    Meant to be run periodically, for example from cron through the
+    snapshot-stock command.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+        min_entries (int): Entries an owner needs since their last snapshot
+
+    Returns:
+        int: Number of snapshots taken
+    """
+    taken = 0
+    for (owner_id,) in connection.execute('SELECT DISTINCT owner_id FROM STOCK_LEDGER').fetchall():
+        latest = _latest_snapshot(connection, owner_id)
+        new_entries = connection.execute('SELECT COUNT(*) FROM STOCK_LEDGER WHERE owner_id = ? AND entry_id > ?',
+                                         (owner_id, latest['last_entry_id'] if latest else 0)).fetchone()[0]
+        if new_entries >= max(1, min_entries) and take_snapshot(connection, owner_id) is not None:
+            taken += 1
+    return taken
@@ -0,0 +1,450 @@
+"""
+Request instrumentation and metrics
+
+Every request is timed per route, streamed responses until their last byte
+is sent. The time a request spends in SQLite, in template rendering and in
+named phases (export writing, base64 encoding, ...) is added up on `flask.g`.
+Totals are kept in process-wide histograms and counters, served in the
+Prometheus text format by the /metrics route.
+
+SQL is timed by `InstrumentedConnection`, which `init_app` mixes into the
+configured DB_CONNECTION_FACTORY for the pool to use. The time of a query is
+the time of its `execute` call, rows fetched later are not included.
+
+/metrics is not public. With METRICS_TOKEN set, scrapers must send it as a
+bearer token. Without one, only clients on the loopback interface are
+answered, so behind a reverse proxy on the same host a token is needed.
+
+Requests slower than SLOW_REQUEST_THRESHOLD are logged with their breakdown
+to the 'inventory.slow_requests' logger. A sample of requests
+(PROFILE_SAMPLE_RATE) also runs under cProfile, and the profile of a sampled
+request that turns out slow is written to PROFILE_DIR.
+
+Configuration keys (all optional):
+    SLOW_REQUEST_THRESHOLD (float | None): Seconds after which a request is logged, None disables the log
+    SLOW_REQUEST_LOG (str | None): File the slow request log is also written to
+    PROFILE_SAMPLE_RATE (float): Fraction of requests profiled while the slow log is enabled
+    PROFILE_DIR (str): Directory profiles of slow requests are written to
+    METRICS_TOKEN (str | None): Bearer token /metrics requires, None allows loopback clients only
+"""
+
+
+import cProfile
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, before_render_template, g, has_app_context, request, template_rendered
+
+
+# Upper bounds in seconds, from 1ms to 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_log = logging.getLogger('inventory.slow_requests')
+
+
+class Histogram:
+    """
+    Prometheus style histogram with one series per label set
+
+    Attributes:
+        name (str): Metric name
+        description (str): Help text
+        labels (tuple): Label names
+        buckets (tuple): Bucket upper bounds in ascending order
+    """
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """
+        Record one observation
+
+        Args:
+            value (float): Observed value
+            *label_values (str): One value per label, in order
+        """
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        """
+        Format the histogram in the Prometheus text format
+
+        Returns:
+            list: Lines of text
+        """
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self._series.items())
+        for label_values, (counts, count, total) in series:
+            labels = _format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels + ("le",), label_values + (repr(bound),))}'
+                             f' {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labels + ("le",), label_values + ("+Inf",))} {count}')
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Counter:
+    """
+    Prometheus style counter with one series per label set
+
+    Attributes:
+        name (str): Metric name
+        description (str): Help text
+        labels (tuple): Label names
+    """
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        """
+        Add to the counter
+
+        Args:
+            amount (float): Amount to add
+            *label_values (str): One value per label, in order
+        """
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self):
+        """
+        Format the counter in the Prometheus text format
+
+        Returns:
+            list: Lines of text
+        """
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = sorted(self._series.items())
+        for label_values, value in series:
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+REQUEST_SECONDS = Histogram('inventory_request_duration_seconds', 'Time to build a response, by route',
+                            ('endpoint', 'method'))
+REQUESTS = Counter('inventory_requests_total', 'Requests handled, by route and status',
+                   ('endpoint', 'method', 'status'))
+SQL_SECONDS = Histogram('inventory_sql_query_duration_seconds', 'Time spent executing SQL statements',
+                        buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.5, 1.0))
+REQUEST_QUERIES = Histogram('inventory_request_sql_queries', 'SQL statements executed per request', ('endpoint',),
+                            buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000))
+TEMPLATE_SECONDS = Histogram('inventory_template_render_seconds', 'Time spent rendering templates', ('template',))
+PHASE_SECONDS = Histogram('inventory_phase_duration_seconds', 'Time spent in named phases of work', ('phase',))
+
+METRICS = [REQUEST_SECONDS, REQUESTS, SQL_SECONDS, REQUEST_QUERIES, TEMPLATE_SECONDS, PHASE_SECONDS]
+
+
+def register_collector(app, collector):
+    """
+    Add a callable whose metrics are included in every /metrics response of an app
+
+    Args:
+        app (Flask): Application whose /metrics route reports the collector
+        collector (callable): Returns a list of (name, type, description, samples) tuples,
+            samples being (labels dict, value) pairs, and is called on every scrape
+    """
+    app.extensions.setdefault('metrics_collectors', []).append(collector)
+
+
+def _request_stats():
+    if has_app_context():
+        return g.get('request_stats')
+    return None
+
+
+def record_query(seconds):
+    """
+    Count one SQL statement against the current request and the global histogram
+
+    Args:
+        seconds (float): Time the statement took
+    """
+    SQL_SECONDS.observe(seconds)
+    stats = _request_stats()
+    if stats is not None:
+        stats['sql_count'] += 1
+        stats['sql_seconds'] += seconds
+
+
+def record_phase(phase, seconds):
+    """
+    Add time spent in a named phase to the current request and the global histogram
+
+    Args:
+        phase (str): Name of the phase, for example 'xlsx_save'
+        seconds (float): Time spent
+    """
+    PHASE_SECONDS.observe(seconds, phase)
+    stats = _request_stats()
+    if stats is not None:
+        stats['phases'][phase] = stats['phases'].get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase):
+    """
+    Time the enclosed block as a named phase
+
+    Args:
+        phase (str): Name of the phase
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+def _timed_call(method, *args):
+    start = time.perf_counter()
+    try:
+        return method(*args)
+    finally:
+        record_query(time.perf_counter() - start)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that times the statements it executes
+    """
+    def execute(self, *args):
+        return _timed_call(super().execute, *args)
+
+    def executemany(self, *args):
+        return _timed_call(super().executemany, *args)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection that times the statements run through it or its cursors
+    """
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return _timed_call(super().execute, *args)
+
+    def executemany(self, *args):
+        return _timed_call(super().executemany, *args)
+
+    def executescript(self, *args):
+        return _timed_call(super().executescript, *args)
+
+
+def instrument_factory(factory):
+    """
+    Add statement timing to a connection class
+
+    Args:
+        factory (type): sqlite3.Connection subclass, such as the configured DB_CONNECTION_FACTORY
+
+    Returns:
+        type: A subclass of both InstrumentedConnection and `factory`, or `factory` itself if it is already timed
+    """
+    if issubclass(factory, InstrumentedConnection):
+        return factory
+    if factory is sqlite3.Connection:
+        return InstrumentedConnection
+    return type(f'Instrumented{factory.__name__}', (InstrumentedConnection, factory), {})
+
+
+def metrics_allowed(app):
+    """
+    Check whether the current request may read /metrics
+
+    Args:
+        app (Flask): Application serving the request
+
+    Returns:
+        bool: True if the request carries METRICS_TOKEN, or comes from a loopback address when no token is set
+    """
+    token = app.config['METRICS_TOKEN']
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode())
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def _start_profiler(app):
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if app.config['SLOW_REQUEST_THRESHOLD'] is None or rate <= 0 or random.random() >= rate:
+        return None
+    if sys.getprofile() is not None:
+        # Another profiler or debugger is already active on this thread
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+def _finish_request(app, stats, method, path, endpoint, status):
+    profiler = stats['profiler']
+    if profiler is not None:
+        profiler.disable()
+    duration = time.perf_counter() - stats['start']
+    REQUEST_SECONDS.observe(duration, endpoint, method)
+    REQUESTS.inc(1, endpoint, method, str(status))
+    REQUEST_QUERIES.observe(stats['sql_count'], endpoint)
+    threshold = app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold is None or duration < threshold:
+        return
+
+    profile_path = None
+    if profiler is not None:
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        profile_path = os.path.join(app.config['PROFILE_DIR'],
+                                    f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{os.getpid()}-'
+                                    f'{threading.get_ident()}.prof')
+        profiler.dump_stats(profile_path)
+    slow_log.warning(json.dumps({
+        'method': method,
+        'path': path,
+        'endpoint': endpoint,
+        'status': status,
+        'seconds': round(duration, 6),
+        'sql_count': stats['sql_count'],
+        'sql_seconds': round(stats['sql_seconds'], 6),
+        'template_seconds': round(stats['template_seconds'], 6),
+        'phases': {phase: round(seconds, 6) for phase, seconds in stats['phases'].items()},
+        'profile': profile_path,
+    }))
+
+
+def render_metrics(app):
+    """
+    Format every metric in the Prometheus text format
+
+    Args:
+        app (Flask): Application whose collectors are included
+
+    Returns:
+        str: Metrics exposition text
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collector in app.extensions.get('metrics_collectors', ()):
+        for name, kind, description, samples in collector():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """
+    Instrument a Flask app: time requests, SQL and templates, and add the /metrics route
+
+    Must run before the app's first database connection is opened, so the
+    pool creates instrumented connections.
+
+    Args:
+        app (Flask): Application to instrument
+    """
+    app.config.setdefault('SLOW_REQUEST_THRESHOLD', None)
+    app.config.setdefault('SLOW_REQUEST_LOG', None)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.01)
+    app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.config.setdefault('METRICS_TOKEN', None)
+    # Keep a factory the caller configured, timing its statements as well
+    app.config['DB_CONNECTION_FACTORY'] = instrument_factory(app.config.get('DB_CONNECTION_FACTORY',
+                                                                            sqlite3.Connection))
+
+    if app.config['SLOW_REQUEST_LOG']:
+        handler = logging.FileHandler(app.config['SLOW_REQUEST_LOG'])
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_log.addHandler(handler)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_stats = {'start': time.perf_counter(), 'sql_count': 0, 'sql_seconds': 0.0,
+                           'template_seconds': 0.0, 'phases': {}, 'profiler': _start_profiler(app)}
+
+    @app.after_request
+    def record_request(response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        args = (app, stats, request.method, request.path, request.endpoint or 'unknown', response.status_code)
+        if response.is_streamed and not response.direct_passthrough:
+            # Generated bodies are produced after this hook, finish once the response is closed
+            response.call_on_close(lambda: _finish_request(*args))
+        else:
+            g.pop('request_stats')
+            _finish_request(*args)
+        return response
+
+    def template_started(sender, template, context, **extra):
+        g.template_start = time.perf_counter()
+
+    def template_finished(sender, template, context, **extra):
+        start = g.pop('template_start', None)
+        if start is None:
+            return
+        seconds = time.perf_counter() - start
+        TEMPLATE_SECONDS.observe(seconds, template.name or 'string')
+        stats = g.get('request_stats')
+        if stats is not None:
+            stats['template_seconds'] += seconds
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        """
+        Serve the app's metrics in the Prometheus text format
+
+        Returns:
+            Response: Metrics exposition text, or 401 if the client may not read them
+        """
+        if not metrics_allowed(app):
+            return Response('Unauthorized', 401, {'WWW-Authenticate': 'Bearer realm="metrics"'})
+        return Response(render_metrics(app), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,115 @@
+"""
+Bounded executor for CPU-heavy work
+
+Password hashing, image resizing, imports and XLSX building can each take a
+noticeable share of a CPU. Running them on a small shared pool caps how many
+requests do such work at once, so with many request threads (see
+`inventory.asgi`) quick page loads are not starved by a burst of slow ones.
+The calling request thread waits for the result; the work runs with a copy of
+its context, so `g`, the database connection and request metrics work as
+they would in the request itself. When too many tasks are already waiting,
+`run_cpu` gives up with a 503 instead of queueing without bound.
+
+This is a concurrency limit, not isolation. The workers are threads of the
+same process, so pure Python work such as building an XLSX file still holds
+the GIL and competes with request threads for it; only hashing and Pillow's
+resizing release it while they run. A slow task cannot block the server
+outright, but the process as a whole is no faster than one core for Python
+code. Run several server processes (`--workers`) to use more cores.
+
+Configuration keys (all optional):
+    CPU_WORKERS (int): Tasks run at the same time, defaults to the CPU count
+    CPU_QUEUE_SIZE (int): Tasks allowed to wait for a worker
+    CPU_QUEUE_TIMEOUT (float): Seconds to wait for a place in the queue before answering 503
+"""
+
+
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from . import metrics
+
+
+_executor_lock = threading.Lock()
+
+
+class _CPUExecutor:
+    # A thread pool plus a semaphore bounding running and waiting tasks together. The threads share the GIL with
+    # the request threads, the pool limits how much CPU-heavy work runs at once but does not isolate it
+    def __init__(self, workers, queue_size):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cpu')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.pending = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+
+def init_app(app):
+    """
+    Register default executor settings on a Flask app
+
+    Args:
+        app (Flask): Application to configure
+    """
+    app.config.setdefault('CPU_WORKERS', os.cpu_count() or 1)
+    app.config.setdefault('CPU_QUEUE_SIZE', 64)
+    app.config.setdefault('CPU_QUEUE_TIMEOUT', 10.0)
+    metrics.register_collector(app, lambda: _executor_metrics(app))
+
+
+def _get_executor(app):
+    executor = app.extensions.get('cpu_executor')
+    if executor is None:
+        with _executor_lock:
+            executor = app.extensions.get('cpu_executor')
+            if executor is None:
+                executor = _CPUExecutor(app.config['CPU_WORKERS'], app.config['CPU_QUEUE_SIZE'])
+                app.extensions['cpu_executor'] = executor
+    return executor
+
+
+def _executor_metrics(app):
+    executor = app.extensions.get('cpu_executor')
+    pending, rejected = (executor.pending, executor.rejected) if executor is not None else (0, 0)
+    return [
+        ('inventory_cpu_tasks_pending', 'gauge', 'CPU-heavy tasks running or waiting', [({}, pending)]),
+        ('inventory_cpu_tasks_rejected_total', 'counter', 'CPU-heavy tasks refused because the queue was full',
+         [({}, rejected)]),
+    ]
+
+
+def run_cpu(func, *args, **kwargs):
+    """
+    Run a function on the CPU executor and wait for its result
+
+    Args:
+        func (callable): Function to run
+        *args: Positional arguments for the function
+        **kwargs: Keyword arguments for the function
+
+    Returns:
+        object: The function's return value, its exceptions are raised here
+
+    Raises:
+        ServiceUnavailable: If the queue stays full for CPU_QUEUE_TIMEOUT seconds
+    """
+    app = current_app._get_current_object()
+    executor = _get_executor(app)
+    if not executor.slots.acquire(timeout=app.config['CPU_QUEUE_TIMEOUT']):
+        with executor.lock:
+            executor.rejected += 1
+        raise ServiceUnavailable('The server is busy, try again shortly', retry_after=5)
+    with executor.lock:
+        executor.pending += 1
+    try:
+        context = contextvars.copy_context()
+        return executor.pool.submit(context.run, func, *args, **kwargs).result()
+    finally:
+        with executor.lock:
+            executor.pending -= 1
+        executor.slots.release()
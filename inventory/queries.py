@@ -0,0 +1,171 @@
+"""
+Inventory listing queries
+
+Item lists are read one page at a time with keyset pagination: instead of an
+OFFSET, each page continues after the sort key of the last row of the previous
+page, which the composite INVENTORY(owner_id, ...) indexes can seek to
+directly. Filters are applied in SQL and only the listed columns are selected,
+never the image BLOB.
+"""
+
+
+import base64
+import binascii
+import json
+import math
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Sort option -> column; every sort ends with item_id so the order is total
+SORT_COLUMNS = {
+    'item_id': 'item_id',
+    'name': 'name',
+    'quantity': 'quantity',
+    'price': 'price',
+}
+
+# Filter option -> SQL condition
+FILTERS = {
+    'min_quantity': 'quantity >= ?',
+    'max_quantity': 'quantity <= ?',
+    'min_price': 'price >= ?',
+    'max_price': 'price <= ?',
+}
+
+LIST_COLUMNS = ('item_id', 'name', 'image_hash', 'description', 'quantity', 'price')
+
+# Range of SQLite's 64-bit INTEGER, larger Python ints cannot be bound
+SQLITE_MIN_INTEGER = -2 ** 63
+SQLITE_MAX_INTEGER = 2 ** 63 - 1
+
+
+def encode_cursor(row, sort):
+    """
+    Build the opaque cursor that continues a listing after a row
+
+    Args:
+        row (sqlite3.Row): Last row of the current page
+        sort (str): Sort option the page was read with
+
+    Returns:
+        str: URL-safe cursor
+    """
+    key = [row['item_id']] if sort == 'item_id' else [row[SORT_COLUMNS[sort]], row['item_id']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, sort):
+    """
+    Read a cursor made by `encode_cursor`
+
+    Args:
+        cursor (str | None): Cursor from the request
+        sort (str): Sort option of the listing
+
+    Returns:
+        list | None: Sort key values, or None if the cursor is missing or does not match the sort
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, binascii.Error):
+        return None
+    if not isinstance(key, list) or len(key) != (1 if sort == 'item_id' else 2):
+        return None
+    # Cursors come from the client, only values SQLite can bind and compare are let through
+    if not all(_valid_key_value(value) for value in key):
+        return None
+    return key
+
+
+def _valid_key_value(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return SQLITE_MIN_INTEGER <= value <= SQLITE_MAX_INTEGER
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, str)
+
+
+def parse_listing_args(args):
+    """
+    Read and validate listing options from query parameters
+
+    Unknown or malformed values fall back to their defaults.
+
+    Args:
+        args (MultiDict): Request query parameters
+
+    Returns:
+        dict: Options accepted by `list_items`
+    """
+    sort = args.get('sort', 'item_id')
+    if sort not in SORT_COLUMNS:
+        sort = 'item_id'
+    order = 'desc' if args.get('order') == 'desc' else 'asc'
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    filters = {}
+    for name in FILTERS:
+        value = args.get(name, type=int if name.endswith('quantity') else float)
+        if value is not None:
+            filters[name] = value
+    return {
+        'sort': sort,
+        'order': order,
+        'limit': limit,
+        'after': decode_cursor(args.get('after'), sort),
+        'filters': filters,
+    }
+
+
+def list_items(connection, owner_id, sort='item_id', order='asc', limit=DEFAULT_PAGE_SIZE, after=None,
+               filters=None, columns=LIST_COLUMNS):
+    """
+    Read one page of an owner's items
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): ID of the user whose items are listed
+        sort (str): Key of SORT_COLUMNS to order by
+        order (str): 'asc' or 'desc'
+        limit (int): Number of items per page
+        after (list | None): Sort key of the last row of the previous page, from `decode_cursor`
+        filters (dict | None): Key of FILTERS -> value
+        columns (tuple): Columns to select, item_id and the sort column are always included
+
+    Returns:
+        tuple: (rows, next cursor or None when this is the last page)
+    """
+    column = SORT_COLUMNS[sort]
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    comparison = '<' if order == 'desc' else '>'
+    selected = list(columns)
+    for required in ('item_id', column):
+        if required not in selected:
+            selected.append(required)
+
+    conditions = ['owner_id = ?']
+    params = [owner_id]
+    for name, value in (filters or {}).items():
+        conditions.append(FILTERS[name])
+        params.append(value)
+    if after is not None:
+        if sort == 'item_id':
+            conditions.append(f'item_id {comparison} ?')
+        else:
+            conditions.append(f'({column}, item_id) {comparison} (?, ?)')
+        params.extend(after)
+
+    order_by = f'item_id {direction}' if sort == 'item_id' else f'{column} {direction}, item_id {direction}'
+    # Read one extra row to find out whether there is a next page
+    rows = connection.execute(f'SELECT {", ".join(selected)} FROM INVENTORY WHERE {" AND ".join(conditions)} '
+                              f'ORDER BY {order_by} LIMIT ?', params + [limit + 1]).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1], sort)
+    return rows, None
@@ -0,0 +1,98 @@
+"""
+Full-text item search
+
+Item names and descriptions are indexed in the INVENTORY_FTS virtual table
+(SQLite FTS5), which triggers in inventory_schema.sql keep in sync with
+INVENTORY. The owner of each item is indexed as a token too, so a search only
+walks the owner's own matches. Every search term is matched as a prefix and
+results are ranked with BM25, with matches in the name weighted above matches
+in the description.
+"""
+
+
+import re
+
+
+SEARCH_PAGE_SIZE = 25
+MAX_SEARCH_PAGE_SIZE = 100
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def build_match_query(text, owner_id):
+    """
+    Turn user input into an FTS5 query scoped to one owner
+
+    Each word becomes a quoted prefix term, so punctuation in the input can
+    never be read as FTS5 query syntax.
+
+    Args:
+        text (str): Search box input
+        owner_id (int): ID of the user whose items are searched
+
+    Returns:
+        str | None: FTS5 MATCH expression, or None if the input has no words
+    """
+    terms = _TOKEN.findall(text)
+    if not terms:
+        return None
+    prefixes = ' '.join(f'"{term}"*' for term in terms)
+    return f'owner_key : "o{int(owner_id)}" AND ({prefixes})'
+
+
+def search_items(connection, owner_id, text, page=1, limit=SEARCH_PAGE_SIZE):
+    """
+    Find an owner's items whose name or description match the search text
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): ID of the user whose items are searched
+        text (str): Search box input
+        page (int): 1-based page number
+        limit (int): Number of results per page
+
+    Returns:
+        tuple: (rows of item_id, name, image_hash, description, quantity, price, best first,
+            True if there are more results)
+    """
+    query = build_match_query(text, owner_id)
+    if query is None:
+        return [], False
+    offset = (max(page, 1) - 1) * limit
+    rows = connection.execute('SELECT i.item_id, i.name, i.image_hash, i.description, i.quantity, i.price '
+                              'FROM INVENTORY_FTS JOIN INVENTORY AS i ON i.item_id = INVENTORY_FTS.rowid '
+                              'WHERE INVENTORY_FTS MATCH ? ORDER BY rank LIMIT ? OFFSET ?',
+                              (query, limit + 1, offset)).fetchall()
+    return rows[:limit], len(rows) > limit
+
+
+def search_index_exists(connection):
+    """
+    Check whether the database already has the search index
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        bool: True if the INVENTORY_FTS table exists
+    """
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'INVENTORY_FTS'").fetchone() is not None
+
+
+def rebuild_index(connection):
+    """
+    Rebuild the search index from the INVENTORY table and compact it
+
+    Needed once for databases that had items before search existed, and safe
+    to run at any time.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        int: Number of items indexed
+    """
+    with connection:
+        connection.execute("INSERT INTO INVENTORY_FTS(INVENTORY_FTS) VALUES ('rebuild')")
+        connection.execute("INSERT INTO INVENTORY_FTS(INVENTORY_FTS) VALUES ('optimize')")
+    return connection.execute('SELECT COUNT(*) FROM INVENTORY').fetchone()[0]
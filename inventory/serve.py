@@ -0,0 +1,65 @@
+"""
+Production launcher
+
+Creates or upgrades the database once, then serves `inventory.asgi` with
+uvicorn. Use it instead of `flask --app inventory.app run`, which starts
+Flask's development server::
+
+    python -m inventory.serve --host 0.0.0.0 --port 8000 --workers 4
+
+Every option can also be set with an environment variable, INVENTORY_HOST,
+INVENTORY_PORT, INVENTORY_WORKERS and so on. Worker processes share the
+secret key kept in the instance folder unless INVENTORY_SECRET_KEY is set,
+which is needed when several hosts serve the same users.
+"""
+
+
+import argparse
+import os
+import sys
+import uvicorn
+
+
+def _env(name, default, convert=str):
+    value = os.environ.get(f'INVENTORY_{name}')
+    return default if value is None else convert(value)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m inventory.serve', description='Serve the inventory app')
+    parser.add_argument('--host', default=_env('HOST', '127.0.0.1'), help='Address to listen on')
+    parser.add_argument('--port', type=int, default=_env('PORT', 8000, int), help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=_env('WORKERS', 1, int),
+                        help='Server processes, each with its own request threads and caches')
+    parser.add_argument('--limit-concurrency', type=int, default=_env('LIMIT_CONCURRENCY', 1000, int),
+                        help='Open connections per process before new ones get a 503')
+    parser.add_argument('--keep-alive', type=int, default=_env('KEEP_ALIVE', 5, int),
+                        help='Seconds an idle keep-alive connection is held open')
+    parser.add_argument('--forwarded-allow-ips', default=_env('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+                        help='Proxies trusted to set X-Forwarded-* headers')
+    parser.add_argument('--log-level', default=_env('LOG_LEVEL', 'info'), help='uvicorn log level')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Command line entry point
+
+    Args:
+        argv (list | None): Arguments, sys.argv by default
+
+    Returns:
+        int: Exit status
+    """
+    args = _parse_args(argv)
+    from .app import create_app, init_database
+    # Creates the instance secret key too, before the workers race to do so
+    init_database(create_app())
+    uvicorn.run('inventory.asgi:application', host=args.host, port=args.port, workers=args.workers,
+                limit_concurrency=args.limit_concurrency, timeout_keep_alive=args.keep_alive,
+                proxy_headers=True, forwarded_allow_ips=args.forwarded_allow_ips, log_level=args.log_level)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Splitting a shared database into per-store shards
+
+`split_database` copies an existing database into the layout used when
+SHARD_DIR is set: a catalog database with USERS and API_TOKENS and one database file per
+store holding its items, images, stock ledger and export jobs. Search index
+entries, store summaries and image reference counts are rebuilt by the
+schema's triggers as the items are copied in. The source database is only
+read.
+"""
+
+
+import os
+import sqlite3
+from .db import SCHEMA_PATH, shard_path
+
+
+# Tables copied row for row into each store's shard, as (table, WHERE clause selecting the store's rows)
+_STORE_TABLES = [
+    ('IMAGES', 'hash IN (SELECT image_hash FROM src.INVENTORY WHERE owner_id = :owner_id)'),
+    ('IMAGE_RENDITIONS', 'hash IN (SELECT image_hash FROM src.INVENTORY WHERE owner_id = :owner_id)'),
+    ('INVENTORY', 'owner_id = :owner_id'),
+    ('STOCK_LEDGER', 'owner_id = :owner_id'),
+    ('STOCK_SNAPSHOTS', 'owner_id = :owner_id'),
+    ('STOCK_SNAPSHOT_ITEMS',
+     'snapshot_id IN (SELECT snapshot_id FROM src.STOCK_SNAPSHOTS WHERE owner_id = :owner_id)'),
+    ('EXPORT_JOBS', 'owner_id = :owner_id'),
+]
+
+
+def _create(path):
+    connection = sqlite3.connect(path)
+    with open(SCHEMA_PATH) as f:
+        connection.executescript(f.read())
+    return connection
+
+
+def _copy_rows(connection, table, where, params):
+    # Name the columns, tables of upgraded databases may have them in another order
+    columns = [row[1] for row in connection.execute(f'PRAGMA main.table_info({table})')]
+    # Image reference counts start at zero and are counted up by the INVENTORY insert triggers
+    select = ['0' if table == 'IMAGES' and column == 'refcount' else column for column in columns]
+    connection.execute(f'INSERT INTO main.{table} ({", ".join(columns)}) SELECT {", ".join(select)} '
+                       f'FROM src.{table} WHERE {where}', params)
+
+
+def _copy_sequence(connection, table):
+    # Keep AUTOINCREMENT counters, so IDs of deleted rows are not handed out again
+    connection.execute('DELETE FROM main.sqlite_sequence WHERE name = ?', (table,))
+    connection.execute('INSERT INTO main.sqlite_sequence (name, seq) '
+                       'SELECT name, seq FROM src.sqlite_sequence WHERE name = ?', (table,))
+
+
+def split_database(source, catalog, shard_dir):
+    """
+    Copy a shared database into a catalog and one database per store
+
+    Args:
+        source (sqlite3.Connection): Connection to the up to date database to split
+        catalog (str): Path of the catalog database to create
+        shard_dir (str): Directory the store databases are created in
+
+    Returns:
+        int: Number of stores copied
+
+    Raises:
+        FileExistsError: If the catalog or a store database already exists
+    """
+    source_path = source.execute('PRAGMA database_list').fetchone()[2]
+    owners = [row[0] for row in source.execute('SELECT user_id FROM USERS ORDER BY user_id')]
+    targets = [catalog] + [shard_path(shard_dir, owner_id) for owner_id in owners]
+    existing = [path for path in targets if os.path.exists(path)]
+    if existing:
+        raise FileExistsError(f'{existing[0]} already exists')
+    os.makedirs(shard_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(catalog)), exist_ok=True)
+
+    connection = _create(catalog)
+    try:
+        connection.execute('ATTACH DATABASE ? AS src', (source_path,))
+        with connection:
+            _copy_rows(connection, 'USERS', '1', {})
+            _copy_sequence(connection, 'USERS')
+            _copy_rows(connection, 'API_TOKENS', '1', {})
+            _copy_sequence(connection, 'API_TOKENS')
+    finally:
+        connection.close()
+
+    for owner_id in owners:
+        connection = _create(shard_path(shard_dir, owner_id))
+        try:
+            connection.execute('ATTACH DATABASE ? AS src', (source_path,))
+            params = {'owner_id': owner_id}
+            with connection:
+                for table, where in _STORE_TABLES:
+                    if table == 'STOCK_LEDGER':
+                        # Replace the 'add' entries the insert trigger wrote with the store's real history
+                        connection.execute('DELETE FROM main.STOCK_LEDGER')
+                    _copy_rows(connection, table, where, params)
+                _copy_sequence(connection, 'INVENTORY')
+                # Move the version past the one clients saw, so their ETags from the shared database do not match
+                connection.execute('INSERT OR REPLACE INTO main.INVENTORY_VERSIONS (owner_id, version) '
+                                   'SELECT :owner_id, MAX(COALESCE((SELECT version FROM src.INVENTORY_VERSIONS '
+                                   'WHERE owner_id = :owner_id), 0), COALESCE((SELECT version FROM '
+                                   'main.INVENTORY_VERSIONS WHERE owner_id = :owner_id), 0)) + 1', params)
+        finally:
+            connection.close()
+    return len(owners)
@@ -0,0 +1,129 @@
+"""
+Batch stock adjustments
+
+Stocktakes and goods receiving change many items at once. An adjustment
+either adds a relative `delta` to an item's quantity (receiving, breakage) or
+sets an absolute `count` (stocktake). A whole batch is checked against the
+owner's items first and then applied with one `executemany` in a single
+transaction, so either every adjustment is applied or none is. A batch that
+would leave any item with less than no stock is refused as a whole.
+"""
+
+
+import json
+from .importer import parse_integer
+
+
+# Largest number of adjustments accepted in one batch
+MAX_ADJUSTMENTS = 5000
+
+# One statement handles both kinds: a count replaces the quantity, a delta is added to it
+_ADJUST_SQL = '''
+    UPDATE INVENTORY
+    SET quantity = COALESCE(:count, quantity) + COALESCE(:delta, 0), updated_at = CURRENT_TIMESTAMP
+    WHERE item_id = :item_id AND owner_id = :owner_id
+'''
+
+# Adjusted items whose stock went below zero, or overflowed SQLite's integers into a REAL
+_INVALID_STOCK_SQL = '''
+    SELECT item_id, name FROM INVENTORY
+    WHERE owner_id = ? AND item_id IN (SELECT value FROM json_each(?))
+        AND (quantity < 0 OR typeof(quantity) != 'integer')
+    ORDER BY item_id
+'''
+
+
+def parse_adjustments(adjustments, owner_id):
+    """
+    Validate a batch of adjustments and turn it into statement parameters
+
+    Args:
+        adjustments (list): Dicts with an `item_id` and either a `delta` or a `count`
+        owner_id (int): ID of the user whose items are adjusted
+
+    Returns:
+        list: Named parameters for the adjustment statement, in the given order
+
+    Raises:
+        ValueError: If the batch is empty, too large or an adjustment is malformed
+    """
+    if not isinstance(adjustments, list) or not adjustments:
+        raise ValueError('adjustments must be a non-empty list')
+    if len(adjustments) > MAX_ADJUSTMENTS:
+        raise ValueError(f'at most {MAX_ADJUSTMENTS} adjustments can be applied at once')
+
+    params = []
+    for index, adjustment in enumerate(adjustments):
+        label = f'adjustment {index}'
+        if not isinstance(adjustment, dict) or 'item_id' not in adjustment:
+            raise ValueError(f'{label}: item_id is required')
+        if ('delta' in adjustment) == ('count' in adjustment):
+            raise ValueError(f'{label}: give exactly one of delta or count')
+        count = None
+        delta = None
+        if 'count' in adjustment:
+            count = parse_integer(adjustment['count'], 'count', label)
+            if count < 0:
+                raise ValueError(f'{label}: count cannot be negative')
+        else:
+            delta = parse_integer(adjustment['delta'], 'delta', label)
+        params.append({
+            'item_id': parse_integer(adjustment['item_id'], 'item_id', label),
+            'count': count,
+            'delta': delta,
+            'owner_id': owner_id,
+        })
+    return params
+
+
+def missing_items(connection, owner_id, item_ids):
+    """
+    Find which of the given items do not exist in an owner's inventory
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): ID of the user the items should belong to
+        item_ids (iterable): Item IDs to check
+
+    Returns:
+        list: Sorted IDs that are not the owner's items
+    """
+    wanted = sorted(set(item_ids))
+    found = {row[0] for row in connection.execute(
+        'SELECT item_id FROM INVENTORY WHERE owner_id = ? AND item_id IN (SELECT value FROM json_each(?))',
+        (owner_id, json.dumps(wanted)))}
+    return [item_id for item_id in wanted if item_id not in found]
+
+
+def apply_adjustments(connection, owner_id, adjustments):
+    """
+    Apply a batch of stock adjustments in one transaction
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+        owner_id (int): ID of the user whose items are adjusted
+        adjustments (list): Dicts with an `item_id` and either a `delta` or a `count`
+
+    Returns:
+        dict: item_id -> new quantity for every adjusted item
+
+    Raises:
+        ValueError: If the batch is malformed or would leave an item below zero
+        LookupError: If an item does not belong to the owner, with the missing IDs as its argument
+    """
+    params = parse_adjustments(adjustments, owner_id)
+    item_ids = json.dumps(sorted({param['item_id'] for param in params}))
+    with connection:
+        missing = missing_items(connection, owner_id, [param['item_id'] for param in params])
+        if missing:
+            raise LookupError(missing)
+        connection.executemany(_ADJUST_SQL, params)
+        invalid = connection.execute(_INVALID_STOCK_SQL, (owner_id, item_ids)).fetchall()
+        if invalid:
+            # Raising inside the transaction rolls the whole batch back
+            names = ', '.join(f'{name!r} (item {item_id})' for item_id, name in invalid)
+            raise ValueError(f'stock cannot go below zero or out of range, refused for {names}')
+        rows = connection.execute('SELECT item_id, quantity FROM INVENTORY WHERE owner_id = ? '
+                                  'AND item_id IN (SELECT value FROM json_each(?)) ORDER BY item_id',
+                                  (owner_id, item_ids)).fetchall()
+    return {item_id: quantity for item_id, quantity in rows}
@@ -0,0 +1,90 @@
+"""
+Store summary aggregates
+
+The dashboard totals of each store (items, units on hand, stock value and low
+and out of stock counts) live in STORE_SUMMARY, one row per owner. Triggers on
+INVENTORY apply every insert, update and delete to that row in the same
+transaction as the change, so reading the dashboard is a single primary key
+lookup however large the catalogue is. `verify_summary` and `rebuild_summary`
+compare against and recompute from a full scan, for maintenance.
+"""
+
+
+SUMMARY_COLUMNS = ('item_count', 'units', 'stock_value_cents', 'low_count', 'out_count')
+
+# The same per-item contributions the triggers add and subtract, summed over INVENTORY
+_AGGREGATE_SQL = '''
+    SELECT owner_id, COUNT(*), COALESCE(SUM(quantity), 0),
+           COALESCE(SUM(CAST(ROUND(quantity * price * 100) AS INTEGER)), 0),
+           COALESCE(SUM(quantity <= reorder_threshold), 0), COALESCE(SUM(quantity = 0), 0)
+    FROM INVENTORY GROUP BY owner_id
+'''
+
+
+def get_summary(connection, owner_id):
+    """
+    Read a store's dashboard totals
+
+    Args:
+        connection (sqlite3.Connection): Connection to query
+        owner_id (int): ID of the user whose store is summarised
+
+    Returns:
+        dict: item_count, units, stock_value, low_count and out_count, all zero for an empty store
+    """
+    row = connection.execute(f'SELECT {", ".join(SUMMARY_COLUMNS)} FROM STORE_SUMMARY WHERE owner_id = ?',
+                             (owner_id,)).fetchone()
+    summary = dict(zip(SUMMARY_COLUMNS, row if row is not None else (0,) * len(SUMMARY_COLUMNS)))
+    summary['stock_value'] = summary.pop('stock_value_cents') / 100
+    return summary
+
+
+def summary_exists(connection):
+    """
+    Check whether the database already has the summary table
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        bool: True if the STORE_SUMMARY table exists
+    """
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'STORE_SUMMARY'").fetchone() is not None
+
+
+def verify_summary(connection):
+    """
+    Compare every store's summary row with totals computed from INVENTORY
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        dict: owner_id -> (stored totals, actual totals) for every store whose row is wrong
+    """
+    actual = {row[0]: tuple(row[1:]) for row in connection.execute(_AGGREGATE_SQL)}
+    stored = {row[0]: tuple(row[1:]) for row in connection.execute(
+        f'SELECT owner_id, {", ".join(SUMMARY_COLUMNS)} FROM STORE_SUMMARY')}
+    empty = (0,) * len(SUMMARY_COLUMNS)
+    mismatches = {}
+    for owner_id in actual.keys() | stored.keys():
+        if stored.get(owner_id, empty) != actual.get(owner_id, empty):
+            mismatches[owner_id] = (stored.get(owner_id, empty), actual.get(owner_id, empty))
+    return mismatches
+
+
+def rebuild_summary(connection):
+    """
+    Recompute every store's summary row from INVENTORY
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database
+
+    Returns:
+        int: Number of stores summarised
+    """
+    with connection:
+        connection.execute('DELETE FROM STORE_SUMMARY')
+        cursor = connection.execute(f'INSERT INTO STORE_SUMMARY (owner_id, {", ".join(SUMMARY_COLUMNS)}) '
+                                    f'{_AGGREGATE_SQL}')
+    return cursor.rowcount
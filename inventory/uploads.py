@@ -0,0 +1,61 @@
+"""
+Upload limits and buffering
+
+Request bodies larger than MAX_CONTENT_LENGTH are refused with a 413 as soon
+as their Content-Length is seen, before anything is read; routes that take
+larger files, such as imports, raise the limit for their own requests.
+Uploaded files are buffered by `UploadRequest` in memory up to
+UPLOAD_MEMORY_LIMIT, so with the default limits an image upload never goes
+through a temporary file; only larger uploads spill to disk.
+
+Configuration keys (all optional):
+    MAX_CONTENT_LENGTH (int): Largest request body in bytes, 16 MiB unless set
+    IMPORT_MAX_CONTENT_LENGTH (int): Largest request body for bulk imports
+    UPLOAD_MEMORY_LIMIT (int): Bytes of uploaded files kept in memory before spilling to a temporary file
+"""
+
+
+import tempfile
+from flask import Request, current_app, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+DEFAULT_MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+
+
+class UploadRequest(Request):
+    """
+    Request whose uploaded files stay in memory up to UPLOAD_MEMORY_LIMIT
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=current_app.config['UPLOAD_MEMORY_LIMIT'])
+
+
+def init_app(app):
+    """
+    Register upload limits and buffering on a Flask app
+
+    Args:
+        app (Flask): Application to configure
+    """
+    # Flask defines MAX_CONTENT_LENGTH as None, so setdefault would never apply
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        app.config['MAX_CONTENT_LENGTH'] = DEFAULT_MAX_CONTENT_LENGTH
+    app.config.setdefault('IMPORT_MAX_CONTENT_LENGTH', 256 * 1024 * 1024)
+    app.config.setdefault('UPLOAD_MEMORY_LIMIT', app.config['MAX_CONTENT_LENGTH'])
+    app.request_class = UploadRequest
+    app.register_error_handler(RequestEntityTooLarge, upload_too_large)
+
+
+def upload_too_large(error):
+    """
+    Answer a request whose body is over the size limit
+
+    Args:
+        error (RequestEntityTooLarge): The error
+
+    Returns:
+        tuple: Message and 413 status
+    """
+    limit = request.max_content_length
+    return f'The upload is larger than the {limit / (1024 * 1024):g} MB limit', 413
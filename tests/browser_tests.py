@@ -51,7 +51,7 @@ class BusinessInventoryTests(unittest.TestCase):
         item_description_box.send_keys("Green")
         item_quantity_box.send_keys("4")
         item_price_box.send_keys("0.99")
-        submit_item=driver.find_element(By.XPATH, "//form[1]/input[6]")
+        submit_item=driver.find_element(By.XPATH, "//form[1]/input[7]")
         submit_item.click()
         self.assertIn("Business Inventory Home", driver.title)
 
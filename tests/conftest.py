@@ -0,0 +1,120 @@
+"""
+Shared fixtures for the Flask test client suite
+
+Every test gets its own database in a temporary directory and a client
+logged in as the owner of a small store. The Selenium tests in
+browser_tests.py run against a deployed server and are not collected here.
+"""
+
+
+import io
+import pytest
+from inventory import create_app, init_database
+from inventory.api import create_token
+from inventory.db import close_pools, get_catalog_db, get_db
+
+
+def make_jpeg(color='red', size=(64, 48)):
+    """
+    Build a small JPEG image
+
+    Args:
+        color (str): Fill color
+        size (tuple): Width and height in pixels
+
+    Returns:
+        bytes: The image
+    """
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def add_item(client, name, image=None, quantity=1, price='1.00'):
+    """
+    Add an item through the add form
+
+    Args:
+        client (FlaskClient): Logged in client
+        name (str): Item name
+        image (bytes | None): Image file to upload
+        quantity (int): Quantity in stock
+        price (str): Price
+    """
+    data = {'name': name, 'description': f'about {name}', 'quantity': str(quantity), 'price': price}
+    if image is not None:
+        data['image'] = (io.BytesIO(image), 'image.jpg')
+    response = client.post('/add', data=data, content_type='multipart/form-data')
+    assert response.status_code == 302
+
+
+def register_and_login(client, username, store_name='Store'):
+    """
+    Register a user and log the client in as them
+
+    Args:
+        client (FlaskClient): Client to log in
+        username (str): Name of the new user
+        store_name (str): Name of the user's store
+    """
+    response = client.post('/register', data={'username': username, 'user_password': 'pw', 'store_name': store_name})
+    assert response.status_code == 302
+    response = client.post('/login', data={'username': username, 'user_password': 'pw'})
+    assert response.status_code == 302
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Uploads are staged in a temp/ folder of the working directory
+    monkeypatch.chdir(tmp_path)
+    app = create_app({'DATABASE': str(tmp_path / 'inventory.db'), 'TESTING': True, 'SECRET_KEY': 'test',
+                      'EXPORT_SPOOL_DIR': str(tmp_path / 'exports')})
+    init_database(app)
+    yield app
+    close_pools(app)
+
+
+@pytest.fixture
+def client(app):
+    """
+    Client logged in as 'owner', whose store holds item0 .. item4 with quantities 0 .. 4
+    """
+    client = app.test_client()
+    register_and_login(client, 'owner')
+    for index in range(5):
+        response = client.post('/add', data={'name': f'item{index}', 'description': f'desc {index}',
+                                             'quantity': str(index), 'price': '1.50'})
+        assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def other_client(app, client):
+    """
+    Client logged in as 'other', the owner of a second, empty store
+    """
+    other = app.test_client()
+    register_and_login(other, 'other', 'Other store')
+    return other
+
+
+@pytest.fixture
+def api_headers(app, client):
+    """
+    Authorization header of an API token acting for 'owner'
+    """
+    with app.app_context():
+        _, token = create_token(get_catalog_db(), 1, 'tests')
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def query(app):
+    """
+    Run a query against the database and return all rows as tuples
+    """
+    def run(sql, params=()):
+        with app.app_context():
+            return [tuple(row) for row in get_db().execute(sql, params).fetchall()]
+    return run
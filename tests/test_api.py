@@ -0,0 +1,127 @@
+import base64
+import gzip
+import json
+import pytest
+from conftest import make_jpeg
+from inventory.api import create_token
+from inventory.db import get_catalog_db
+
+
+def patch(client, headers, **changes):
+    return client.patch('/api/v1/items', json={'items': [dict(item_id=2, **changes)]}, headers=headers)
+
+
+def create(client, headers, **fields):
+    item = dict({'name': 'new item', 'description': 'x', 'quantity': 1, 'price': 1}, **fields)
+    return client.post('/api/v1/items', json={'items': [item]}, headers=headers)
+
+
+def test_requires_a_token(client):
+    response = client.get('/api/v1/items')
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+
+def test_list_with_fields(client, api_headers):
+    response = client.get('/api/v1/items?fields=item_id,quantity&limit=2', headers=api_headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['items'] == [{'item_id': 1, 'quantity': 0}, {'item_id': 2, 'quantity': 1}]
+    assert body['next_after']
+    assert client.get('/api/v1/items?fields=secret', headers=api_headers).status_code == 400
+
+
+def test_unchanged_reads_are_not_modified(client, api_headers):
+    response = client.get('/api/v1/items/1', headers=api_headers)
+    again = client.get('/api/v1/items/1', headers=dict(api_headers, **{'If-None-Match': response.headers['ETag']}))
+    assert again.status_code == 304
+
+
+@pytest.mark.parametrize('changes', [
+    {'price': 'nan'}, {'price': 'inf'}, {'price': 'cheap'}, {'quantity': 10 ** 20}, {'quantity': -4},
+    {'quantity': '3.7'}, {'reorder_threshold': 10 ** 20},
+])
+def test_patch_rejects_bad_numbers(client, api_headers, query, changes):
+    response = patch(client, api_headers, **changes)
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('item 0:')
+    assert query('SELECT quantity, price FROM INVENTORY WHERE item_id = 2') == [(1, 1.5)]
+
+
+def test_patch_changes_only_given_fields(client, api_headers, query):
+    response = patch(client, api_headers, price=2.25, quantity='8')
+    assert response.status_code == 200
+    assert response.get_json()['items'][0]['price'] == 2.25
+    assert query('SELECT quantity, price, description FROM INVENTORY WHERE item_id = 2') == [(8, 2.25, 'desc 1')]
+
+
+def test_patch_other_stores_items_is_not_found(client, other_client, api_headers, query):
+    other_item = other_client.post('/add', data={'name': 'theirs', 'description': 'x', 'quantity': '1', 'price': '1'})
+    assert other_item.status_code == 302
+    item_id = query("SELECT item_id FROM INVENTORY WHERE name = 'theirs'")[0][0]
+    response = client.patch('/api/v1/items', json={'items': [{'item_id': item_id, 'quantity': 0}]},
+                            headers=api_headers)
+    assert response.status_code == 404
+    assert query('SELECT quantity FROM INVENTORY WHERE item_id = ?', (item_id,)) == [(1,)]
+
+
+@pytest.mark.parametrize('fields', [
+    {'quantity': 'inf'}, {'quantity': 10 ** 20}, {'price': 'nan'}, {'quantity': -1},
+    {'image': 'aGVsbG8='}, {'image': 'not base64!'},
+])
+def test_create_rejects_bad_items(client, api_headers, query, fields):
+    assert create(client, api_headers, **fields).status_code == 400
+    assert query("SELECT count(*) FROM INVENTORY WHERE name = 'new item'") == [(0,)]
+
+
+def test_create_with_image(client, api_headers, query):
+    response = create(client, api_headers, image=base64.b64encode(make_jpeg()).decode('ascii'))
+    assert response.status_code == 201
+    item = response.get_json()['items'][0]
+    assert item['image_hash']
+    assert query('SELECT mime FROM IMAGES WHERE hash = ?', (item['image_hash'],)) == [('image/jpeg',)]
+
+
+def test_create_duplicate_name_conflicts(client, api_headers):
+    response = create(client, api_headers, name='item1')
+    assert response.status_code == 409
+    assert response.get_json()['names'] == ['item1']
+
+
+def test_batch_get_and_delete(client, api_headers, query):
+    response = client.get('/api/v1/items/batch?ids=3,1,999&fields=item_id', headers=api_headers)
+    assert response.get_json() == {'items': [{'item_id': 3}, {'item_id': 1}], 'missing': [999]}
+    assert client.delete('/api/v1/items?ids=1,999', headers=api_headers).status_code == 404
+    assert client.delete('/api/v1/items?ids=1,3', headers=api_headers).get_json() == {'deleted': [1, 3]}
+    assert query('SELECT item_id FROM INVENTORY ORDER BY item_id') == [(2,), (4,), (5,)]
+
+
+def test_names_only_conflict_within_the_store(client, other_client, app, api_headers, query):
+    with app.app_context():
+        _, token = create_token(get_catalog_db(), 2, 'theirs')
+    response = create(other_client, {'Authorization': f'Bearer {token}'}, name='item1')
+    assert response.status_code == 201
+    response = patch(client, api_headers, name='item3')
+    assert response.status_code == 409 and response.get_json()['names'] == ['item3']
+    assert query("SELECT owner_id FROM INVENTORY WHERE name = 'item1' ORDER BY owner_id") == [(1,), (2,)]
+
+
+def test_token_commands(app, client):
+    runner = app.test_cli_runner()
+    output = runner.invoke(args=['create-api-token', '--owner', 'owner', '--name', 'shop sync']).output
+    token_id, token = output.split('\n')[0].removeprefix('Token ').split(': ')
+    headers = {'Authorization': f'Bearer {token}'}
+    assert client.get('/api/v1/items/2', headers=headers).get_json()['name'] == 'item1'
+    assert f'{token_id}\towner\tshop sync' in runner.invoke(args=['list-api-tokens', '--owner', 'owner']).output
+    assert runner.invoke(args=['create-api-token', '--owner', 'nobody', '--name', 'x']).exit_code != 0
+    assert runner.invoke(args=['revoke-api-token', token_id]).exit_code == 0
+    assert client.get('/api/v1/items/2', headers=headers).status_code == 401
+    assert runner.invoke(args=['revoke-api-token', token_id]).exit_code != 0
+
+
+def test_large_responses_are_gzipped(app, client, api_headers, monkeypatch):
+    monkeypatch.setitem(app.config, 'API_GZIP_MIN_SIZE', 100)
+    response = client.get('/api/v1/items', headers=dict(api_headers, **{'Accept-Encoding': 'gzip'}))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.get_data()))['items']) == 5
+    assert 'Content-Encoding' not in client.get('/api/v1/items', headers=api_headers).headers
@@ -0,0 +1,85 @@
+import json
+import os
+import sqlite3
+import pytest
+from benchmarks import fixtures
+from benchmarks.fixtures import build_fixture, ensure_fixture, fixture_path
+from benchmarks.loadtest import compare, main, percentile
+
+
+def read(path, sql):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
+
+
+def test_fixtures_are_reproducible(tmp_path):
+    first = build_fixture(str(tmp_path / 'a.db'), 200)
+    second = build_fixture(str(tmp_path / 'b.db'), 200)
+    sql = 'SELECT name, description, quantity, price, reorder_threshold FROM INVENTORY ORDER BY item_id'
+    assert read(first, sql) == read(second, sql)
+    assert read(first, 'SELECT count(*), count(DISTINCT owner_id) FROM INVENTORY') == [(200, 1)]
+    low = read(first, 'SELECT count(*) FROM INVENTORY WHERE quantity <= reorder_threshold')[0][0]
+    assert 20 < low < 80
+
+
+def test_fixture_with_images(tmp_path):
+    path = build_fixture(str(tmp_path / 'images.db'), 20, images=True)
+    assert read(path, 'SELECT count(*) FROM INVENTORY WHERE image_hash IS NULL') == [(0,)]
+    # Items cycle through a fixed set of photos, each stored once with its renditions
+    assert read(path, 'SELECT count(*), min(refcount) FROM IMAGES') == [(16, 1)]
+    assert read(path, 'SELECT count(DISTINCT hash) FROM IMAGE_RENDITIONS') == [(16,)]
+
+
+def test_fixtures_are_cached(tmp_path, monkeypatch):
+    monkeypatch.setitem(fixtures.FIXTURE_SIZES, '1k', 10)
+    path = ensure_fixture(str(tmp_path), '1k')
+    assert path == fixture_path(str(tmp_path), '1k', False)
+    modified = os.path.getmtime(path)
+    os.utime(path, (0, 0))
+    assert ensure_fixture(str(tmp_path), '1k') == path
+    assert os.path.getmtime(path) == 0
+    ensure_fixture(str(tmp_path), '1k', rebuild=True)
+    assert os.path.getmtime(path) >= modified
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert (percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99)) == (50, 95, 99)
+    assert percentile([], 0.5) is None
+
+
+def test_compare_reports_regressions():
+    baseline = {'scenarios': {'inventory': {'p95_ms': 10, 'throughput': 100},
+                              'login': {'p95_ms': 10, 'throughput': 100}}}
+    results = {'scenarios': {'inventory': {'p95_ms': 11.9, 'throughput': 84},
+                             'login': {'p95_ms': 12.5, 'throughput': 80}, 'add': {'p95_ms': 1, 'throughput': 1}}}
+    regressions = compare(results, baseline, 0.2)
+    assert [message.split(':')[0] for message in regressions] == ['login', 'login']
+
+
+def test_run_and_compare_with_baseline(tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(fixtures.FIXTURE_SIZES, '1k', 50)
+    output = tmp_path / 'run.json'
+    argv = ['--fixture-dir', str(tmp_path), '--scenarios', 'login,inventory,low_stock,xml_export,add',
+            '--requests', '8', '--concurrency', '2', '--output', str(output)]
+    assert main(argv) == 0
+    report = json.loads(output.read_text())
+    assert report['meta']['items'] == 50
+    for result in report['scenarios'].values():
+        assert result['requests'] == 8
+        assert result['errors'] == 0
+        assert result['p50_ms'] <= result['p95_ms'] <= result['max_ms']
+    # The run works on a copy, the cached fixture is left as it was
+    assert not os.path.exists(fixture_path(str(tmp_path), '1k', False) + '.run')
+    assert read(fixture_path(str(tmp_path), '1k', False), 'SELECT count(*) FROM INVENTORY') == [(50,)]
+
+    # A baseline far faster than anything achievable is a regression
+    for result in report['scenarios'].values():
+        result['p95_ms'] = 0.0001
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(report))
+    assert main(argv[:-2] + ['--baseline', str(baseline)]) == 1
+    assert 'REGRESSION' in capsys.readouterr().err
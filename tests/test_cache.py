@@ -0,0 +1,49 @@
+import pytest
+from inventory.app import User
+from inventory.cache import TTLCache
+
+
+def test_authenticated_requests_hit_the_user_cache(client):
+    before = client.get('/cache-stats').get_json()['users']
+    for _ in range(3):
+        assert client.get('/inventory').status_code == 200
+    after = client.get('/cache-stats').get_json()['users']
+    # The three pages and the second stats request each load the user once
+    assert after['hits'] == before['hits'] + 4
+    assert after['misses'] == before['misses']
+
+
+def test_cache_miss_reads_the_user(client, app):
+    user_cache = app.extensions['user_cache']
+    user_cache.clear()
+    with app.test_request_context():
+        user = User.get(1)
+        assert (user.id, user.username, user.store_name) == (1, 'owner', 'Store')
+        assert not hasattr(user, 'user_password')
+        assert User.get(1) is user
+        assert User.get(99) is None
+    assert user_cache.stats()['size'] == 1
+
+
+def test_login_refreshes_the_cached_user(app, client):
+    user_cache = app.extensions['user_cache']
+    user_cache.set(1, User(1, 'owner', 'Stale name'))
+    client.get('/logout')
+    client.post('/login', data={'username': 'owner', 'user_password': 'pw'})
+    assert user_cache.get(1).store_name == 'Store'
+
+
+def test_ttl_and_lru(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('inventory.cache.time.monotonic', lambda: now[0])
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    now[0] += 11
+    assert cache.get('a', 'gone') == 'gone'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 2, 1)
+    assert stats['hit_ratio'] == pytest.approx(1 / 3)
@@ -0,0 +1,60 @@
+import io
+import pytest
+
+
+def revalidate(client, path):
+    first = client.get(path)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    return etag, client.get(path, headers={'If-None-Match': etag})
+
+
+@pytest.mark.parametrize('path', ['/inventory', '/low-stock', '/xml-export?mode=direct',
+                                  '/xlsx-export?mode=direct&images=none'])
+def test_unchanged_pages_get_304(client, path):
+    etag, again = revalidate(client, path)
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert again.get_data() == b''
+    assert 'no-cache' in again.headers['Cache-Control'] and 'private' in again.headers['Cache-Control']
+
+
+@pytest.mark.parametrize('change', [
+    lambda client: client.post('/add', data={'name': 'new', 'description': 'x', 'quantity': '1', 'price': '1'}),
+    lambda client: client.post('/edit/item1', data={'quantity': '7'}),
+    lambda client: client.post('/delete', data={'deleteItem': '1'}),
+    lambda client: client.post('/stock/adjust', json={'adjustments': [{'item_id': 2, 'delta': 1}]}),
+    lambda client: client.post('/import', data={'file': (io.BytesIO(b'name,description,quantity,price\n'
+                                                                     b'item3,x,1,1\n'), 'items.csv')}),
+])
+def test_every_change_invalidates(client, change):
+    etag, _ = revalidate(client, '/inventory')
+    change(client)
+    response = client.get('/inventory', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_etags_differ_per_url_and_store(client, other_client):
+    etag, _ = revalidate(client, '/inventory')
+    assert client.get('/inventory?sort=name').headers['ETag'] != etag
+    response = other_client.get('/inventory', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+def test_rendered_pages_are_cached_until_the_inventory_changes(app, client):
+    app.extensions['page_cache'].clear()
+    before = client.get('/cache-stats').get_json()['pages']
+    first = client.get('/inventory').get_data()
+    assert client.get('/inventory').get_data() == first
+    stats = client.get('/cache-stats').get_json()['pages']
+    assert (stats['hits'] - before['hits'], stats['misses'] - before['misses'], stats['size']) == (1, 1, 1)
+    client.post('/edit/item1', data={'quantity': '42'})
+    assert b'42' in client.get('/inventory').get_data()
+
+
+def test_other_stores_changes_keep_the_version(client, other_client):
+    etag, _ = revalidate(client, '/inventory')
+    other_client.post('/add', data={'name': 'theirs', 'description': 'x', 'quantity': '1', 'price': '1'})
+    assert client.get('/inventory', headers={'If-None-Match': etag}).status_code == 304
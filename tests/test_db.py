@@ -0,0 +1,54 @@
+import sqlite3
+import pytest
+from inventory.db import ConnectionPool, PoolTimeout, get_db, get_pool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), size=2, timeout=0.1)
+    yield pool
+    pool.close()
+
+
+def test_released_connections_are_reused(pool):
+    connection = pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is connection
+
+
+def test_pragmas_are_applied(pool):
+    connection = pool.acquire()
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert connection.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+    assert connection.row_factory is sqlite3.Row
+
+
+def test_pool_is_bounded(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(held.pop())
+    assert pool.acquire() is not None
+
+
+def test_release_rolls_back_open_transactions(pool):
+    connection = pool.acquire()
+    connection.execute('CREATE TABLE t (x)')
+    connection.execute('INSERT INTO t VALUES (1)')
+    assert connection.in_transaction
+    pool.release(connection)
+    connection = pool.acquire()
+    assert not connection.in_transaction
+    assert connection.execute('SELECT count(*) FROM t').fetchone()[0] == 0
+
+
+def test_requests_share_one_pooled_connection(app, client):
+    with app.app_context():
+        first = get_db()
+        assert get_db() is first
+    with app.app_context():
+        assert get_db() is first
+    client.get('/inventory')
+    client.get('/inventory')
+    # Every request gave its connection back, so nothing beyond the test's own connection was ever opened
+    assert get_pool(app)._idle.qsize() == 1
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import pytest
+from conftest import add_item
+from inventory.events import asgi_events, bus, format_event, stock_state, stream_events
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """
+    Events published on the change bus, as (owner_id, event, data)
+    """
+    events = []
+    monkeypatch.setattr(bus, 'publish', lambda owner_id, event, data: events.append((owner_id, event, data)))
+    return events
+
+
+def parse(message):
+    fields = dict(line.split(': ', 1) for line in message.decode().strip().split('\n'))
+    return fields['event'], json.loads(fields['data'])
+
+
+def test_stock_state_and_format():
+    assert [stock_state(quantity, 2) for quantity in (0, 1, 2, 3)] == ['out', 'low', 'low', 'ok']
+    assert format_event('reload', {'version': 3}) == b'event: reload\ndata: {"version":3}\n\n'
+
+
+def test_add_edit_and_delete_publish_changes(client, published):
+    add_item(client, 'fresh', quantity=3)
+    client.post('/edit/fresh', data={'quantity': '12'})
+    client.post('/delete', data={'deleteItem': '6'})
+    changes = [(owner_id, data['change'], data['item']['name']) for owner_id, event, data in published
+               if event == 'item']
+    assert changes == [(1, 'added', 'fresh'), (1, 'updated', 'fresh'), (1, 'deleted', 'fresh')]
+    versions = [data['version'] for _, event, data in published if event == 'item']
+    assert versions == sorted(versions) and len(set(versions)) == 3
+
+
+def test_alerts_follow_stock_state_changes(client, published):
+    add_item(client, 'fresh', quantity=3)
+    client.post('/edit/fresh', data={'quantity': '0'})
+    client.post('/edit/fresh', data={'quantity': '0'})
+    client.post('/edit/fresh', data={'quantity': '50'})
+    alerts = [(data['previous_state'], data['state']) for _, event, data in published if event == 'alert']
+    assert alerts == [('ok', 'low'), ('low', 'out'), ('out', 'ok')]
+
+
+def test_bulk_changes_publish_a_reload(client, published):
+    client.post('/stock/adjust', json={'adjustments': [{'item_id': 2, 'delta': 1}]})
+    assert [event for _, event, _ in published] == ['reload']
+
+
+def test_other_stores_cannot_edit_or_delete(client, other_client, query, published):
+    assert other_client.get('/edit/item1').status_code == 404
+    other_client.post('/edit/item1', data={'quantity': '99', 'reorder_threshold': '50'})
+    other_client.post('/delete', data={'deleteItem': '2'})
+    assert query("SELECT quantity, reorder_threshold FROM INVENTORY WHERE item_id = 2") == [(1, 10)]
+    assert published == []
+
+
+def test_stream_delivers_the_stores_events(app, client, other_client):
+    with app.app_context():
+        mine, theirs = stream_events(app, 1), stream_events(app, 2)
+        assert next(mine) == b'retry: 5000\n\n' and next(theirs) == b'retry: 5000\n\n'
+        client.post('/edit/item3', data={'quantity': '30'})
+        event, data = parse(next(mine))
+        assert (event, data['change'], data['item']['quantity'], data['item']['state']) == \
+            ('item', 'updated', 30, 'ok')
+        assert parse(next(mine))[0] == 'alert'
+        mine.close()
+        theirs.close()
+    assert bus.subscriber_count() == 0
+
+
+def test_stream_catches_up_with_missed_changes(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 0.01)
+    monkeypatch.setitem(app.config, 'EVENTS_QUEUE_SIZE', 1)
+    with app.app_context():
+        stream = stream_events(app, 1, since=0)
+        assert next(stream) == b'retry: 5000\n\n'
+        assert parse(next(stream))[0] == 'reload'
+        assert next(stream) == b': keep-alive\n\n'
+        # Two changes overflow the one event queue, the page is told to reload instead
+        client.post('/edit/item1', data={'quantity': '2'})
+        client.post('/edit/item2', data={'quantity': '3'})
+        assert parse(next(stream))[0] == 'reload'
+        stream.close()
+
+
+def test_stream_notices_changes_from_other_processes(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 0.01)
+    with app.app_context():
+        stream = stream_events(app, 1)
+        next(stream)
+        monkeypatch.setattr(bus, 'publish', lambda owner_id, event, data: None)
+        client.post('/edit/item1', data={'quantity': '8'})
+        event, data = parse(next(stream))
+        assert event == 'reload' and data['version'] > 0
+        assert next(stream) == b': keep-alive\n\n'
+        stream.close()
+
+
+def test_events_route(client):
+    response = client.get('/events')
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert next(response.response) == b'retry: 5000\n\n'
+    response.close()
+
+
+def test_asgi_events_need_a_login(app):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/events', 'query_string': b'', 'headers': []}
+    asyncio.run(asgi_events(app)(scope, receive, send))
+    assert messages[0]['status'] == 401
@@ -0,0 +1,155 @@
+import base64
+import csv
+import gzip
+import io
+import json
+import time
+import xml.etree.ElementTree as ET
+import pytest
+from conftest import add_item, make_jpeg
+from inventory.db import get_db
+from inventory.exports import buffered
+
+
+def test_xml_lists_the_owners_items(client, other_client):
+    response = client.get('/xml-export?mode=direct')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/xml'
+    assert 'inventory.xml' in response.headers['Content-Disposition']
+    root = ET.fromstring(response.get_data())
+    assert root.tag == 'inventory'
+    assert [item.findtext('name') for item in root] == ['item0', 'item1', 'item2', 'item3', 'item4']
+    assert [item.findtext('quantity') for item in root] == ['0', '1', '2', '3', '4']
+    assert root[1].findtext('price') == '1.50'
+    assert root[1].findtext('description') == 'desc 1'
+    assert len(ET.fromstring(other_client.get('/xml-export?mode=direct').get_data())) == 0
+
+
+def test_xml_escapes_text(client):
+    add_item(client, '<b>&"fish"</b>')
+    root = ET.fromstring(client.get('/xml-export?mode=direct').get_data())
+    assert root[5].findtext('name') == '<b>&"fish"</b>'
+
+
+def test_xml_image_modes(client):
+    image = make_jpeg()
+    add_item(client, 'pictured', image=image)
+
+    inline = ET.fromstring(client.get('/xml-export?mode=direct').get_data())
+    assert base64.b64decode(inline[5].findtext('image')) == image
+    assert inline[0].find('image') is not None and not inline[0].findtext('image')
+
+    linked = ET.fromstring(client.get('/xml-export?mode=direct&images=url').get_data())
+    assert '/items/6/image' in linked[5].findtext('image')
+    assert linked[5].findtext('image').startswith('http')
+
+    bare = ET.fromstring(client.get('/xml-export?mode=direct&images=none').get_data())
+    assert all(item.find('image') is None for item in bare)
+
+
+def test_xml_unknown_image_mode(client):
+    assert client.get('/xml-export?mode=direct&images=base64').status_code == 400
+
+
+def test_buffered_joins_small_pieces():
+    assert list(buffered([b'ab', b'cd', b'e'], size=4)) == [b'abcd', b'e']
+    assert list(buffered([])) == []
+
+
+def load_xlsx(response):
+    from openpyxl import load_workbook
+    assert response.status_code == 200
+    return load_workbook(io.BytesIO(response.get_data()))
+
+
+def test_xlsx_rows(client):
+    response = client.get('/xlsx-export?mode=direct')
+    assert response.mimetype == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    sheet = load_xlsx(response).active
+    rows = list(sheet.iter_rows(values_only=True))
+    assert rows[0] == ('Name', 'Image', 'Description', 'Quantity', 'Price')
+    assert [row[0] for row in rows[1:]] == ['item0', 'item1', 'item2', 'item3', 'item4']
+    assert rows[2] == ('item1', None, 'desc 1', 1, '1.50')
+    assert sheet.sheet_format.defaultRowHeight == 60
+
+
+def test_xlsx_image_modes(client):
+    add_item(client, 'pictured', image=make_jpeg())
+    inline = load_xlsx(client.get('/xlsx-export?mode=direct')).active
+    assert [image.anchor._from.row for image in inline._images] == [6]
+
+    linked = load_xlsx(client.get('/xlsx-export?mode=direct&images=url')).active
+    assert not linked._images
+    assert '/items/6/image' in linked['B7'].value
+
+    bare = load_xlsx(client.get('/xlsx-export?mode=direct&images=none')).active
+    assert not bare._images
+    assert bare['B7'].value is None
+
+
+def test_xlsx_skips_unreadable_images(client, app):
+    add_item(client, 'pictured', image=make_jpeg())
+    with app.app_context():
+        connection = get_db()
+        connection.execute("UPDATE IMAGE_RENDITIONS SET data = x'00' "
+                           "WHERE hash = (SELECT image_hash FROM INVENTORY WHERE item_id = 6)")
+        connection.commit()
+    sheet = load_xlsx(client.get('/xlsx-export?mode=direct')).active
+    assert not sheet._images
+    assert sheet['A7'].value == 'pictured'
+
+
+def test_xlsx_unknown_image_mode(client):
+    assert client.get('/xlsx-export?mode=direct&images=base64').status_code == 400
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_csv(client):
+    response = client.get('/csv-export')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'Content-Encoding' not in response.headers
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ['item_id', 'name', 'description', 'quantity', 'price', 'reorder_threshold', 'updated_at']
+    assert [row[1] for row in rows[1:]] == ['item0', 'item1', 'item2', 'item3', 'item4']
+    assert rows[2][3:5] == ['1', '1.5']
+
+
+def test_ndjson_with_image_links(client):
+    client.post('/add', data={'name': 'pictured', 'description': 'x', 'quantity': '1', 'price': '1',
+                              'image': (io.BytesIO(make_jpeg()), 'a.jpg')})
+    items = ndjson(client.get('/ndjson-export?images=url'))
+    assert len(items) == 6
+    assert items[0]['image_url'] is None
+    assert '/items/6/image' in items[5]['image_url']
+    assert 'image' not in items[0]
+
+
+def test_gzip_when_accepted(client):
+    response = client.get('/ndjson-export', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+    assert [json.loads(line)['name'] for line in lines] == ['item0', 'item1', 'item2', 'item3', 'item4']
+
+
+def test_since_returns_only_changed_items(client, query):
+    # updated_at has a resolution of one second
+    time.sleep(1.1)
+    later = client.get('/ndjson-export').headers['X-Export-Timestamp']
+    client.post('/edit/item2', data={'quantity': '9'})
+    client.post('/stock/adjust', json={'adjustments': [{'item_id': 4, 'delta': 1}]})
+    assert [item['name'] for item in ndjson(client.get(f'/ndjson-export?since={later}'))] == ['item2', 'item3']
+    assert len(ndjson(client.get(f'/ndjson-export?since=2000-01-01'))) == 5
+    rows = list(csv.reader(io.StringIO(client.get(f'/csv-export?since={later}').get_data(as_text=True))))
+    assert [row[1] for row in rows[1:]] == ['item2', 'item3']
+    assert ndjson(client.get('/ndjson-export?since=2999-01-01T00:00:00%2B02:00')) == []
+
+
+@pytest.mark.parametrize('path', ['/csv-export?since=yesterday', '/ndjson-export?images=inline',
+                                  '/csv-export?images=base64'])
+def test_bad_parameters(client, path):
+    assert client.get(path).status_code == 400
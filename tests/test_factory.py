@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import inventory
+from inventory import create_app
+from inventory.app import instance_secret_key
+
+
+def run_python(code, **env):
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            env={**os.environ, **env})
+    return result.stdout.strip()
+
+
+def test_config_comes_from_the_environment_then_the_mapping(monkeypatch, tmp_path):
+    monkeypatch.setenv('INVENTORY_DATABASE', str(tmp_path / 'from_env.db'))
+    monkeypatch.setenv('INVENTORY_DB_POOL_SIZE', '3')
+    app = create_app({'DB_POOL_SIZE': 5, 'SECRET_KEY': 'test'})
+    assert app.config['DATABASE'] == str(tmp_path / 'from_env.db')
+    assert app.config['DB_POOL_SIZE'] == 5
+    assert app.config['IMPORT_BATCH_SIZE'] == 1000
+    assert 'inventory_db' not in app.extensions
+
+
+def test_apps_keep_their_own_caches(app):
+    other = create_app({'SECRET_KEY': 'test'})
+    assert other.extensions['user_cache'] is not app.extensions['user_cache']
+    assert other.extensions['page_cache'] is not app.extensions['page_cache']
+    assert len(other.extensions['metrics_collectors']) == len(app.extensions['metrics_collectors'])
+
+
+def test_secret_key_is_kept_in_the_instance_folder(tmp_path):
+    app = create_app({'SECRET_KEY': 'test'})
+    app.instance_path = str(tmp_path / 'instance')
+    key = instance_secret_key(app)
+    assert len(key) == 32
+    assert instance_secret_key(app) == key
+    assert oct(os.stat(tmp_path / 'instance' / 'secret_key').st_mode & 0o777) == '0o600'
+
+
+def test_package_app_is_built_on_first_use(monkeypatch):
+    monkeypatch.setenv('INVENTORY_SECRET_KEY', 'test')
+    assert inventory.app is inventory.app
+    assert inventory.app.name == 'inventory.app' and 'main' in inventory.app.blueprints
+    assert run_python('import sys; from inventory import app; from inventory.app import create_app; '
+                      'print(type(app).__name__, type(sys.modules["inventory.app"]).__name__)',
+                      INVENTORY_SECRET_KEY='test') == 'Flask module'
+
+
+def test_export_libraries_load_lazily():
+    code = 'import sys; from inventory import create_app; create_app(); print("openpyxl" in sys.modules)'
+    assert run_python(code, INVENTORY_SECRET_KEY='test') == 'False'
+    assert run_python(code, INVENTORY_SECRET_KEY='test', INVENTORY_PRELOAD='true') == 'True'
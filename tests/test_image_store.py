@@ -0,0 +1,77 @@
+import sqlite3
+from conftest import add_item, make_jpeg
+from inventory import init_database
+from inventory.db import close_pools, get_db
+from inventory.images import collect_garbage, image_hash, put_image, recount_references
+
+
+def test_identical_images_are_stored_once(client, query):
+    image = make_jpeg()
+    add_item(client, 'first', image)
+    add_item(client, 'second', image)
+    add_item(client, 'third', make_jpeg('blue'))
+    assert query('SELECT hash, refcount FROM IMAGES ORDER BY image_id') == [
+        (image_hash(image), 2), (image_hash(make_jpeg('blue')), 1)]
+    assert query('SELECT count(*) FROM IMAGE_RENDITIONS WHERE hash = ?', (image_hash(image),)) == [(2,)]
+    first, second = client.get('/items/6/image'), client.get('/items/7/image')
+    assert first.get_data() == second.get_data() == image
+    assert first.headers['ETag'] == second.headers['ETag']
+
+
+def test_deletes_release_references_and_gc_frees_them(app, client, query):
+    image = make_jpeg()
+    add_item(client, 'first', image)
+    add_item(client, 'second', image)
+    client.post('/delete', data={'deleteItem': '6'})
+    assert query('SELECT refcount FROM IMAGES') == [(1,)]
+    with app.app_context():
+        assert collect_garbage(get_db()) == (0, 0)
+    client.post('/delete', data={'deleteItem': '7'})
+    assert query('SELECT refcount FROM IMAGES') == [(0,)]
+    with app.app_context():
+        assert collect_garbage(get_db()) == (1, len(image))
+    assert query('SELECT count(*) FROM IMAGES') == [(0,)]
+    assert query('SELECT count(*) FROM IMAGE_RENDITIONS') == [(0,)]
+
+
+def test_gc_command_can_recount(app, client, query):
+    add_item(client, 'pictured', make_jpeg())
+    with app.app_context():
+        connection = get_db()
+        with connection:
+            put_image(connection, make_jpeg('green'))
+            connection.execute('UPDATE IMAGES SET refcount = 5')
+        assert recount_references(connection) == 2
+        with connection:
+            connection.execute('UPDATE IMAGES SET refcount = 5')
+    result = app.test_cli_runner().invoke(args=['gc-images', '--recount', '--vacuum'])
+    assert result.exit_code == 0
+    assert 'Corrected 2 reference counts' in result.output
+    assert 'Removed 1 unused images' in result.output
+    assert query('SELECT refcount FROM IMAGES') == [(1,)]
+
+
+def test_inline_images_are_migrated(app, client, query, tmp_path, monkeypatch):
+    path = tmp_path / 'inline.db'
+    image = make_jpeg()
+    with sqlite3.connect(path) as connection:
+        connection.executescript('''
+            CREATE TABLE USERS(user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE,
+                               user_password TEXT NOT NULL, store_name TEXT NOT NULL);
+            CREATE TABLE INVENTORY(item_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, image BLOB,
+                                   image_hash TEXT, description TEXT NOT NULL, quantity INTEGER NOT NULL,
+                                   price REAL NOT NULL, owner_id INTEGER NOT NULL);
+            CREATE TABLE ITEM_IMAGES(item_id INTEGER NOT NULL, rendition TEXT NOT NULL, mime TEXT NOT NULL,
+                                     data BLOB NOT NULL, PRIMARY KEY (item_id, rendition));
+        ''')
+        connection.executemany("INSERT INTO INVENTORY (name, image, description, quantity, price, owner_id) "
+                               "VALUES (?, ?, 'x', 1, 1.0, 1)", [('a', image), ('b', image), ('c', None)])
+        connection.execute("INSERT INTO ITEM_IMAGES VALUES (1, 'thumb', 'image/jpeg', x'ffd8')")
+    connection.close()
+    close_pools(app)
+    monkeypatch.setitem(app.config, 'DATABASE', str(path))
+    init_database(app)
+    assert query('SELECT hash, refcount, size FROM IMAGES') == [(image_hash(image), 2, len(image))]
+    assert query('SELECT rendition, data FROM IMAGE_RENDITIONS') == [('thumb', b'\xff\xd8')]
+    assert 'image' not in {row[1] for row in query('PRAGMA table_info(INVENTORY)')}
+    assert query("SELECT 1 FROM sqlite_master WHERE name = 'ITEM_IMAGES'") == []
@@ -0,0 +1,67 @@
+import hashlib
+import sqlite3
+from inventory.db import close_pools, get_db
+from conftest import add_item, make_jpeg
+
+
+def test_image_is_served_with_a_strong_etag(client):
+    image = make_jpeg()
+    add_item(client, 'pictured', image)
+    response = client.get('/items/6/image')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.get_data() == image
+    assert response.headers['ETag'] == f'"{hashlib.sha256(image).hexdigest()}"'
+    assert response.cache_control.private
+    assert response.cache_control.max_age == 31536000
+    assert response.last_modified is not None
+
+
+def test_conditional_requests_get_304(client):
+    add_item(client, 'pictured', make_jpeg())
+    response = client.get('/items/6/image')
+    by_etag = client.get('/items/6/image', headers={'If-None-Match': response.headers['ETag']})
+    assert by_etag.status_code == 304
+    assert by_etag.get_data() == b''
+    by_date = client.get('/items/6/image', headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert by_date.status_code == 304
+    changed = client.get('/items/6/image', headers={'If-None-Match': '"something else"'})
+    assert changed.status_code == 200
+
+
+def test_missing_images_are_not_found(client, other_client):
+    add_item(client, 'pictured', make_jpeg())
+    assert client.get('/items/1/image').status_code == 404
+    assert client.get('/items/999/image').status_code == 404
+    assert other_client.get('/items/6/image').status_code == 404
+
+
+def test_pages_link_to_the_image_route(client):
+    add_item(client, 'pictured', make_jpeg())
+    page = client.get('/inventory').get_data(as_text=True)
+    assert '/items/6/image' in page
+    assert 'base64' not in page
+
+
+def test_migrate_backfills_image_hashes(app, tmp_path, monkeypatch):
+    path = tmp_path / 'legacy.db'
+    image = make_jpeg()
+    with sqlite3.connect(path) as connection:
+        connection.executescript('''
+            CREATE TABLE USERS(user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE,
+                               user_password TEXT NOT NULL, store_name TEXT NOT NULL);
+            CREATE TABLE INVENTORY(item_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, image BLOB,
+                                   description TEXT NOT NULL, quantity INTEGER NOT NULL, price REAL NOT NULL,
+                                   owner_id INTEGER NOT NULL);
+        ''')
+        connection.execute("INSERT INTO INVENTORY (name, image, description, quantity, price, owner_id) "
+                           "VALUES ('old', ?, 'x', 1, 1.0, 1)", (image,))
+    connection.close()
+    close_pools(app)
+    monkeypatch.setitem(app.config, 'DATABASE', str(path))
+    from inventory import init_database
+    init_database(app)
+    with app.app_context():
+        row = get_db().execute("SELECT image_hash, updated_at FROM INVENTORY WHERE name = 'old'").fetchone()
+    assert row['image_hash'] == hashlib.sha256(image).hexdigest()
+    assert row['updated_at'] is not None
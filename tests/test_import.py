@@ -0,0 +1,120 @@
+import io
+import pytest
+from conftest import add_item, make_jpeg
+from inventory.importer import detect_format, parse_price, parse_whole_number
+
+JSON = {'Accept': 'application/json'}
+
+
+def import_file(client, data, filename):
+    response = client.post('/import', data={'file': (io.BytesIO(data), filename)}, headers=JSON)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def import_csv(client, text):
+    return import_file(client, text.encode('utf-8'), 'items.csv')
+
+
+def test_bad_numbers_are_reported_per_row(client, query):
+    report = import_csv(client, 'name,description,quantity,price\n'
+                                'good,kept,4,2.50\n'
+                                'infinite,x,inf,1\n'
+                                'overflow,x,1e400,1\n'
+                                'huge,x,99999999999999999999,1\n'
+                                'fraction,x,3.7,1\n'
+                                'negative,x,-2,1\n'
+                                'nan price,x,1,nan\n'
+                                'inf price,x,1,inf\n')
+    assert report['processed'] == 8
+    assert report['imported'] == 1
+    assert [error['line'] for error in report['errors']] == [3, 4, 5, 6, 7, 8, 9]
+    assert 'whole number' in report['errors'][3]['message']
+    assert query("SELECT quantity, price FROM INVENTORY WHERE name = 'good'") == [(4, 2.5)]
+    assert query("SELECT count(*) FROM INVENTORY WHERE name != 'good' AND name NOT LIKE 'item%'") == [(0,)]
+
+
+def test_missing_fields_are_reported(client):
+    report = import_csv(client, 'name,description,quantity,price\n,x,1,1\nnameless,,1,1\nok,x,1,1\n')
+    assert report['imported'] == 1
+    assert [error['message'] for error in report['errors']] == ['name is required', 'description is required']
+
+
+def test_whole_floats_are_accepted(client, query):
+    report = import_csv(client, 'name,description,quantity,price,reorder_threshold\nfloaty,x,3.0,1,5.0\n')
+    assert report['imported'] == 1
+    assert query("SELECT quantity, reorder_threshold FROM INVENTORY WHERE name = 'floaty'") == [(3, 5)]
+
+
+def test_number_parsers():
+    assert parse_whole_number(' 12 ', 'quantity') == 12
+    assert parse_whole_number(2 ** 63 - 1, 'quantity') == 2 ** 63 - 1
+    for value in (2 ** 63, 'nan', '1.5', True, None, 'ten'):
+        with pytest.raises(ValueError):
+            parse_whole_number(value, 'quantity')
+    assert parse_price('2.5') == 2.5
+    for value in ('inf', '-nan', float('nan'), [], 'cheap'):
+        with pytest.raises(ValueError):
+            parse_price(value)
+
+
+def test_existing_items_are_updated(client, query):
+    report = import_csv(client, 'name,description,quantity,price\nitem1,new description,7,3\n')
+    assert report['imported'] == 1
+    assert query("SELECT description, quantity FROM INVENTORY WHERE name = 'item1'") == [('new description', 7)]
+    assert query("SELECT count(*) FROM INVENTORY") == [(5,)]
+
+
+def test_same_name_allowed_in_two_stores(client, other_client, query):
+    report = import_file(other_client, b'name,description,quantity,price\nitem1,theirs,0,0\n', 'items.csv')
+    assert (report['imported'], report['error_count']) == (1, 0)
+    assert query("SELECT owner_id, description FROM INVENTORY WHERE name = 'item1' ORDER BY owner_id") == \
+        [(1, 'desc 1'), (2, 'theirs')]
+
+
+def test_small_batches(app, client, query, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMPORT_BATCH_SIZE', 2)
+    rows = ''.join(f'bulk{index},x,{index},1\n' for index in range(7))
+    report = import_csv(client, 'Name,Description,Quantity,Price\n' + rows + 'broken,x,?,1\n')
+    assert (report['processed'], report['imported'], report['error_count']) == (8, 7, 1)
+    assert query("SELECT count(*) FROM INVENTORY WHERE name LIKE 'bulk%'") == [(7,)]
+
+
+def test_xml_export_round_trip(client, other_client, query):
+    add_item(client, 'pictured', image=make_jpeg())
+    document = client.get('/xml-export?mode=direct').get_data()
+    client.post('/delete', data={'deleteItem': '6'})
+    report = import_file(client, document, 'inventory.xml')
+    assert (report['processed'], report['imported'], report['error_count']) == (6, 6, 0)
+    assert query("SELECT image_hash IS NOT NULL FROM INVENTORY WHERE name = 'pictured'") == [(1,)]
+    assert query("SELECT refcount FROM IMAGES WHERE hash = "
+                 "(SELECT image_hash FROM INVENTORY WHERE name = 'pictured')") == [(1,)]
+
+
+def test_xlsx_import(client, query):
+    from openpyxl import Workbook
+    wb = Workbook()
+    wb.active.append(['name', 'description', 'quantity', 'price'])
+    wb.active.append(['sheet item', 'from a sheet', 3, 4.25])
+    wb.active.append([None, None, None, None])
+    wb.active.append(['bad', 'row', 'many', 1])
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    report = import_file(client, buffer.getvalue(), 'items.xlsx')
+    assert report['imported'] == 1
+    assert report['errors'] == [{'line': 4, 'message': "invalid quantity 'many'"}]
+    assert query("SELECT quantity, price FROM INVENTORY WHERE name = 'sheet item'") == [(3, 4.25)]
+
+
+def test_unreadable_files(client):
+    report = import_file(client, b'not a zip', 'items.xlsx')
+    assert report['imported'] == 0 and 'could not read file' in report['errors'][0]['message']
+    report = import_file(client, b'<inventory><item><name>a', 'items.xml')
+    assert 'could not read file' in report['errors'][-1]['message']
+
+
+def test_unknown_format(client):
+    response = client.post('/import', data={'file': (io.BytesIO(b'x'), 'items.txt')})
+    assert response.status_code == 400
+    assert detect_format('Items.CSV') == 'csv'
+    assert detect_format('items') is None
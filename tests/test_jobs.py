@@ -0,0 +1,99 @@
+import io
+import os
+import time
+import xml.etree.ElementTree as ET
+from inventory import init_database
+from inventory.db import get_db
+from inventory.jobs import cleanup_expired, spool_path
+
+JSON = {'Accept': 'application/json'}
+
+
+def wait_for(client, status_url, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        job = client.get(status_url, headers=JSON).get_json()
+        if job['status'] in ('done', 'failed') or time.time() > deadline:
+            return job
+        time.sleep(0.05)
+
+
+def insert_job(app, job_id, status, created_at, owner_id=1):
+    with app.app_context():
+        connection = get_db()
+        with connection:
+            connection.execute('INSERT INTO EXPORT_JOBS (job_id, owner_id, kind, images, status, created_at) '
+                               "VALUES (?, ?, 'xml', 'none', ?, ?)", (job_id, owner_id, status, created_at))
+
+
+def test_xml_job_lifecycle(client):
+    response = client.get('/xml-export?images=none', headers=JSON)
+    assert response.status_code == 202
+    body = response.get_json()
+    assert response.headers['Location'] == body['status_url']
+
+    job = wait_for(client, body['status_url'])
+    assert job['status'] == 'done'
+    assert job['kind'] == 'xml'
+    assert job['progress'] == job['total'] == 5
+    assert job['download_url'] == body['download_url']
+
+    download = client.get(job['download_url'])
+    assert download.status_code == 200
+    assert download.mimetype == 'application/xml'
+    assert 'inventory.xml' in download.headers['Content-Disposition']
+    root = ET.fromstring(download.get_data())
+    assert [item.findtext('name') for item in root] == ['item0', 'item1', 'item2', 'item3', 'item4']
+
+
+def test_xlsx_job_download(client):
+    from openpyxl import load_workbook
+    body = client.get('/xlsx-export', headers=JSON).get_json()
+    assert wait_for(client, body['status_url'])['status'] == 'done'
+    download = client.get(body['download_url'])
+    sheet = load_workbook(io.BytesIO(download.get_data())).active
+    assert sheet.max_row == 6
+
+
+def test_browsers_are_sent_to_the_status_page(client):
+    response = client.get('/xml-export')
+    assert response.status_code == 302
+    assert '/exports/' in response.headers['Location']
+    page = client.get(response.headers['Location'])
+    assert page.status_code == 200
+
+
+def test_jobs_belong_to_their_owner(client, other_client):
+    body = client.get('/xml-export', headers=JSON).get_json()
+    wait_for(client, body['status_url'])
+    assert other_client.get(body['status_url'], headers=JSON).status_code == 404
+    assert other_client.get(body['download_url']).status_code == 404
+
+
+def test_unfinished_job_cannot_be_downloaded(client, app):
+    insert_job(app, 'pending', 'queued', time.time())
+    assert client.get('/exports/pending/download').status_code == 409
+    assert client.get('/exports/missing/download').status_code == 404
+
+
+def test_interrupted_jobs_fail_on_startup(client, app, query):
+    insert_job(app, 'queued', 'queued', time.time())
+    insert_job(app, 'running', 'running', time.time())
+    init_database(app)
+    rows = query("SELECT job_id, status, error IS NOT NULL FROM EXPORT_JOBS ORDER BY job_id")
+    assert rows == [('queued', 'failed', 1), ('running', 'failed', 1)]
+    assert client.get('/exports/running', headers=JSON).get_json()['status'] == 'failed'
+
+
+def test_cleanup_keeps_unfinished_jobs(client, app, query):
+    old = time.time() - 2 * app.config['EXPORT_JOB_TTL']
+    insert_job(app, 'old-done', 'done', old)
+    insert_job(app, 'old-running', 'running', old)
+    insert_job(app, 'new-done', 'done', time.time())
+    path = spool_path(app, 'old-done', 'xml')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    with app.app_context():
+        assert cleanup_expired(app, get_db()) == 1
+    assert not os.path.exists(path)
+    assert query('SELECT job_id FROM EXPORT_JOBS ORDER BY job_id') == [('new-done',), ('old-running',)]
@@ -0,0 +1,100 @@
+import time
+import pytest
+from inventory import init_database
+from inventory.db import get_db
+from inventory.ledger import ledger_timestamp, snapshot_all, stock_as_of, take_snapshot
+
+
+def adjust(client, *adjustments):
+    assert client.post('/stock/adjust', json={'adjustments': list(adjustments)}).status_code == 200
+
+
+def as_of(client, at, **params):
+    response = client.get('/stock/as-of', query_string={'at': at, **params})
+    assert response.status_code == 200
+    return {item['item_id']: item['quantity'] for item in response.get_json()['items']}
+
+
+def entry_time(query, entry_id):
+    return query('SELECT created_at FROM STOCK_LEDGER WHERE entry_id = ?', (entry_id,))[0][0]
+
+
+def test_every_write_path_is_recorded(client, query):
+    adjust(client, {'item_id': 2, 'delta': 5}, {'item_id': 2, 'delta': -1})
+    client.post('/edit/item1', data={'quantity': '9'})
+    client.post('/delete', data={'deleteItem': '2'})
+    assert query('SELECT kind, delta, quantity FROM STOCK_LEDGER WHERE item_id = 2 ORDER BY entry_id') == [
+        ('add', 1, 1), ('adjust', 5, 6), ('adjust', -1, 5), ('adjust', 4, 9), ('delete', -9, 0)]
+
+
+def test_history_pages_newest_first(client):
+    adjust(client, {'item_id': 2, 'delta': 1})
+    adjust(client, {'item_id': 2, 'delta': 1})
+    first = client.get('/items/2/history?limit=2').get_json()
+    assert [entry['quantity'] for entry in first['entries']] == [3, 2]
+    second = client.get(f"/items/2/history?limit=2&before={first['next_before']}").get_json()
+    assert [entry['kind'] for entry in second['entries']] == ['add']
+    assert second['next_before'] is None
+
+
+def test_deleted_items_keep_their_history(client):
+    client.post('/delete', data={'deleteItem': '3'})
+    assert [entry['kind'] for entry in client.get('/items/3/history').get_json()['entries']] == ['delete', 'add']
+
+
+def test_as_of(client, query):
+    # Entries are told apart by their millisecond timestamps
+    adjust(client, {'item_id': 2, 'count': 50})
+    time.sleep(0.01)
+    adjust(client, {'item_id': 2, 'delta': 1})
+    time.sleep(0.01)
+    client.post('/delete', data={'deleteItem': '3'})
+    adjusted, added, deleted = [row[0] for row in query('SELECT entry_id FROM STOCK_LEDGER WHERE entry_id > 5 '
+                                                        'ORDER BY entry_id')]
+    assert as_of(client, entry_time(query, adjusted))[2] == 50
+    assert as_of(client, entry_time(query, added)) == {1: 0, 2: 51, 3: 2, 4: 3, 5: 4}
+    assert 3 not in as_of(client, entry_time(query, deleted))
+    assert as_of(client, '2000-01-01') == {}
+    assert as_of(client, entry_time(query, added), item_id=2) == {2: 51}
+
+
+@pytest.mark.parametrize('at', ['', 'yesterday', None])
+def test_as_of_needs_a_date(client, at):
+    path = '/stock/as-of' if at is None else f'/stock/as-of?at={at}'
+    assert client.get(path).status_code == 400
+
+
+def test_snapshots_give_the_same_answers(client, app, query):
+    adjust(client, {'item_id': 1, 'delta': 3})
+    with app.app_context():
+        connection = get_db()
+        before = stock_as_of(connection, 1, ledger_timestamp('2999-01-01'))
+        snapshot_id = take_snapshot(connection, 1)
+        assert snapshot_id is not None
+        assert take_snapshot(connection, 1) is None
+        assert stock_as_of(connection, 1, ledger_timestamp('2999-01-01')) == before
+    adjust(client, {'item_id': 1, 'delta': 1})
+    with app.app_context():
+        connection = get_db()
+        assert stock_as_of(connection, 1, ledger_timestamp('2999-01-01'))[1] == ('item0', 4)
+        assert snapshot_all(connection, min_entries=5) == 0
+        assert snapshot_all(connection, min_entries=1) == 1
+    assert query('SELECT count(*) FROM STOCK_SNAPSHOTS') == [(2,)]
+
+
+def test_owner_scoping(client, other_client):
+    assert other_client.get('/items/2/history').get_json()['entries'] == []
+    assert as_of(other_client, '2999-01-01') == {}
+
+
+def test_ledger_timestamp():
+    assert ledger_timestamp('2024-05-01') == '2024-05-01 00:00:00.000'
+    assert ledger_timestamp('2024-05-01T12:30:00.123456+02:00') == '2024-05-01 10:30:00.123'
+
+
+def test_existing_items_get_an_opening_entry(client, app, query):
+    with app.app_context():
+        get_db().executescript('DROP TABLE STOCK_LEDGER')
+    init_database(app)
+    assert query('SELECT kind, quantity FROM STOCK_LEDGER ORDER BY item_id') == [
+        ('opening', quantity) for quantity in range(5)]
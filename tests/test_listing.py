@@ -0,0 +1,67 @@
+import base64
+import json
+import re
+import pytest
+from inventory.db import get_db
+from inventory.queries import decode_cursor, list_items
+
+
+def cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def listed_names(response):
+    return re.findall(r'<td>(item\d)</td>', response.get_data(as_text=True))
+
+
+@pytest.mark.parametrize('sort', ['item_id', 'name', 'quantity', 'price'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_pages_cover_every_item_once(client, app, sort, order):
+    seen = []
+    after = None
+    with app.app_context():
+        for _ in range(10):
+            rows, next_cursor = list_items(get_db(), 1, sort=sort, order=order, limit=2, after=after)
+            seen += [row['item_id'] for row in rows]
+            if next_cursor is None:
+                break
+            after = decode_cursor(next_cursor, sort)
+    assert sorted(seen) == [1, 2, 3, 4, 5]
+    assert len(seen) == 5
+
+
+def test_listing_pages_link_forward(client):
+    first = client.get('/inventory?limit=2&sort=quantity&order=desc')
+    assert listed_names(first) == ['item4', 'item3']
+    next_url = re.search(r'<a href="([^"]+)">Next page</a>', first.get_data(as_text=True)).group(1)
+    second = client.get(next_url.replace('&amp;', '&'))
+    assert listed_names(second) == ['item2', 'item1']
+
+
+def test_filters(client, app):
+    with app.app_context():
+        rows, next_cursor = list_items(get_db(), 1, filters={'min_quantity': 2, 'max_quantity': 3})
+    assert [row['item_id'] for row in rows] == [3, 4]
+    assert next_cursor is None
+    assert listed_names(client.get('/inventory?min_quantity=2&max_quantity=3')) == ['item2', 'item3']
+
+
+def test_listing_does_not_select_images(client, app):
+    with app.app_context():
+        rows, _ = list_items(get_db(), 1, limit=1)
+    assert 'image' not in rows[0].keys()
+
+
+@pytest.mark.parametrize('sort, key', [
+    ('item_id', [[1, 2]]), ('item_id', [{'a': 1}]), ('item_id', [10 ** 30]), ('item_id', [True]),
+    ('name', ['x', [1]]), ('name', [None, 1]), ('item_id', 'not a list'), ('item_id', [1, 2]),
+])
+def test_malformed_cursors_start_from_the_beginning(client, sort, key):
+    assert decode_cursor(cursor(key), sort) is None
+    response = client.get(f'/inventory?sort={sort}&after={cursor(key)}')
+    assert response.status_code == 200
+    assert listed_names(response)[0] == 'item0'
+
+
+def test_undecodable_cursor(client):
+    assert client.get('/inventory?after=%%%').status_code == 200
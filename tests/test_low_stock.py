@@ -0,0 +1,49 @@
+import re
+
+
+def low_stock_names(client):
+    page = client.get('/low-stock').get_data(as_text=True)
+    return re.findall(r'<td>(item\d)</td>', page)
+
+
+def test_low_stock_uses_each_items_threshold(client, query):
+    # Every item starts with the default threshold of 10 and quantities 0 .. 4, low stock comes before out of stock
+    assert query('SELECT DISTINCT reorder_threshold FROM INVENTORY') == [(10,)]
+    assert low_stock_names(client) == ['item1', 'item2', 'item3', 'item4', 'item0']
+    client.post('/edit/item3', data={'quantity': '3', 'reorder_threshold': '2'})
+    client.post('/edit/item4', data={'quantity': '4', 'reorder_threshold': '4'})
+    assert low_stock_names(client) == ['item1', 'item2', 'item4', 'item0']
+
+
+def test_threshold_from_the_add_form(client, query):
+    client.post('/add', data={'name': 'bulk', 'description': 'x', 'quantity': '30', 'price': '1',
+                              'reorder_threshold': '50'})
+    assert query("SELECT reorder_threshold FROM INVENTORY WHERE name = 'bulk'") == [(50,)]
+    assert 'bulk' in client.get('/low-stock').get_data(as_text=True)
+
+
+def test_negative_threshold_is_clamped(client, query):
+    client.post('/edit/item1', data={'quantity': '1', 'reorder_threshold': '-5'})
+    assert query("SELECT reorder_threshold FROM INVENTORY WHERE name = 'item1'") == [(0,)]
+
+
+def test_edit_requires_login(app, client, query):
+    anonymous = app.test_client()
+    response = anonymous.post('/edit/item1', data={'quantity': '99'})
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+    assert anonymous.get('/edit/item1').status_code == 302
+    assert query("SELECT quantity FROM INVENTORY WHERE name = 'item1'") == [(1,)]
+
+
+def test_edit_other_stores_item(client, other_client, query):
+    assert other_client.get('/edit/item1').status_code == 404
+    other_client.post('/edit/item1', data={'quantity': '99', 'reorder_threshold': '50'})
+    assert query("SELECT quantity, reorder_threshold FROM INVENTORY WHERE name = 'item1'") == [(1, 10)]
+
+
+def test_edit_own_item(client, query):
+    page = client.get('/edit/item1').get_data(as_text=True)
+    assert 'value="10"' in page
+    client.post('/edit/item1', data={'quantity': '20', 'reorder_threshold': '5'})
+    assert query("SELECT quantity, reorder_threshold FROM INVENTORY WHERE name = 'item1'") == [(20, 5)]
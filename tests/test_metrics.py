@@ -0,0 +1,81 @@
+import sqlite3
+import pytest
+from flask import Flask
+from inventory import db, metrics
+from inventory.db import close_pools, get_db
+from inventory.metrics import InstrumentedConnection, instrument_factory
+
+REMOTE = {'REMOTE_ADDR': '203.0.113.5'}
+
+
+class AuditedConnection(sqlite3.Connection):
+    pass
+
+
+def test_default_connections_are_instrumented(app):
+    with app.app_context():
+        assert isinstance(get_db(), InstrumentedConnection)
+
+
+def test_configured_factory_is_kept(tmp_path):
+    app = Flask(__name__)
+    app.config.update(DATABASE=str(tmp_path / 'inventory.db'), DB_CONNECTION_FACTORY=AuditedConnection)
+    db.init_app(app)
+    metrics.init_app(app)
+    try:
+        with app.app_context():
+            connection = get_db()
+            assert isinstance(connection, AuditedConnection)
+            assert isinstance(connection, InstrumentedConnection)
+    finally:
+        close_pools(app)
+
+
+def test_instrument_factory():
+    assert instrument_factory(sqlite3.Connection) is InstrumentedConnection
+    assert instrument_factory(InstrumentedConnection) is InstrumentedConnection
+    mixed = instrument_factory(AuditedConnection)
+    assert issubclass(mixed, AuditedConnection) and instrument_factory(mixed) is mixed
+
+
+def test_metrics_count_requests(client):
+    client.get('/inventory')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'inventory_request_duration_seconds_count{endpoint="main.inventory",method="GET"}' in text
+    assert 'inventory_sql_query_duration_seconds' in text
+    assert 'inventory_template_render_seconds' in text
+    assert 'inventory_user_cache_hits' in text
+
+
+def test_phases_are_timed(client):
+    with metrics.timed('test_phase'):
+        pass
+    assert 'phase="test_phase"' in client.get('/metrics').get_data(as_text=True)
+
+
+def test_metrics_are_limited_to_loopback_clients(app):
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 200
+    response = client.get('/metrics', environ_base=REMOTE)
+    assert response.status_code == 401
+    assert 'inventory_' not in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('header, status', [
+    (None, 401), ('Bearer wrong', 401), ('Basic s3cret', 401), ('Bearer s3cret', 200), ('bearer s3cret', 200),
+])
+def test_metrics_token(app, monkeypatch, header, status):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    headers = {'Authorization': header} if header else {}
+    # With a token configured, loopback clients need it too
+    assert app.test_client().get('/metrics', headers=headers).status_code == status
+    assert app.test_client().get('/metrics', headers=headers, environ_base=REMOTE).status_code == status
+
+
+def test_slow_requests_are_logged(client, app, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, 'SLOW_REQUEST_THRESHOLD', 0)
+    monkeypatch.setitem(app.config, 'PROFILE_SAMPLE_RATE', 0)
+    with caplog.at_level('WARNING', logger='inventory.slow_requests'):
+        client.get('/inventory')
+    assert '"endpoint": "main.inventory"' in caplog.text
+    assert '"sql_count"' in caplog.text
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import pytest
+from flask import g
+from werkzeug.exceptions import ServiceUnavailable
+from inventory import serve
+from inventory.offload import run_cpu
+
+
+@pytest.fixture
+def executor(app, monkeypatch):
+    """
+    Settings for a one worker executor without a queue, created on the first run_cpu call
+    """
+    monkeypatch.setitem(app.config, 'CPU_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'CPU_QUEUE_SIZE', 0)
+    monkeypatch.setitem(app.config, 'CPU_QUEUE_TIMEOUT', 0.05)
+    app.extensions.pop('cpu_executor', None)
+    yield app
+    app.extensions.pop('cpu_executor').pool.shutdown()
+
+
+def test_results_errors_and_context_reach_the_caller(executor):
+    with executor.app_context():
+        g.marker = 'request state'
+        assert run_cpu(lambda a, b=0: a + b, 2, b=3) == 5
+        assert run_cpu(lambda: g.marker) == 'request state'
+        with pytest.raises(ZeroDivisionError):
+            run_cpu(lambda: 1 / 0)
+        assert threading.current_thread().name not in run_cpu(lambda: threading.current_thread().name)
+
+
+def test_full_queue_answers_503(executor, client):
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    def busy():
+        with executor.app_context():
+            run_cpu(hold)
+
+    worker = threading.Thread(target=busy)
+    worker.start()
+    try:
+        assert started.wait(5)
+        with executor.app_context():
+            with pytest.raises(ServiceUnavailable):
+                run_cpu(lambda: None)
+        response = client.post('/login', data={'username': 'owner', 'user_password': 'pw'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+        assert 'inventory_cpu_tasks_pending 1' in client.get('/metrics').get_data(as_text=True)
+    finally:
+        release.set()
+        worker.join()
+    assert 'inventory_cpu_tasks_rejected_total 2' in client.get('/metrics').get_data(as_text=True)
+
+
+def call_asgi(application, path):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': [],
+             'client': ('127.0.0.1', 5000), 'server': ('localhost', 80)}
+    asyncio.run(application(scope, receive, send))
+    return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def test_asgi_application_serves_the_app(app):
+    from inventory.asgi import application
+    status, body = call_asgi(application, '/login')
+    assert status == 200 and b'<form' in body
+
+
+def test_serve_prepares_the_database_then_runs_uvicorn(tmp_path, monkeypatch):
+    monkeypatch.setenv('INVENTORY_DATABASE', str(tmp_path / 'served.db'))
+    monkeypatch.setenv('INVENTORY_SECRET_KEY', 'test')
+    calls = []
+    monkeypatch.setattr(serve.uvicorn, 'run', lambda target, **options: calls.append((target, options)))
+    assert serve.main(['--workers', '2']) == 0
+    assert (tmp_path / 'served.db').exists()
+    assert calls[0][0] == 'inventory.asgi:application' and calls[0][1]['workers'] == 2
+
+
+def test_serve_reads_options_from_the_environment(monkeypatch):
+    monkeypatch.setenv('INVENTORY_PORT', '9001')
+    monkeypatch.setenv('INVENTORY_WORKERS', '3')
+    args = serve._parse_args([])
+    assert (args.port, args.workers, args.host) == (9001, 3, '127.0.0.1')
+    assert serve._parse_args(['--port', '9002']).port == 9002
+
+
+def test_init_db_command(app, query):
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0 and 'Initialized' in result.output
+    assert query("SELECT 1 FROM sqlite_master WHERE name = 'INVENTORY'") == [(1,)]
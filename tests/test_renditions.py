@@ -0,0 +1,74 @@
+import io
+from PIL import Image
+from inventory.db import get_db
+from inventory.images import RENDITIONS, backfill_renditions, make_renditions
+from conftest import add_item, make_jpeg
+
+
+def open_image(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_renditions_fit_their_boxes():
+    renditions = make_renditions(make_jpeg(size=(1600, 900)))
+    assert set(renditions) == set(RENDITIONS)
+    for name, (mime, data) in renditions.items():
+        assert mime == 'image/jpeg'
+        image = open_image(data)
+        assert image.width == RENDITIONS[name][0]
+        assert image.height < RENDITIONS[name][1]
+
+
+def test_transparent_images_stay_png():
+    buffer = io.BytesIO()
+    Image.new('RGBA', (300, 300), (255, 0, 0, 0)).save(buffer, 'PNG')
+    mime, data = make_renditions(buffer.getvalue())['thumb']
+    assert mime == 'image/png'
+    assert open_image(data).mode == 'RGBA'
+
+
+def test_exif_orientation_is_applied():
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    # Orientation 6: the stored pixels are rotated, the image is displayed 90 degrees clockwise
+    exif[0x0112] = 6
+    Image.new('RGB', (400, 200), 'blue').save(buffer, 'JPEG', exif=exif)
+    image = open_image(make_renditions(buffer.getvalue())['medium'][1])
+    assert image.height > image.width
+
+
+def test_unreadable_images_have_no_renditions():
+    assert make_renditions(b'\xff\xd8\xff not really a jpeg') == {}
+
+
+def test_route_serves_each_size(client):
+    add_item(client, 'pictured', make_jpeg(size=(1200, 800)))
+    original = client.get('/items/6/image')
+    thumb = client.get('/items/6/image?size=thumb')
+    assert thumb.status_code == 200
+    assert open_image(thumb.get_data()).size == (120, 80)
+    assert open_image(client.get('/items/6/image?size=medium').get_data()).size == (600, 400)
+    assert thumb.headers['ETag'] != original.headers['ETag']
+    assert client.get('/items/6/image?size=thumb', headers={'If-None-Match': thumb.headers['ETag']}).status_code == 304
+    assert client.get('/items/6/image?size=huge').status_code == 404
+
+
+def test_unreadable_upload_falls_back_to_the_original(client):
+    data = b'\x89PNG\r\n\x1a\n broken'
+    add_item(client, 'broken', data)
+    response = client.get('/items/6/image?size=thumb')
+    assert response.status_code == 200
+    assert response.get_data() == data
+    assert response.mimetype == 'image/png'
+
+
+def test_backfill_generates_missing_renditions(app, client):
+    add_item(client, 'pictured', make_jpeg())
+    add_item(client, 'other picture', make_jpeg('green'))
+    with app.app_context():
+        connection = get_db()
+        with connection:
+            connection.execute('DELETE FROM IMAGE_RENDITIONS')
+        assert backfill_renditions(connection, workers=1) == 2
+        assert backfill_renditions(connection, workers=1) == 0
+    assert client.get('/items/7/image?size=thumb').mimetype == 'image/jpeg'
@@ -0,0 +1,75 @@
+import pytest
+from inventory import init_database
+from inventory.db import get_db
+from inventory.search import build_match_query, rebuild_index
+
+JSON = {'Accept': 'application/json'}
+
+
+def search(client, text, **params):
+    response = client.get('/search', query_string={'q': text, **params}, headers=JSON)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def names(client, text, **params):
+    return [item['name'] for item in search(client, text, **params)['items']]
+
+
+def test_terms_match_as_prefixes(client):
+    client.post('/add', data={'name': 'Red apple', 'description': 'Crisp and sweet', 'quantity': '3', 'price': '1'})
+    client.post('/add', data={'name': 'Green pear', 'description': 'Goes well with apples', 'quantity': '3',
+                              'price': '1'})
+    assert names(client, 'app') == ['Red apple', 'Green pear']
+    assert names(client, 'swe cri') == ['Red apple']
+    assert names(client, 'banana') == []
+
+
+def test_name_matches_rank_first(client):
+    client.post('/add', data={'name': 'Widget', 'description': 'plain', 'quantity': '1', 'price': '1'})
+    client.post('/add', data={'name': 'Gadget', 'description': 'a widget holder', 'quantity': '1', 'price': '1'})
+    assert names(client, 'widget') == ['Widget', 'Gadget']
+
+
+@pytest.mark.parametrize('text', ['"', 'item0 OR', 'NEAR(', '*', 'a"b', 'owner_key : o2', '-item', '^item1'])
+def test_punctuation_is_not_query_syntax(client, text):
+    search(client, text)
+
+
+def test_match_query_quotes_every_term():
+    assert build_match_query('ite" OR x*', 7) == 'owner_key : "o7" AND ("ite"* "OR"* "x"*)'
+    assert build_match_query(' ?! ', 7) is None
+
+
+def test_search_only_finds_the_owners_items(client, other_client):
+    assert names(other_client, 'item') == []
+    assert names(other_client, 'owner_key o1') == []
+    assert len(names(client, 'item')) == 5
+
+
+def test_index_follows_edits_and_deletes(client, query):
+    client.post('/add', data={'name': 'Lamp', 'description': 'desk lamp', 'quantity': '1', 'price': '1'})
+    assert names(client, 'lamp') == ['Lamp']
+    item_id = query("SELECT item_id FROM INVENTORY WHERE name = 'Lamp'")[0][0]
+    client.post('/delete', data={'deleteItem': str(item_id)})
+    assert names(client, 'lamp') == []
+
+
+def test_pages(client):
+    first = search(client, 'item', limit=2)
+    second = search(client, 'item', limit=2, page=3)
+    assert first['has_more'] and not second['has_more']
+    assert len(first['items']) == 2 and len(second['items']) == 1
+    page = client.get('/search?q=item&limit=2').get_data(as_text=True)
+    assert 'page=2' in page
+
+
+def test_existing_items_are_indexed_on_first_run(client, app):
+    with app.app_context():
+        connection = get_db()
+        connection.executescript('DROP TABLE INVENTORY_FTS')
+    init_database(app)
+    assert len(names(client, 'desc')) == 5
+    with app.app_context():
+        assert rebuild_index(get_db()) == 5
+    assert len(names(client, 'desc')) == 5
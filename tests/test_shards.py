@@ -0,0 +1,135 @@
+import sqlite3
+import pytest
+from conftest import add_item
+from inventory import init_database
+from inventory.db import close_pools, get_catalog_db, get_db, shard_owners, shard_path
+
+
+def test_names_are_unique_per_store(client, other_client, query):
+    add_item(other_client, 'item1')
+    response = client.post('/add', data={'name': 'item1', 'description': 'x', 'quantity': '1', 'price': '2'})
+    assert response.status_code == 200
+    assert b'Item already found' in response.get_data()
+    assert query("SELECT owner_id FROM INVENTORY WHERE name = 'item1' ORDER BY owner_id") == [(1,), (2,)]
+
+
+def test_stores_before_per_store_names_are_rebuilt(app, client, query, tmp_path, monkeypatch):
+    path = tmp_path / 'global_names.db'
+    with sqlite3.connect(path) as connection:
+        connection.executescript('''
+            CREATE TABLE USERS(user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE,
+                               user_password TEXT NOT NULL, store_name TEXT NOT NULL);
+            CREATE TABLE INVENTORY(item_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, image BLOB,
+                                   description TEXT NOT NULL, quantity INTEGER NOT NULL, price REAL NOT NULL,
+                                   owner_id INTEGER NOT NULL);
+        ''')
+        connection.executemany("INSERT INTO INVENTORY (name, description, quantity, price, owner_id) "
+                               "VALUES (?, 'shared shelf', ?, 1.0, ?)", [('a', 1, 1), ('b', 2, 2), ('gone', 0, 1)])
+        connection.execute("DELETE FROM INVENTORY WHERE name = 'gone'")
+    connection.close()
+    close_pools(app)
+    monkeypatch.setitem(app.config, 'DATABASE', str(path))
+    init_database(app)
+    init_database(app)
+    assert query('SELECT item_id, name, quantity, owner_id FROM INVENTORY ORDER BY item_id') == \
+        [(1, 'a', 1, 1), (2, 'b', 2, 2)]
+    assert query("SELECT seq FROM sqlite_sequence WHERE name = 'INVENTORY'") == [(3,)]
+    with app.app_context():
+        connection = get_db()
+        with connection:
+            connection.execute("INSERT INTO INVENTORY (name, description, quantity, price, owner_id) "
+                               "VALUES ('a', 'same name, other store', 5, 1.0, 2)")
+        with pytest.raises(sqlite3.IntegrityError):
+            connection.execute("INSERT INTO INVENTORY (name, description, quantity, price, owner_id) "
+                               "VALUES ('a', 'duplicate', 5, 1.0, 2)")
+    # Indexes, triggers and the search view are back
+    assert query("SELECT item_id FROM INVENTORY WHERE name = 'a' AND owner_id = 2") == [(4,)]
+    assert query("SELECT 1 FROM sqlite_master WHERE name = 'idx_inventory_owner_name'") == [(1,)]
+    assert query("SELECT rowid FROM INVENTORY_FTS WHERE INVENTORY_FTS MATCH 'shelf' ORDER BY rowid") == [(1,), (2,)]
+    assert query("SELECT owner_id, item_count, units FROM STORE_SUMMARY ORDER BY owner_id") == \
+        [(1, 1, 1), (2, 2, 7)]
+
+
+def split(app, tmp_path):
+    catalog, shard_dir = tmp_path / 'catalog.db', tmp_path / 'shards'
+    result = app.test_cli_runner().invoke(args=['split-database', str(catalog), str(shard_dir)])
+    assert result.exit_code == 0, result.output
+    return catalog, shard_dir
+
+
+@pytest.fixture
+def sharded(app, client, other_client, tmp_path, monkeypatch):
+    """
+    Serve the 'owner' and 'other' stores from per-store databases, 'other' holding one item named item1
+    """
+    add_item(other_client, 'item1', quantity=9)
+    catalog, shard_dir = split(app, tmp_path)
+    close_pools(app)
+    app.extensions['user_cache'].clear()
+    monkeypatch.setitem(app.config, 'DATABASE', str(catalog))
+    monkeypatch.setitem(app.config, 'SHARD_DIR', str(shard_dir))
+    init_database(app)
+    return shard_dir
+
+
+def shard_rows(shard_dir, owner_id, sql):
+    with sqlite3.connect(shard_path(shard_dir, owner_id)) as connection:
+        rows = connection.execute(sql).fetchall()
+    connection.close()
+    return rows
+
+
+def test_split_copies_each_store_into_its_own_database(app, sharded):
+    assert shard_owners(sharded) == [1, 2]
+    with app.app_context():
+        catalog = get_catalog_db()
+        assert [tuple(row) for row in catalog.execute('SELECT user_id, username FROM USERS ORDER BY user_id')] == \
+            [(1, 'owner'), (2, 'other')]
+        assert catalog.execute('SELECT count(*) FROM INVENTORY').fetchone()[0] == 0
+    assert shard_rows(sharded, 1, 'SELECT name, quantity FROM INVENTORY ORDER BY item_id') == \
+        [(f'item{index}', index) for index in range(5)]
+    assert shard_rows(sharded, 2, 'SELECT item_id, name, quantity FROM INVENTORY') == [(6, 'item1', 9)]
+    assert shard_rows(sharded, 2, 'SELECT item_id, quantity FROM STOCK_LEDGER') == [(6, 9)]
+    assert shard_rows(sharded, 2, 'SELECT item_count, units FROM STORE_SUMMARY') == [(1, 9)]
+
+
+def test_requests_are_served_from_the_users_store(sharded, client, other_client):
+    assert b'item4' in client.get('/inventory').get_data()
+    page = other_client.get('/inventory').get_data()
+    assert b'item1' in page and b'item4' not in page
+    add_item(other_client, 'new')
+    assert client.post('/edit/item1', data={'quantity': '3'}).status_code == 302
+    assert shard_rows(sharded, 2, "SELECT name, quantity FROM INVENTORY ORDER BY item_id") == \
+        [('item1', 9), ('new', 1)]
+    assert shard_rows(sharded, 1, "SELECT quantity FROM INVENTORY WHERE name = 'item1'") == [(3,)]
+    response = other_client.get('/search?q=item', headers={'Accept': 'application/json'})
+    assert [item['name'] for item in response.get_json()['items']] == ['item1']
+
+
+def test_new_stores_get_a_database_on_first_use(app, sharded):
+    newcomer = app.test_client()
+    newcomer.post('/register', data={'username': 'new', 'user_password': 'pw', 'store_name': 'New'})
+    newcomer.post('/login', data={'username': 'new', 'user_password': 'pw'})
+    add_item(newcomer, 'first')
+    assert shard_owners(sharded) == [1, 2, 3]
+    assert shard_rows(sharded, 3, 'SELECT name, owner_id FROM INVENTORY') == [('first', 3)]
+
+
+def test_maintenance_commands_visit_every_store(app, sharded):
+    runner = app.test_cli_runner()
+    assert 'Summarised 2 stores' in runner.invoke(args=['rebuild-summary']).output
+    assert runner.invoke(args=['verify-summary']).exit_code == 0
+    assert runner.invoke(args=['split-database', 'again.db', 'again']).exit_code != 0
+
+
+def test_split_refuses_to_overwrite(app, client, tmp_path):
+    catalog, shard_dir = split(app, tmp_path)
+    result = app.test_cli_runner().invoke(args=['split-database', str(catalog), str(shard_dir)])
+    assert result.exit_code != 0 and 'already exists' in result.output
+
+
+def test_store_connection_needs_an_owner_outside_requests(app, sharded):
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            get_db()
+        assert get_db(2).execute('SELECT count(*) FROM INVENTORY').fetchone()[0] == 1
@@ -0,0 +1,74 @@
+import pytest
+from inventory.importer import parse_integer
+
+
+def adjust(client, *adjustments):
+    return client.post('/stock/adjust', json={'adjustments': list(adjustments)})
+
+
+def test_batch_is_applied(client, query):
+    response = adjust(client, {'item_id': 2, 'delta': 5}, {'item_id': 3, 'count': 0}, {'item_id': 2, 'delta': -1})
+    assert response.status_code == 200
+    assert response.get_json()['items'] == [{'item_id': 2, 'quantity': 5}, {'item_id': 3, 'quantity': 0}]
+    assert query('SELECT item_id, quantity FROM INVENTORY WHERE item_id IN (2, 3) ORDER BY item_id') == [(2, 5), (3, 0)]
+
+
+def test_bare_list_is_accepted(client, query):
+    response = client.post('/stock/adjust', json=[{'item_id': '5', 'count': '9'}])
+    assert response.get_json()['items'] == [{'item_id': 5, 'quantity': 9}]
+
+
+def test_delta_below_zero_rolls_back_the_batch(client, query):
+    response = adjust(client, {'item_id': 2, 'delta': 5}, {'item_id': 4, 'delta': -10})
+    assert response.status_code == 400
+    assert "'item3' (item 4)" in response.get_json()['error']
+    assert query('SELECT item_id, quantity FROM INVENTORY WHERE item_id IN (2, 4) ORDER BY item_id') == [(2, 1), (4, 3)]
+
+
+@pytest.mark.parametrize('adjustment', [
+    {'item_id': 2, 'delta': 10 ** 20},
+    {'item_id': 2, 'delta': 2 ** 63 - 1},
+    {'item_id': 2, 'count': -1},
+    {'item_id': 2, 'count': 1, 'delta': 1},
+    {'item_id': 2, 'delta': 'lots'},
+    {'item_id': 2, 'delta': True},
+    {'item_id': 2, 'delta': 1.5},
+    {'delta': 1},
+])
+def test_invalid_adjustments(client, query, adjustment):
+    assert adjust(client, adjustment).status_code == 400
+    assert query('SELECT quantity FROM INVENTORY WHERE item_id = 2') == [(1,)]
+
+
+def test_empty_batch(client):
+    assert adjust(client).status_code == 400
+
+
+def test_other_stores_items_are_not_found(client, other_client, query):
+    response = adjust(other_client, {'item_id': 2, 'count': 100})
+    assert response.status_code == 404
+    assert response.get_json()['item_ids'] == [2]
+    assert query('SELECT quantity FROM INVENTORY WHERE item_id = 2') == [(1,)]
+
+
+def test_out_of_stock_after_adjustment(client):
+    adjust(client, {'item_id': 3, 'delta': -2})
+    assert 'item2' in client.get('/low-stock').get_data(as_text=True)
+
+
+def test_count_form(client, query):
+    page = client.get('/stock/adjust?limit=2')
+    assert page.status_code == 200
+    assert 'item1' in page.get_data(as_text=True)
+    response = client.post('/stock/adjust?limit=2', data={'item_id': ['1', '2'], 'mode': ['count', 'delta'],
+                                                          'value': ['7', '-1']})
+    assert response.status_code == 302
+    assert query('SELECT quantity FROM INVENTORY WHERE item_id IN (1, 2) ORDER BY item_id') == [(7,), (0,)]
+
+
+def test_parse_integer_labels_errors():
+    assert parse_integer('12', 'count', 'adjustment 0') == 12
+    with pytest.raises(ValueError, match='^adjustment 3: delta must be an integer$'):
+        parse_integer(2.0, 'delta', 'adjustment 3')
+    with pytest.raises(ValueError, match='^item 1: item_id .* is out of range$'):
+        parse_integer(2 ** 64, 'item_id', 'item 1')
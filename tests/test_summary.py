@@ -0,0 +1,50 @@
+import io
+from inventory import init_database
+from inventory.db import get_db
+from inventory.summary import get_summary, verify_summary
+
+
+def summary(app, owner_id=1):
+    with app.app_context():
+        return get_summary(get_db(), owner_id)
+
+
+def test_summary_of_the_fixture_store(app, client):
+    assert summary(app) == {'item_count': 5, 'units': 10, 'stock_value': 15.0, 'low_count': 5, 'out_count': 1}
+    assert summary(app, 99) == {'item_count': 0, 'units': 0, 'stock_value': 0.0, 'low_count': 0, 'out_count': 0}
+    page = client.get('/home').get_data(as_text=True)
+    assert '15.00' in page
+
+
+def test_triggers_follow_every_write_path(app, client, other_client):
+    client.post('/stock/adjust', json={'adjustments': [{'item_id': 1, 'delta': 20}, {'item_id': 2, 'count': 0}]})
+    client.post('/edit/item3', data={'quantity': '3', 'reorder_threshold': '1'})
+    client.post('/delete', data={'deleteItem': '5'})
+    client.post('/import', data={'file': (io.BytesIO(b'name,description,quantity,price\nitem4,back,2,0.10\n'
+                                                      b'new,x,1,0.333\n'), 'items.csv')})
+    other_client.post('/add', data={'name': 'theirs', 'description': 'x', 'quantity': '7', 'price': '2'})
+    assert summary(app) == {'item_count': 6, 'units': 28, 'stock_value': 38.03, 'low_count': 4, 'out_count': 1}
+    assert summary(app, 2)['units'] == 7
+    with app.app_context():
+        assert verify_summary(get_db()) == {}
+
+
+def test_verify_and_rebuild_commands(app, client):
+    with app.app_context():
+        connection = get_db()
+        with connection:
+            connection.execute('UPDATE STORE_SUMMARY SET units = units + 1 WHERE owner_id = 1')
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['verify-summary'])
+    assert result.exit_code != 0
+    assert '1 store summaries are out of date' in result.output
+    assert runner.invoke(args=['rebuild-summary']).exit_code == 0
+    assert runner.invoke(args=['verify-summary']).exit_code == 0
+    assert summary(app)['units'] == 10
+
+
+def test_existing_stores_are_summarised_on_first_run(app, client):
+    with app.app_context():
+        get_db().executescript('DROP TABLE STORE_SUMMARY')
+    init_database(app)
+    assert summary(app)['item_count'] == 5
@@ -0,0 +1,66 @@
+import io
+import os
+from conftest import add_item, make_jpeg
+from inventory.db import get_db
+from inventory.images import image_hash, put_image_stream, scan_upload
+
+
+def post_item(client, name, image):
+    return client.post('/add', data={'name': name, 'description': 'x', 'quantity': '1', 'price': '1',
+                                     'image': (io.BytesIO(image), 'upload.jpg')}, content_type='multipart/form-data')
+
+
+def test_uploads_are_stored_without_temporary_files(client, query, tmp_path):
+    image = make_jpeg(size=(400, 300))
+    add_item(client, 'pictured', image)
+    assert client.get('/items/6/image').get_data() == image
+    assert query('SELECT hash, mime, size FROM IMAGES') == [(image_hash(image), 'image/jpeg', len(image))]
+    assert not os.path.exists(tmp_path / 'temp')
+
+
+def test_uploads_over_the_memory_limit_spill_to_disk(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_MEMORY_LIMIT', 1024)
+    image = make_jpeg(size=(400, 300))
+    add_item(client, 'pictured', image)
+    assert client.get('/items/6/image').get_data() == image
+
+
+def test_oversized_uploads_are_refused(app, client, query, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 4096)
+    response = post_item(client, 'huge', make_jpeg(size=(400, 300)) + bytes(8192))
+    assert response.status_code == 413
+    assert b'0.00390625 MB limit' in response.get_data()
+    assert query("SELECT count(*) FROM INVENTORY WHERE name = 'huge'") == [(0,)]
+
+
+def test_imports_have_their_own_limit(app, client, query, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024)
+    rows = ''.join(f'bulk{index},{"x" * 40},1,1\n' for index in range(50))
+    data = {'file': (io.BytesIO(f'name,description,quantity,price\n{rows}'.encode()), 'items.csv')}
+    response = client.post('/import', data=data, headers={'Accept': 'application/json'})
+    assert response.status_code == 200 and response.get_json()['imported'] == 50
+    monkeypatch.setitem(app.config, 'IMPORT_MAX_CONTENT_LENGTH', 1024)
+    data = {'file': (io.BytesIO(f'name,description,quantity,price\n{rows}'.encode()), 'items.csv')}
+    assert client.post('/import', data=data).status_code == 413
+
+
+def test_non_images_are_refused(client, query):
+    response = post_item(client, 'text', b'just some text, not a picture')
+    assert response.status_code == 400
+    assert query("SELECT count(*) FROM INVENTORY WHERE name = 'text'") == [(0,)]
+    assert query('SELECT count(*) FROM IMAGES') == [(0,)]
+
+
+def test_stream_is_copied_in_chunks_and_stored_once(app, monkeypatch):
+    monkeypatch.setattr('inventory.images.UPLOAD_CHUNK_SIZE', 100)
+    image = make_jpeg(size=(200, 150))
+    stream = io.BytesIO(image)
+    scan = scan_upload(stream)
+    assert scan == (image_hash(image), len(image), 'image/jpeg')
+    with app.app_context():
+        connection = get_db()
+        with connection:
+            assert put_image_stream(connection, stream, scan) == image_hash(image)
+            assert put_image_stream(connection, stream, scan) == image_hash(image)
+        assert connection.execute('SELECT data FROM IMAGES').fetchall()[0][0] == image
+        assert connection.execute('SELECT count(*) FROM IMAGES').fetchone()[0] == 1